@@ -60,6 +60,9 @@ def main():
     general_group.add_argument('--run_pipeline', action='store_const',
                                const=True)
     general_group.add_argument('--debug', action='store_true')
+    general_group.add_argument('--analysis_workers', type=int,
+                               help='Analyze the steps in this many processes'
+                                    ' (0 to use all the CPUs)')
 
     metadata_group = parser.add_argument_group('Notebook Metadata Overrides',
                                                METADATA_GROUP_DESC)
@@ -93,7 +96,8 @@ def main():
                                for a in mt_overrides_group._group_actions
                                if getattr(args, a.dest, None) is not None}
     print(f"mt_overrides_group_dict: {mt_overrides_group_dict}")
-    processor = NotebookProcessor(args.nb, mt_overrides_group_dict)
+    processor = NotebookProcessor(args.nb, mt_overrides_group_dict,
+                                  analysis_workers=args.analysis_workers)
     pipeline = processor.run()
     imports_and_functions = processor.get_imports_and_functions()
     dsl_script_path = Compiler(pipeline, imports_and_functions).compile()
@@ -207,6 +207,109 @@ def get_function_calls(code):
     return fns
 
 
+def _get_subscript_columns(node):
+    """Get the column names selected by a subscript like `x["a"]`.
+
+    Returns None when the subscript is not a selection of constant string
+    keys, i.e. `x["a"]` or `x[["a", "b"]]`.
+    """
+    key = node.slice
+    if isinstance(key, ast.Constant) and isinstance(key.value, str):
+        return [key.value]
+    if (isinstance(key, ast.List) and key.elts
+            and all(isinstance(e, ast.Constant) and isinstance(e.value, str)
+                    for e in key.elts)):
+        return [e.value for e in key.elts]
+    return None
+
+
+def get_column_projections(code, names):
+    """Get the columns that the input code reads from some variables.
+
+    A variable can be projected onto a subset of its columns when *all* its
+    usages in the code are subscripts with constant string keys, like:
+
+    ```
+    df["a"].mean()
+    df[["b", "c"]].plot()
+    ```
+
+    Any other usage (e.g. `df.head()`, `df[col]`, `df["a"] = 1`, `f(df)`,
+    `df = ...`) means that the code might need the whole object. So does
+    any mention of the variable that the AST does not show, i.e. in magic
+    commands or in the code passed to `eval` and `exec`.
+
+    Args:
+        code (str): Multiline string representing Python code
+        names (Iterable[str]): Names of the variables to analyze
+
+    Returns (dict): A dictionary [name] -> sorted list of column names, just
+        for the variables that can be projected.
+    """
+    names = set(names)
+    columns = {name: set() for name in names}
+    # Name nodes that are the value of a column selection
+    selections = set()
+    tree = ast.parse(utils.comment_magic_commands(code))
+    for node in walk(tree):
+        if (isinstance(node, ast.Subscript)
+                and isinstance(node.ctx, ast.Load)
+                and isinstance(node.value, ast.Name)
+                and node.value.id in names):
+            cols = _get_subscript_columns(node)
+            if cols is not None:
+                selections.add(node.value)
+                columns[node.value.id].update(cols)
+    for node in walk(tree):
+        if isinstance(node, ast.Name):
+            bound = [] if node in selections else [node.id]
+        # other nodes binding names, e.g. `def df():`, `import df`
+        elif isinstance(node, (ast.FunctionDef, ast.AsyncFunctionDef,
+                               ast.ClassDef, ast.ExceptHandler)):
+            bound = [node.name]
+        elif isinstance(node, (ast.Global, ast.Nonlocal)):
+            bound = node.names
+        elif isinstance(node, ast.alias):
+            bound = [node.asname or node.name]
+        elif isinstance(node, ast.arg):
+            bound = [node.arg]
+        else:
+            continue
+        for name in bound:
+            columns.pop(name, None)
+    for source in _get_unparsed_sources(code, tree):
+        if source is None:
+            return {}
+        for name in list(columns):
+            if re.search(r"\b%s\b" % re.escape(name), source):
+                columns.pop(name)
+    return {name: sorted(cols) for name, cols in columns.items() if cols}
+
+
+def _get_unparsed_sources(code, tree):
+    """Get the pieces of code that run without being part of the AST.
+
+    These are the magic commands of the code and the strings passed to
+    `eval` and `exec`. Yields None for code that is not known statically,
+    e.g. `exec(source)`.
+    """
+    magic_pattern = re.compile(r'^\s*%%?.*$', re.MULTILINE)
+    yield from magic_pattern.findall(code)
+    for node in walk(tree):
+        if (isinstance(node, ast.Call)
+                and isinstance(node.func, ast.Name)
+                and node.func.id in ("eval", "exec")):
+            if not node.args:
+                continue
+            source = node.args[0]
+            if (isinstance(source, ast.Constant)
+                    and isinstance(source.value, (str, bytes))):
+                yield (source.value if isinstance(source.value, str)
+                       else source.value.decode(errors="replace"))
+            else:
+                yield None
+
+
 def get_function_and_class_names(code):
     """Get all function and class names of the code block.
 
@@ -0,0 +1,287 @@
+# Copyright 2020 The Kale Authors
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import os
+import copy
+import pickle
+import shutil
+import hashlib
+import logging
+import threading
+import collections
+
+from typing import Any, Callable, Dict, Iterable, Optional, Tuple
+from concurrent.futures import ProcessPoolExecutor
+
+from kale import marshal
+from kale.common import utils
+from kale.marshal import store
+
+log = logging.getLogger(__name__)
+
+# Persist the static analysis of notebooks to this directory, if set
+ANALYSIS_CACHE_DIR_ENV = "KALE_ANALYSIS_CACHE_DIR"
+# Bump to invalidate the analyses persisted by previous versions
+ANALYSIS_CACHE_VERSION = 1
+
+
+class StepCache:
+    """Cache the outputs of the steps of a pipeline run locally.
+
+    A step is fingerprinted by its source code, the values of the pipeline
+    parameters it consumes and the content of its marshalled inputs. When a
+    step with the same fingerprint ran before, its outputs are restored from
+    the cache instead of running it again.
+
+    Every entry of the cache is a folder holding the marshalled outputs of a
+    step. When the cache exceeds `max_size` bytes, the least recently used
+    entries are evicted.
+
+    NOTE: The source code of the functions called by a step is not part of
+    its fingerprint.
+    """
+
+    def __init__(self, cache_dir: str, max_size: int = None):
+        self.cache_dir = cache_dir
+        self.max_size = max_size
+
+    def get_key(self, step, parameters: Dict[str, Any]) -> Optional[str]:
+        """Fingerprint a step about to run in the current marshal data dir.
+
+        Args:
+            step: The step
+            parameters: The pipeline parameters consumed by the step
+
+        Returns: the step's fingerprint, None if some input is missing
+        """
+        h = hashlib.sha256()
+        h.update(step.rendered_source.encode())
+        h.update(repr((sorted(step.ins), sorted(step.outs))).encode())
+        for name in sorted(parameters):
+            h.update(repr((name, parameters[name])).encode())
+        for name in sorted(step.ins):
+            if name in parameters:
+                continue
+            try:
+                path = marshal.locate(name)
+            except ValueError as e:
+                log.info("Not caching step '%s': %s", step.name, e)
+                return None
+            h.update(("%s:%s" % (os.path.basename(path),
+                                 store.compute_digest(path))).encode())
+        return h.hexdigest()
+
+    def restore(self, key: str) -> bool:
+        """Restore the outputs of a cached step to the marshal data dir.
+
+        Returns: True if the step was found in the cache
+        """
+        entry_dir = os.path.join(self.cache_dir, key)
+        if not os.path.isdir(entry_dir):
+            return False
+        for entry_name in os.listdir(entry_dir):
+            marshal.add_entry(os.path.join(entry_dir, entry_name))
+        # mark the entry as recently used
+        os.utime(entry_dir)
+        return True
+
+    def save(self, key: str, step):
+        """Cache the outputs of a step that has just run.
+
+        Args:
+            key: The fingerprint of the step, see `get_key`
+            step: The step
+        """
+        entry_dir = os.path.join(self.cache_dir, key)
+        if os.path.isdir(entry_dir):
+            return
+        # Build the entry aside, so that interrupted runs don't leave
+        # incomplete entries behind
+        tmp_dir = "%s.tmp-%s" % (entry_dir, utils.random_string())
+        os.makedirs(tmp_dir)
+        try:
+            for name in step.outs:
+                path = marshal.locate(name)
+                store.copy(path, os.path.join(tmp_dir,
+                                              os.path.basename(path)))
+            os.replace(tmp_dir, entry_dir)
+        except OSError:
+            if not os.path.isdir(entry_dir):
+                raise
+            # cached by another run in the meantime
+        finally:
+            if os.path.isdir(tmp_dir):
+                shutil.rmtree(tmp_dir)
+        log.info("Cached the outputs of step '%s'", step.name)
+        self.evict()
+
+    def evict(self):
+        """Remove the least recently used entries exceeding `max_size`."""
+        if self.max_size is None:
+            return
+        entries = []
+        with os.scandir(self.cache_dir) as it:
+            for entry in it:
+                if entry.is_dir() and ".tmp-" not in entry.name:
+                    entries.append((entry.stat().st_mtime, entry.path,
+                                    store.get_size(entry.path)))
+        total_size = sum(size for _, _, size in entries)
+        for _, path, size in sorted(entries):
+            if total_size <= self.max_size:
+                break
+            log.info("Evicting step cache entry %s", path)
+            shutil.rmtree(path)
+            total_size -= size
+
+
+class AnalysisCache:
+    """Memoize the static analysis of source code, keyed by its hash.
+
+    Compiling or validating a notebook analyzes the source of every cell and
+    step, even though only a few of them change between two requests. The
+    results are kept in memory, evicting the least recently used ones, and
+    optionally persisted to `cache_dir`.
+
+    Results are copied on the way in and out, so that callers can modify
+    them.
+    """
+
+    def __init__(self, max_size: int = 4096, cache_dir: str = None):
+        self.max_size = max_size
+        self.cache_dir = cache_dir
+        self._results = collections.OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, kind: str, code: str, analyze: Callable[[str], Any]) -> Any:
+        """Get the result of analyzing some code, analyzing it if needed.
+
+        Args:
+            kind: The kind of analysis, e.g. "pyflakes"
+            code: Python source code
+            analyze: Function analyzing the code. Exceptions are not cached.
+
+        Returns: the result of `analyze(code)`
+        """
+        key = self._get_key(kind, code)
+        with self._lock:
+            if key in self._results:
+                self._results.move_to_end(key)
+                return copy.deepcopy(self._results[key])
+        result = self._read(key)
+        if result is None:
+            result = analyze(code)
+            self._write(key, result)
+        self._keep(key, result)
+        return result
+
+    def prefetch(self, analyses: Iterable[Tuple[str, str, Callable]],
+                 max_workers: Optional[int] = None):
+        """Run analyses in parallel processes, ahead of `get`.
+
+        Only the analyses missing from the cache run. Failed analyses are not
+        cached, so that `get` raises their exceptions again.
+
+        Args:
+            analyses: (kind, code, analyze) tuples, see `get`. `analyze` must
+                be picklable, e.g. a module-level function.
+            max_workers: The number of processes. Defaults to the number of
+                CPUs.
+        """
+        pending = dict()
+        for kind, code, analyze in analyses:
+            key = self._get_key(kind, code)
+            with self._lock:
+                if key in self._results or key in pending:
+                    continue
+            result = self._read(key)
+            if result is None:
+                pending[key] = (analyze, code)
+            else:
+                self._keep(key, result)
+        if not pending:
+            return
+        max_workers = max_workers or os.cpu_count() or 1
+        log.info("Running %d static analyses in %d processes", len(pending),
+                 max_workers)
+        with ProcessPoolExecutor(max_workers=max_workers) as executor:
+            # Analyses are small, send them in batches
+            chunksize = max(1, len(pending) // (max_workers * 4))
+            results = executor.map(_run_analysis, pending.values(),
+                                   chunksize=chunksize)
+            for key, (ok, result) in zip(pending, results):
+                if ok:
+                    self._write(key, result)
+                    self._keep(key, result)
+
+    @staticmethod
+    def _get_key(kind: str, code: str) -> str:
+        return hashlib.sha256(("%d\0%s\0%s" % (
+            ANALYSIS_CACHE_VERSION, kind, code)).encode()).hexdigest()
+
+    def _keep(self, key: str, result: Any):
+        with self._lock:
+            self._results[key] = copy.deepcopy(result)
+            self._results.move_to_end(key)
+            while len(self._results) > self.max_size:
+                self._results.popitem(last=False)
+
+    def clear(self):
+        """Drop the results kept in memory."""
+        with self._lock:
+            self._results.clear()
+
+    def _read(self, key: str) -> Any:
+        if not self.cache_dir:
+            return None
+        try:
+            with open(os.path.join(self.cache_dir, key), "rb") as f:
+                return pickle.load(f)
+        except FileNotFoundError:
+            return None
+        except Exception as e:
+            log.debug("Could not read cached analysis %s: %s", key, e)
+            return None
+
+    def _write(self, key: str, result: Any):
+        if not self.cache_dir:
+            return
+        path = os.path.join(self.cache_dir, key)
+        tmp_path = "%s.tmp-%s" % (path, utils.random_string())
+        try:
+            os.makedirs(self.cache_dir, exist_ok=True)
+            with open(tmp_path, "wb") as f:
+                pickle.dump(result, f)
+            os.replace(tmp_path, path)
+        except OSError as e:
+            log.debug("Could not persist analysis %s: %s", key, e)
+
+
+def _run_analysis(analysis: Tuple[Callable, str]) -> Tuple[bool, Any]:
+    analyze, code = analysis
+    try:
+        return True, analyze(code)
+    except Exception:
+        return False, None
+
+
+_analysis_cache = None
+
+
+def get_analysis_cache() -> AnalysisCache:
+    """Get the process-wide cache of the static analysis of notebooks."""
+    global _analysis_cache
+    if _analysis_cache is None:
+        _analysis_cache = AnalysisCache(
+            cache_dir=os.environ.get(ANALYSIS_CACHE_DIR_ENV))
+    return _analysis_cache
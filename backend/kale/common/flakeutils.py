@@ -12,29 +12,9 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
-import re
+import ast
 
-from pyflakes import reporter as pyflakes_reporter, api as pyflakes_api
-
-
-class StreamList:
-    """Simulate a file object to store Flakes' report streams."""
-
-    def __init__(self):
-        self.out = list()
-
-    def write(self, text):
-        """Write to stream list."""
-        self.out.append(text)
-
-    def reset(self):
-        """Clean the stream list."""
-        self.out = list()
-        return self
-
-    def __call__(self):
-        """Return the stream list."""
-        return self.out
+from pyflakes import checker as flakes_checker, messages as flakes_messages
 
 
 def pyflakes_report(code):
@@ -43,31 +23,14 @@ def pyflakes_report(code):
     Args:
         code: A multiline string representing Python code
 
-    Returns: a list of names that have been reported missing by Flakes
+    Returns: a set of names that have been reported missing by Flakes
     """
-    flakes_stdout = StreamList()
-    flakes_stderr = StreamList()
-    rep = pyflakes_reporter.Reporter(
-        flakes_stdout.reset(),
-        flakes_stderr.reset())
-    pyflakes_api.check(code, filename="kale", reporter=rep)
-
-    # the stderr stream should be used just for compilation error, so if any
-    # message is found in the stderr stream, raise an exception
-    if rep._stderr():
+    try:
+        tree = ast.parse(code, filename="kale")
+    except (SyntaxError, ValueError) as e:
         raise RuntimeError("Flakes reported the following error:"
-                           "\n{}".format('\t' + '\t'.join(rep._stderr())))
-
-    # Match names
-    p = r"'(.+?)'"
-
-    out = rep._stdout()
-    # Using a `set` to avoid repeating the same var names in case they are
-    # reported missing multiple times by flakes
-    undef_vars = set()
-    # iterate over all the flakes report output, keeping only lines
-    # with 'undefined name' reports
-    for line in filter(lambda a: a != '\n' and 'undefined name' in a, out):
-        var_search = re.search(p, line)
-        undef_vars.add(var_search.group(1))
-    return undef_vars
+                           "\n\t{}".format(e))
+    checker = flakes_checker.Checker(tree, filename="kale")
+    return {message.message_args[0] for message in checker.messages
+            if isinstance(message, (flakes_messages.UndefinedName,
+                                    flakes_messages.UndefinedExport))}
@@ -14,6 +14,9 @@
 
 import networkx as nx
 
+from collections import defaultdict, deque
+from typing import Dict, Iterable, Iterator, Optional
+
 
 def get_ordered_ancestors(g: nx.DiGraph, node):
     """Get a list of ancestors ordered by DAG layers.
@@ -58,20 +61,96 @@ def get_ordered_ancestors(g: nx.DiGraph, node):
 
     Returns (list): A list of ancestors, ordered by DAG layers.
     """
-    # list of ancestors, unique and ordered by layers
-    ancs = list()
-    # used as queue
-    q = [node]
+    return list(iter_ordered_ancestors(g, node))
+
+
+def iter_ordered_ancestors(g: nx.DiGraph, node) -> Iterator[str]:
+    """Iterate over the ancestors of a node, ordered by DAG layers.
 
+    Ancestors are visited lazily, so that callers that stop early don't
+    traverse the whole graph. See `get_ordered_ancestors`.
+    """
+    visited = {node}
+    q = deque([node])
     while q:
-        cur = q.pop(0)
+        cur = q.popleft()
         # sort ancestors for a deterministic result
-        preds = sorted(list(g.predecessors(cur)))
-        for p in preds:
-            if p not in ancs:
-                ancs.append(p)
+        for p in sorted(g.predecessors(cur)):
+            if p not in visited:
+                visited.add(p)
                 q.append(p)
-    return ancs
+                yield p
+
+
+class AncestorIndex:
+    """Index the ancestors of the nodes of a DAG and the names they provide.
+
+    Sets of nodes are bitsets: every node gets a bit, following the
+    topological order, and the ancestors of a node are the union of its
+    predecessors and their ancestors. This way, checking whether a node is
+    an ancestor of another one, or finding which ancestors provide some
+    names, takes a few integer operations, no matter the size of the graph.
+
+    Names are grouped by kind, e.g. the variables or the functions that
+    nodes define.
+    """
+
+    def __init__(self, g: nx.DiGraph):
+        self.graph = g
+        self.nodes = list(nx.topological_sort(g))
+        self.bits: Dict[str, int] = {n: 1 << i
+                                     for i, n in enumerate(self.nodes)}
+        self.ancestors: Dict[str, int] = dict()
+        for n in self.nodes:
+            ancestors = 0
+            for p in g.predecessors(n):
+                ancestors |= self.ancestors[p] | self.bits[p]
+            self.ancestors[n] = ancestors
+        # kind -> name -> the nodes providing the name
+        self._names = defaultdict(lambda: defaultdict(int))
+
+    def add_names(self, node, names: Iterable[str], kind: str):
+        """Record the names of some kind that a node provides."""
+        bit = self.bits[node]
+        providers = self._names[kind]
+        for name in names:
+            providers[name] |= bit
+
+    def get_providers(self, names: Iterable[str], kind: str) -> int:
+        """Get the nodes providing any of the names, as a bitset."""
+        providers = self._names[kind]
+        mask = 0
+        for name in names:
+            mask |= providers.get(name, 0)
+        return mask
+
+    def iter_ancestors(self, node, mask: Optional[int] = None
+                       ) -> Iterator[str]:
+        """Iterate over the ancestors of a node, ordered by DAG layers.
+
+        Args:
+            node: The name of the node
+            mask: Only the ancestors in this bitset. The traversal stops as
+                soon as all of them have been found.
+        """
+        remaining = self.ancestors[node]
+        if mask is not None:
+            remaining &= mask
+        if not remaining:
+            return
+        for anc in iter_ordered_ancestors(self.graph, node):
+            bit = self.bits[anc]
+            if remaining & bit:
+                yield anc
+                remaining &= ~bit
+                if not remaining:
+                    return
+
+    def get_nearest_provider(self, node, name: str,
+                             kind: str) -> Optional[str]:
+        """Get the first ancestor of a node providing a name, if any."""
+        return next(self.iter_ancestors(
+            node, self.get_providers([name], kind)), None)
 
 
 def get_leaf_nodes(g: nx.DiGraph):
@@ -16,24 +16,37 @@ import os
 import re
 import sys
 import time
+import atexit
 import json
-import signal
+import base64
 import logging
 import nbformat
 import requests
-import threading
 import ipykernel
 
-from queue import Empty
+from collections import deque
 from jupyter_server import serverapp
+from jupyter_core.utils import run_sync
+from jupyter_client.manager import AsyncKernelManager
 from jupyter_client.kernelspec import get_kernel_spec
 from kale.common.utils import remove_ansi_color_sequences
+from nbclient.exceptions import CellExecutionError, DeadKernelError
 from nbconvert.preprocessors.execute import ExecutePreprocessor
 
 from packaging import version as pkg_version
 
 log = logging.getLogger(__name__)
 
+# Engines running the code of notebook steps
+KERNEL_ENGINE = "kernel"
+IN_PROCESS_ENGINE = "inprocess"
+RUN_CODE_ENGINES = (KERNEL_ENGINE, IN_PROCESS_ENGINE)
+RUN_CODE_ENGINE_ENV = "KALE_RUN_CODE_ENGINE"
+# Kernels started in advance by the pools that `run_code` shares, once the
+# process has run code before
+KERNEL_POOL_SIZE_ENV = "KALE_KERNEL_POOL_SIZE"
+DEFAULT_KERNEL_POOL_SIZE = 1
+
 HTML_TEMPLATE = '''
 <html><head>
     <style>
@@ -76,6 +89,13 @@ IMAGE_HTML_TEMPLATE = '''
 </div>
 '''
 
+IMAGE_FILE_HTML_TEMPLATE = '''
+<div>
+  <p>{}</p>
+  <img src="{}" />
+</div>
+'''
+
 TEXT_HTML_TEMPLATE = '''
 <div style="margin:10px 0;">
 <pre>
@@ -102,9 +122,25 @@ JAVASCRIPT_HTML_TEMPLATE = '''
 </script>
 '''
 
+TRUNCATED_STREAMS_HTML_TEMPLATE = '''
+<div style="margin:10px 0;">
+<p><i>The stream outputs exceeded {} characters, the rest of them are not
+part of this report.</i></p>
+</div>
+'''
+
+NO_ARTIFACTS_MESSAGE = "This step did not produce any artifacts."
+
+# Characters of stream outputs written to an HTML report, at most
+MAX_STREAM_SIZE = 10 * 1024 * 1024
+# Buffered characters of a stream, before they are written to the report
+STREAM_BUFFER_SIZE = 8 * 1024
+# Seconds a stream is buffered for, before it is written to the report
+STREAM_BUFFER_TIME = 1
+
 
 class KaleKernelException(Exception):
-    """Raised when signal_handler receives a signal from capture_streams."""
+    """Raised when the user code fails to run."""
     pass
 
 
@@ -181,68 +217,541 @@ def process_outputs(cells):
                     for c in cells]
     html_outputs = '\n'.join(html_outputs).strip()
     if html_outputs == "":
-        html_outputs = "This step did not produce any artifacts."
+        html_outputs = NO_ARTIFACTS_MESSAGE
     html_artifact = HTML_TEMPLATE % html_outputs
     return html_artifact
 
 
-async def capture_streams(kc, exit_on_error=False):
-    """Capture stream and error outputs from a kernel connection.
+class HTMLReportWriter:
+    """Write the outputs of the cells of a step to an HTML report.
 
-    Get messages from the iopub channel of the `kc` kernel connection
-    and write to stdout or stderr any message of type `stream`.
-    Capture and exit when receiving an `error` message or when the message
-    queue is done.
+    Outputs are written to the report as they arrive, so the report never
+    sits in memory. Consecutive chunks of a stream are buffered for a while
+    and written as a single block. Stream outputs are capped to
+    `max_stream_size` characters in total, the rest of them are dropped.
+    When `images_dir` is set, PNG images are saved there, and the report
+    links to them instead of embedding them.
+    """
+
+    def __init__(self, path: str, max_stream_size: int = MAX_STREAM_SIZE,
+                 images_dir: str = None):
+        self.path = path
+        self.max_stream_size = max_stream_size
+        self.images_dir = images_dir
+        self._file = None
+        self._tail = None
+        self._empty = True
+        self._images = 0
+        self._stream_size = 0
+        self._streams_truncated = False
+        self._stream_name = None
+        self._stream_chunks = []
+        self._stream_buffer_size = 0
+        self._stream_buffer_time = None
+
+    def __enter__(self):
+        """Open the report."""
+        self.open()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        """Close the report."""
+        self.close()
+
+    def open(self):
+        """Create the report and write its head."""
+        head, self._tail = HTML_TEMPLATE.split("%s")
+        self._file = open(self.path, "w")
+        self._file.write(head)
+
+    def write_output(self, output):
+        """Write a cell output to the report, see `generate_html_output`."""
+        if output['output_type'] == 'stream':
+            self._write_stream(output['name'], output['text'])
+            return
+        self.flush()
+        html = ""
+        if (self.images_dir
+                and output['output_type'] in ('display_data',
+                                              'execute_result')
+                and 'image/png' in output['data']):
+            data = dict(output['data'])
+            html = IMAGE_FILE_HTML_TEMPLATE.format(
+                data.pop('text/plain', ''),
+                self._save_image(data.pop('image/png')))
+            output = dict(output, data=data)
+        self._write(html + generate_html_output([output]))
+
+    def flush(self):
+        """Write the buffered stream to the report."""
+        if not self._stream_chunks:
+            return
+        text = "".join(self._stream_chunks)
+        self._stream_chunks = []
+        self._stream_buffer_size = 0
+        self._write(generate_html_output([{'output_type': 'stream',
+                                           'name': self._stream_name,
+                                           'text': text}]))
+
+    def close(self):
+        """Write the tail of the report and close it."""
+        self.flush()
+        if self._empty:
+            self._file.write(NO_ARTIFACTS_MESSAGE)
+        self._file.write(self._tail)
+        self._file.close()
+
+    def _write(self, html):
+        if not html:
+            return
+        self._file.write(html)
+        self._file.flush()
+        self._empty = False
+
+    def _write_stream(self, name, text):
+        if self._streams_truncated:
+            return
+        if name != self._stream_name:
+            self.flush()
+            self._stream_name = name
+        if not self._stream_chunks:
+            self._stream_buffer_time = time.time()
+        room = self.max_stream_size - self._stream_size
+        if len(text) > room:
+            text = text[:room]
+            self._streams_truncated = True
+        self._stream_size += len(text)
+        self._stream_chunks.append(text)
+        self._stream_buffer_size += len(text)
+        if self._streams_truncated:
+            self.flush()
+            self._write(TRUNCATED_STREAMS_HTML_TEMPLATE.format(
+                self.max_stream_size))
+        elif (self._stream_buffer_size >= STREAM_BUFFER_SIZE
+              or (time.time() - self._stream_buffer_time
+                  >= STREAM_BUFFER_TIME)):
+            self.flush()
+
+    def _save_image(self, image):
+        """Save a base64 encoded PNG image and get its path in the report."""
+        os.makedirs(self.images_dir, exist_ok=True)
+        self._images += 1
+        path = os.path.join(self.images_dir, "image-%d.png" % self._images)
+        with open(path, "wb") as f:
+            f.write(base64.b64decode(image))
+        rel_path = os.path.relpath(
+            path, os.path.dirname(os.path.abspath(self.path)))
+        return "/".join(rel_path.split(os.sep))
+
+
+def _forward_iopub_msg(msg):
+    """Write the streams and the errors of a kernel to stdout and stderr.
 
     Args:
-        kc: kernel connection
-        exit_on_error (bool): True to call sys.exit() when the kernel sends
-            an error message.
+        msg: A message from the iopub channel of a kernel
+    """
+    msg_type = msg['header']['msg_type']
+    content = msg['content']
+    if msg_type == 'stream':  # stdout or stderr
+        if content['name'] == 'stdout':
+            sys.stdout.write(content['text'])
+            sys.stdout.flush()
+        elif content['name'] == 'stderr':
+            sys.stderr.write(content['text'])
+            sys.stderr.flush()
+        else:
+            raise NotImplementedError("stream message content name not"
+                                      " recognized: {}"
+                                      .format(content['name']))
+    if msg_type == 'error':  # error and exceptions
+        # traceback is a list of strings (jupyter protocol spec)
+        if content['ename'] == KaleGracefulExit.__name__:
+            log.error("Received a %s exception. Exiting..." %
+                      KaleGracefulExit.__name__)
+        else:
+            traceback = map(remove_ansi_color_sequences,
+                            content['traceback'])
+            sys.stderr.write('\n'.join(traceback) + '\n')
+
+
+class KernelPool:
+    """A pool of started kernels, ready to run code.
+
+    Starting a kernel takes seconds, so the pool keeps `size` kernels
+    started in advance, each one running `warmup_code` (e.g., the imports of
+    a notebook) as soon as it is up. Every kernel runs the code of a single
+    `run_code` call: the pool starts a new kernel in place of every kernel it
+    hands out, and shuts it down when it is released. This way, no state
+    leaks from one run to the next one.
+
+    Kernels run in the background while the pool is idle, so use the pool as
+    a context manager or call `shutdown` when done with it.
+    """
+
+    def __init__(self, kernel_name: str = 'python3', size: int = 1,
+                 warmup_code: str = None, startup_timeout: int = 60):
+        self.kernel_name = kernel_name
+        self.size = size
+        self.warmup_code = warmup_code
+        self.startup_timeout = startup_timeout
+        # (kernel manager, kernel client, warm up request id) tuples
+        self._kernels = deque()
+        self._fill()
+
+    def __enter__(self):
+        """Use the pool, shutting down its kernels when done."""
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        """Shut down the kernels of the pool."""
+        self.shutdown()
+
+    def _fill(self):
+        while len(self._kernels) < self.size:
+            self._kernels.append(run_sync(self._start_kernel)())
+
+    async def _start_kernel(self):
+        km = AsyncKernelManager(kernel_name=self.kernel_name)
+        # The kernel keeps starting up while the pool returns
+        await km.start_kernel()
+        kc = km.client()
+        kc.start_channels()
+        msg_id = None
+        if self.warmup_code:
+            msg_id = kc.execute(self.warmup_code, silent=True,
+                                store_history=False)
+        return km, kc, msg_id
+
+    async def _wait_for_kernel(self, km, kc, msg_id):
+        try:
+            if not msg_id:
+                await kc.wait_for_ready(timeout=self.startup_timeout)
+            # `wait_for_ready` would drop the reply of the warm up code, which
+            # tells that the kernel is ready, anyway
+            while msg_id:
+                reply = await kc.get_shell_msg(timeout=self.startup_timeout)
+                if reply['parent_header'].get('msg_id') != msg_id:
+                    continue
+                if reply['content']['status'] != 'ok':
+                    log.warning("Failed to warm up the kernel: %s",
+                                reply['content'].get('evalue'))
+                break
+        finally:
+            kc.stop_channels()
+
+    def acquire(self) -> AsyncKernelManager:
+        """Get a started kernel, ready to run code.
+
+        Returns (AsyncKernelManager): The manager of the kernel
+        """
+        if self._kernels:
+            kernel = self._kernels.popleft()
+        else:
+            kernel = run_sync(self._start_kernel)()
+        self._fill()
+        km = kernel[0]
+        try:
+            run_sync(self._wait_for_kernel)(*kernel)
+        except Exception:
+            self.release(km)
+            raise
+        return km
+
+    def release(self, km: AsyncKernelManager):
+        """Shut down a kernel of the pool, once it has run its code."""
+        run_sync(km.shutdown_kernel)()
+
+    def shutdown(self):
+        """Shut down the kernels that are waiting to be used."""
+        while self._kernels:
+            km, kc, _ = self._kernels.popleft()
+            kc.stop_channels()
+            self.release(km)
+
+
+# (process id, kernel name, warm up code) -> shared kernel pool. Forked
+# processes must not use the kernels of their parent.
+_kernel_pools = dict()
+
+
+def get_kernel_pool(kernel_name: str = 'python3',
+                    warmup_code: str = None) -> KernelPool:
+    """Get a kernel pool that the `run_code` calls of the process share.
+
+    Most processes, e.g. the steps of a KFP pipeline, run code just once,
+    so the pool starts no kernel in advance on first use. From then on, it
+    keeps `KALE_KERNEL_POOL_SIZE` kernels (default: 1) running
+    `warmup_code` while the code of the previous call runs. Setting the
+    variable applies from the first use. The kernels are shut down when
+    the process exits.
+    """
+    key = (os.getpid(), kernel_name, warmup_code)
+    size = os.environ.get(KERNEL_POOL_SIZE_ENV)
+    pool = _kernel_pools.get(key)
+    if pool is None:
+        pool = KernelPool(kernel_name, size=int(size or 0),
+                          warmup_code=warmup_code)
+        _kernel_pools[key] = pool
+    else:
+        pool.size = int(size or DEFAULT_KERNEL_POOL_SIZE)
+    return pool
+
+
+@atexit.register
+def shutdown_kernel_pools():
+    """Shut down the kernels of the pools that the process shares.
+
+    This runs when the process exits, but not in processes that exit with
+    `os._exit`, e.g., the processes that `multiprocessing` forks.
     """
-    while True:
+    for (pid, _, _), pool in list(_kernel_pools.items()):
+        if pid == os.getpid():
+            pool.shutdown()
+
+
+class _KernelExecutePreprocessor(ExecutePreprocessor):
+    """Run the cells of a notebook, handling their outputs as they arrive.
+
+    The preprocessor consumes the replies and the outputs of the kernel in a
+    single event loop, reading a message only after it is done with the
+    previous one. Streams and errors are forwarded to stdout and stderr
+    right away. When `report` is set, the outputs are written to it instead
+    of being kept in the notebook.
+    """
+
+    def __init__(self, report: HTMLReportWriter = None, **kwargs):
+        super().__init__(**kwargs)
+        self.report = report
+
+    def process_message(self, msg, cell, cell_index):
+        """Forward the streams and the errors of the kernel."""
+        _forward_iopub_msg(msg)
+        return super().process_message(msg, cell, cell_index)
+
+    def output(self, outs, msg, display_id, cell_index):
+        """Write an output of a cell to the report, if any."""
+        if self.report is None:
+            return super().output(outs, msg, display_id, cell_index)
+        out = super().output([], msg, display_id, cell_index)
+        if out is not None:
+            self.report.write_output(out)
+        return out
+
+    def _update_display_id(self, display_id, msg):
+        """Write the updates of a display to the report, if any.
+
+        The report is written as the outputs arrive, so an updated display is
+        written again, instead of replacing the one already in the report.
+        """
+        if self.report is None:
+            return super()._update_display_id(display_id, msg)
+        if (msg['header']['msg_type'] != 'update_display_data'
+                or display_id not in self._display_id_map):
+            return
+        msg = dict(msg, header=dict(msg['header'], msg_type='display_data'))
         try:
-            msg = await kc.iopub_channel.get_msg()
-        except Empty:
-            print("The Kale kernel stream watcher thread raised an Empty"
-                  " exception, exiting...")
+            out = nbformat.v4.output_from_msg(msg)
+        except ValueError:
+            log.error("Unhandled display update: %s", msg)
             return
+        self.report.write_output(out)
+
+
+class _OutputCollector:
+    """Collect the outputs of the cells run by an in-process shell.
+
+    The outputs are written to `report`, if set, instead of being kept.
+    """
+
+    def __init__(self, report: HTMLReportWriter = None):
+        self.report = report
+        # the outputs of the cell that is running
+        self.outputs = []
 
-        msg_type = msg['header']['msg_type']
-        content = msg['content']
-        if msg_type == 'stream':  # stdout or stderr
-            if content['name'] == 'stdout':
-                sys.stdout.write(content['text'])
-            elif content['name'] == 'stderr':
-                sys.stderr.write(content['text'])
-            else:
-                raise NotImplementedError("stream message content name not"
-                                          " recognized: {}"
-                                          .format(content['name']))
-        if msg_type == 'error':  # error and exceptions
-            # traceback is a list of strings (jupyter protocol spec)
-            if content['ename'] == KaleGracefulExit.__name__:
+    def add(self, output):
+        """Add an output of the running cell."""
+        if self.report:
+            self.report.write_output(output)
+        else:
+            self.outputs.append(output)
+
+    def add_stream(self, name, text):
+        """Add a stream output, extending the last one if it's the same."""
+        if self.report:
+            self.report.write_output(nbformat.v4.new_output(
+                'stream', name=name, text=text))
+        elif (self.outputs and self.outputs[-1]['output_type'] == 'stream'
+                and self.outputs[-1]['name'] == name):
+            self.outputs[-1]['text'] += text
+        else:
+            self.outputs.append(nbformat.v4.new_output(
+                'stream', name=name, text=text))
+
+
+class _CapturedStream:
+    """A file-like stream that collects what it writes to another stream."""
+
+    def __init__(self, name, stream, collector):
+        self.name = name
+        self.stream = stream
+        self.collector = collector
+
+    def write(self, text):
+        """Write to the underlying stream and collect the text."""
+        self.collector.add_stream(self.name, text)
+        return self.stream.write(text)
+
+    def __getattr__(self, name):
+        """Get the other attributes from the underlying stream."""
+        return getattr(self.stream, name)
+
+
+def _get_in_process_shell(collector):
+    """Create an IPython shell that collects the outputs of its cells.
+
+    Rich outputs, i.e. `display` calls and the results of the last
+    expressions of cells, are collected in the same form as the outputs of a
+    notebook's cells. Tracebacks are collected as error outputs and written
+    to stderr, like the ones of a kernel.
+    """
+    from traitlets.config import Config
+    from IPython.core.displayhook import DisplayHook
+    from IPython.core.displaypub import DisplayPublisher
+    from IPython.core.interactiveshell import InteractiveShell
+
+    class _DisplayPublisher(DisplayPublisher):
+        def publish(self, data, metadata=None, *args, **kwargs):
+            collector.add(nbformat.v4.new_output(
+                'display_data', data=data, metadata=metadata or {}))
+
+    class _DisplayHook(DisplayHook):
+        def write_output_prompt(self):
+            pass
+
+        def write_format_data(self, format_dict, md_dict=None):
+            collector.add(nbformat.v4.new_output(
+                'execute_result', data=format_dict, metadata=md_dict or {},
+                execution_count=self.prompt_count))
+
+        def finish_displayhook(self):
+            self._is_active = False
+
+    class _Shell(InteractiveShell):
+        display_pub_class = _DisplayPublisher
+        displayhook_class = _DisplayHook
+
+        def _showtraceback(self, etype, evalue, stb):
+            collector.add(nbformat.v4.new_output(
+                'error', ename=etype.__name__, evalue=str(evalue),
+                traceback=stb))
+            if etype is KaleGracefulExit:
                 log.error("Received a %s exception. Exiting..." %
                           KaleGracefulExit.__name__)
-                os.kill(os.getpid(), signal.SIGUSR1)
-            else:
-                traceback = map(remove_ansi_color_sequences,
-                                content['traceback'])
-                sys.stderr.write('\n'.join(traceback) + '\n')
-                if exit_on_error:
-                    # when receiving an error from the kernel, we don't want
-                    # to just print the exception to stderr, otherwise the
-                    # pipeline step would complete successfully.
-                    # kill sends the signal to the specific pid (main thread)
-                    os.kill(os.getpid(), signal.SIGUSR1)
-
-
-def run_code(source: tuple, kernel_name='python3'):
+                return
+            sys.stderr.write('\n'.join(map(remove_ansi_color_sequences,
+                                           stb)) + '\n')
+
+    config = Config()
+    config.HistoryManager.enabled = False
+    config.InteractiveShell.colors = 'nocolor'
+    if InteractiveShell.initialized():
+        # Already running in IPython, keep the running shell in place
+        return _Shell(config=config)
+    return _Shell.instance(config=config)
+
+
+def _run_in_process(cells, report: HTMLReportWriter = None):
+    """Run code cells in an IPython shell, in the current process.
+
+    Args:
+        cells: Notebook code cells, to run and store the outputs of
+        report: Write the outputs to this report, instead of the cells
+    """
+    from IPython.core.interactiveshell import InteractiveShell
+
+    collector = _OutputCollector(report)
+    shell = _get_in_process_shell(collector)
+    stdout, stderr = sys.stdout, sys.stderr
+    sys.stdout = _CapturedStream('stdout', stdout, collector)
+    sys.stderr = _CapturedStream('stderr', stderr, collector)
+    try:
+        for cell in cells:
+            collector.outputs = cell.outputs
+            result = shell.run_cell(cell.source, store_history=True)
+            if not result.success:
+                raise KaleKernelException()
+    finally:
+        sys.stdout, sys.stderr = stdout, stderr
+        if InteractiveShell._instance is shell:
+            InteractiveShell.clear_instance()
+
+
+def _run_in_kernel(notebook, kernel_pool: KernelPool,
+                   report: HTMLReportWriter = None):
+    """Run the code cells of a notebook in a kernel of a pool.
+
+    Args:
+        notebook: The notebook to run and store the outputs of
+        kernel_pool: Take the kernel from this pool
+        report: Write the outputs to this report, instead of the notebook
+    """
+    # these parameters are passed to nbconvert.ExecutePreprocessor. The
+    # first error stops the execution and fails the run.
+    jupyter_execute_kwargs = dict(
+        timeout=-1, allow_errors=False, store_widget_state=True)
+
+    resources = {}
+    # cwd: If supplied, the kernel will run in this directory
+    # resources['metadata'] = {'path': cwd}
+    ep = _KernelExecutePreprocessor(report, **jupyter_execute_kwargs)
+    km = kernel_pool.acquire()
+    try:
+        # start preprocessor: run each code cell and capture the output
+        ep.preprocess(notebook, resources, km=km)
+    except (CellExecutionError, DeadKernelError) as e:
+        raise KaleKernelException() from e
+    finally:
+        if ep.kc is not None:
+            ep.kc.stop_channels()
+        kernel_pool.release(km)
+
+
+def run_code(source: tuple, kernel_name='python3',
+             kernel_pool: KernelPool = None, warmup_code: str = None,
+             engine: str = None,
+             html_report_path: str = None,
+             max_stream_size: int = MAX_STREAM_SIZE, images_dir: str = None):
     """Run code blocks inside a jupyter kernel.
 
+    The `inprocess` engine runs the blocks in an IPython shell in the
+    current process instead, sparing the kernel's start up and the transfer
+    of the outputs. Magics work in both engines, but the outputs that need a
+    frontend (e.g., widgets) are available only in a kernel.
+
     Args:
         source (tuple): source code blocks
         kernel_name: name of the kernel (form the kernel spec) to be created
+        kernel_pool: Take a started kernel from this pool. The name of the
+            kernel is the pool's one. Defaults to the pool of `kernel_name`
+            that the process shares, see `get_kernel_pool`.
+        warmup_code: Code that the kernels of the shared pool run in
+            advance, typically the imports of the notebook. It must be safe
+            to run again, as part of `source`.
+        engine: `kernel` or `inprocess`. Defaults to the value of the
+            `KALE_RUN_CODE_ENGINE` env variable, or `kernel`.
+        html_report_path: Write the HTML report of the outputs to this
+            file, while the code runs, see `HTMLReportWriter`
+        max_stream_size: Characters of stream outputs to write to the
+            report, at most
+        images_dir: Save the images of the report to this directory,
+            instead of embedding them
+
+    Returns (str): The HTML report, or its path if `html_report_path` is set
     """
+    engine = engine or os.environ.get(RUN_CODE_ENGINE_ENV, KERNEL_ENGINE)
+    if engine not in RUN_CODE_ENGINES:
+        raise ValueError("Unknown engine '%s'. Use one of the following: %s"
+                         % (engine, RUN_CODE_ENGINES))
     log.info("%s Running user code... %s", "-" * 10, "-" * 10)
     log.newline(lines=3)
     import IPython
@@ -251,65 +760,46 @@ def run_code(source: tuple, kernel_name='python3'):
                            " Kale requires at least version 7.6.0."
                            .format(IPython.__version__))
 
-    # new notebook
-    spec = get_kernel_spec(kernel_name)
-    notebook = nbformat.v4.new_notebook(metadata={
-        'kernelspec': {
-            'display_name': spec.display_name,
-            'language': spec.language,
-            'name': kernel_name,
-        }})
+    if engine == IN_PROCESS_ENGINE:
+        notebook = nbformat.v4.new_notebook()
+    else:
+        if kernel_pool is None:
+            kernel_pool = get_kernel_pool(kernel_name, warmup_code)
+        kernel_name = kernel_pool.kernel_name
+        # new notebook
+        spec = get_kernel_spec(kernel_name)
+        notebook = nbformat.v4.new_notebook(metadata={
+            'kernelspec': {
+                'display_name': spec.display_name,
+                'language': spec.language,
+                'name': kernel_name,
+            }})
     notebook.cells = [nbformat.v4.new_code_cell(s) for s in source]
-    # these parameters are passed to nbconvert.ExecutePreprocessor
-    jupyter_execute_kwargs = dict(
-        timeout=-1, allow_errors=True, store_widget_state=True)
-
-    resources = {}
-    # cwd: If supplied, the kernel will run in this directory
-    # resources['metadata'] = {'path': cwd}
-    ep = ExecutePreprocessor(**jupyter_execute_kwargs)
-    km = ep.kernel_manager_class(kernel_name=kernel_name, config=ep.config)
-    # start_kernel supports several additional arguments via **kw
-    km.start_kernel(extra_arguments=ep.extra_arguments)
-    kc = km.client()
-    kc.start_channels()
-    try:
-        kc.wait_for_ready(timeout=60)
-    except RuntimeError:
-        kc.stop_channels()
-        raise
-    kc.allow_stdin = False
-
-    def signal_handler(_signal, _frame):
-        raise KaleKernelException()
-
-    # this signal is used by the thread in case an error message is received
-    # by the kernel. Running sys.exit() inside the thread would terminate
-    # just the thread itself, not the main process. Calling os._exit() can be
-    # dangerous as the process is killed instantly (files and connections are
-    # not closed, for example). With a signal we can capture the ExitCommand
-    # exception from the main process and exit gracefully.
-    signal.signal(signal.SIGUSR1, signal_handler)
-    # start separate thread in to capture and print stdout, stderr, errors.
-    # daemon mode will make the watcher thread die when the main one returns.
-    x = threading.Thread(target=capture_streams, args=(kc, True,), daemon=True)
-    x.start()
 
+    report = None
+    if html_report_path:
+        report = HTMLReportWriter(html_report_path, max_stream_size,
+                                  images_dir)
+        report.open()
     try:
-        # start preprocessor: run each code cell and capture the output
-        ep.preprocess(notebook, resources, km=km)
+        if engine == IN_PROCESS_ENGINE:
+            _run_in_process(notebook.cells, report)
+        else:
+            _run_in_kernel(notebook, kernel_pool, report)
     except KaleKernelException:
         sys.stdout.flush()
         log.newline(lines=3)
         log.error("%s Failed to run user code %s", "-" * 10, "-" * 10)
         # exit gracefully with error
         sys.exit(-1)
-    # Give some time to the stream watcher thread to receive all messages from
-    # the kernel before shutting down.
-    time.sleep(1)
-    km.shutdown_kernel()
-
-    result = process_outputs(notebook.cells)
+    finally:
+        if report:
+            report.close()
+
+    if report:
+        result = html_report_path
+    else:
+        result = process_outputs(notebook.cells)
     sys.stdout.flush()
     log.newline(lines=3)
     log.info("%s Successfully ran user code %s", "-" * 10, "-" * 10)
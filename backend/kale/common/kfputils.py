@@ -287,12 +287,14 @@ def update_uimetadata(artifact_name,
     log.info("Artifact successfully added")
 
 
-def generate_mlpipeline_metrics(metrics):
+def generate_mlpipeline_metrics(metrics, merge=False):
     """Generate a KFP_UI_METRICS_FILE_PATH file.
 
     Args:
         metrics (dict): a dictionary where the key is the metric name and the
             value is its value.
+        merge (bool): keep the metrics already in the file, unless replaced
+            by a metric with the same name.
     """
     metadata = list()
     for name, value in metrics.items():
@@ -316,6 +318,17 @@ def generate_mlpipeline_metrics(metrics):
         log.exception("Writing to '%s' failed. This step will not be able to"
                       " show metrics in the KFP UI.", KFP_UI_METRICS_FILE_PATH)
         return
+    if merge and os.path.exists(KFP_UI_METRICS_FILE_PATH):
+        try:
+            with open(KFP_UI_METRICS_FILE_PATH) as f:
+                existing = json.load(f)['metrics']
+        except (OSError, ValueError, KeyError, TypeError):
+            log.exception("Could not read the existing pipeline metrics from"
+                          " '%s'. Overwriting them.", KFP_UI_METRICS_FILE_PATH)
+        else:
+            names = {m['name'] for m in metadata}
+            metadata = [m for m in existing
+                        if m.get('name') not in names] + metadata
     with open(KFP_UI_METRICS_FILE_PATH, 'w') as f:
         json.dump({'metrics': metadata}, f)
 
@@ -0,0 +1,285 @@
+# Copyright 2020 The Kale Authors
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Run the steps of a pipeline locally, in parallel processes."""
+
+import os
+import re
+import sys
+import logging
+import selectors
+import multiprocessing
+
+from typing import Callable, Dict, TYPE_CHECKING
+
+if TYPE_CHECKING:
+    from kale.step import Step
+    from kale.pipeline import Pipeline
+
+log = logging.getLogger(__name__)
+
+# The suffixes of K8s resource quantities
+QUANTITY_SUFFIXES = {"": 1, "m": 1e-3,
+                     "k": 1e3, "M": 1e6, "G": 1e9, "T": 1e12, "P": 1e15,
+                     "E": 1e18,
+                     "Ki": 2 ** 10, "Mi": 2 ** 20, "Gi": 2 ** 30,
+                     "Ti": 2 ** 40, "Pi": 2 ** 50, "Ei": 2 ** 60}
+
+
+def parse_quantity(quantity: str) -> float:
+    """Parse a K8s resource quantity, e.g. `500m` or `4Gi`."""
+    match = re.fullmatch(r"([0-9]+(?:\.[0-9]*)?|\.[0-9]+)([a-zA-Z]*)",
+                         str(quantity).strip())
+    if not match or match.group(2) not in QUANTITY_SUFFIXES:
+        raise ValueError("Not a valid K8s quantity: %s" % quantity)
+    return float(match.group(1)) * QUANTITY_SUFFIXES[match.group(2)]
+
+
+def get_local_resources() -> Dict[str, float]:
+    """Get the CPUs and the memory (in bytes) of the local machine."""
+    if hasattr(os, "sched_getaffinity"):
+        cpus = len(os.sched_getaffinity(0))
+    else:
+        cpus = os.cpu_count() or 1
+    resources = {"cpu": float(cpus)}
+    try:
+        resources["memory"] = float(os.sysconf("SC_PAGE_SIZE")
+                                    * os.sysconf("SC_PHYS_PAGES"))
+    except (AttributeError, ValueError, OSError):
+        pass
+    return resources
+
+
+def _run_step_process(run_step: Callable[["Step"], None], step: "Step",
+                      stdout_fd: int, stderr_fd: int, fds_to_close):
+    # The step writes to the pipes of its own stdout and stderr, including
+    # the output of its subprocesses (e.g., Jupyter kernels)
+    sys.stdout.flush()
+    sys.stderr.flush()
+    os.dup2(stdout_fd, 1)
+    os.dup2(stderr_fd, 2)
+    for fd in fds_to_close:
+        os.close(fd)
+    # sys.stdout and sys.stderr may have been replaced, e.g. to capture them
+    for fd, name in ((1, "stdout"), (2, "stderr")):
+        try:
+            redirected = getattr(sys, name).fileno() == fd
+        except (AttributeError, OSError, ValueError):
+            redirected = False
+        if not redirected:
+            setattr(sys, name, open(fd, "w", buffering=1, closefd=False))
+    try:
+        run_step(step)
+    finally:
+        # The process exits without running the `atexit` handlers. Do not
+        # import jputils, along with Jupyter, just to find no kernels.
+        jputils = sys.modules.get("kale.common.jputils")
+        if jputils is not None:
+            jputils.shutdown_kernel_pools()
+        sys.stdout.flush()
+        sys.stderr.flush()
+
+
+class _StepProcess:
+    """A step running in a forked process, along with its output pipes."""
+
+    def __init__(self, name, process, stdout_fd, stderr_fd, demand):
+        self.name = name
+        self.process = process
+        self.demand = demand
+        # read end of each pipe -> [stream to forward to, incomplete line]
+        self.pipes = {stdout_fd: [sys.stdout, b""],
+                      stderr_fd: [sys.stderr, b""]}
+
+    def forward(self, fd: int) -> bool:
+        """Forward the complete lines read from a pipe, with a prefix.
+
+        Returns: False if the pipe is closed
+        """
+        stream, pending = self.pipes[fd]
+        data = os.read(fd, 64 * 1024)
+        lines = (pending + data).split(b"\n")
+        self.pipes[fd][1] = lines.pop()
+        self._write(stream, lines)
+        if not data:
+            self.flush(fd)
+        return bool(data)
+
+    def flush(self, fd: int):
+        """Forward the incomplete line read from a pipe."""
+        stream, pending = self.pipes[fd]
+        self.pipes[fd][1] = b""
+        if pending:
+            self._write(stream, [pending])
+
+    def _write(self, stream, lines):
+        prefix = "[%s] " % self.name
+        for line in lines:
+            stream.write(prefix + line.decode(errors="replace") + "\n")
+        stream.flush()
+
+
+class LocalScheduler:
+    """Run the steps of a pipeline in parallel processes, following the DAG.
+
+    A step starts as soon as all of its parents have completed, as long as
+    fewer than `max_parallelism` steps are running and the `limits` of the
+    running steps fit in the local `resources`. Only the resources of
+    `resources` are accounted for, i.e. `cpu` and `memory` by default, and
+    steps without limits only count towards `max_parallelism`. A step whose
+    limits exceed the resources runs when no other step is using them.
+
+    Every step runs `run_step` in a forked process, sharing the working
+    directory, and thus the marshal data dir, with the other steps. The
+    lines a step writes to stdout and stderr are forwarded with the name of
+    the step as a prefix. When a step fails, no more steps start, and the
+    run fails once the running steps complete.
+
+    NOTE: Forking processes is supported on POSIX systems only.
+    """
+
+    def __init__(self, pipeline: "Pipeline",
+                 run_step: Callable[["Step"], None],
+                 max_parallelism: int = None,
+                 resources: Dict[str, float] = None):
+        self.pipeline = pipeline
+        self.run_step = run_step
+        self.resources = (get_local_resources() if resources is None
+                          else resources)
+        self.max_parallelism = max_parallelism or int(
+            self.resources.get("cpu", 1))
+        # Fail early on invalid limits
+        self._demands = {step.name: self._get_demand(step)
+                         for step in pipeline.steps}
+        self._context = multiprocessing.get_context("fork")
+        self._selector = None
+        self._running: Dict[str, _StepProcess] = dict()
+
+    def _get_demand(self, step: "Step") -> Dict[str, float]:
+        demand = dict()
+        for name, capacity in self.resources.items():
+            if name in step.config.limits:
+                demand[name] = min(parse_quantity(step.config.limits[name]),
+                                   capacity)
+        return demand
+
+    def _fits(self, demand: Dict[str, float]) -> bool:
+        for name, quantity in demand.items():
+            in_use = sum(p.demand.get(name, 0)
+                         for p in self._running.values())
+            # tolerate rounding errors of fractional CPUs
+            if in_use + quantity > self.resources[name] + 1e-6:
+                return False
+        return True
+
+    def run(self):
+        """Run all the steps of the pipeline.
+
+        Raises:
+            RuntimeError: Some steps failed
+        """
+        order = self.pipeline.steps_names
+        parents = {name: set(self.pipeline.predecessors(name))
+                   for name in order}
+        # keep the topological order among the ready steps
+        ready = [name for name in order if not parents[name]]
+        failed = []
+        self._selector = selectors.DefaultSelector()
+        try:
+            while self._running or (ready and not failed):
+                for name in list(ready):
+                    if (failed
+                            or len(self._running) >= self.max_parallelism):
+                        break
+                    if self._fits(self._demands[name]):
+                        ready.remove(name)
+                        self._start(name)
+                for name in self._wait():
+                    if self._running.pop(name).process.exitcode != 0:
+                        log.error("Step '%s' failed", name)
+                        failed.append(name)
+                        continue
+                    for child in self.pipeline.successors(name):
+                        parents[child].discard(name)
+                        if not parents[child]:
+                            ready.append(child)
+                    ready.sort(key=order.index)
+        finally:
+            for name, step_process in list(self._running.items()):
+                step_process.process.terminate()
+                step_process.process.join()
+                self._close(step_process)
+            self._running.clear()
+            self._selector.close()
+        if failed:
+            raise RuntimeError("The following steps failed: %s"
+                               % ", ".join(failed))
+
+    def _start(self, name: str):
+        log.info("%s Starting step '%s'... %s", "-" * 10, name, "-" * 10)
+        stdout_r, stdout_w = os.pipe()
+        stderr_r, stderr_w = os.pipe()
+        # the child does not need the pipes of the other steps
+        fds_to_close = [stdout_r, stderr_r]
+        for step_process in self._running.values():
+            fds_to_close.extend(step_process.pipes)
+        process = self._context.Process(
+            target=_run_step_process,
+            args=(self.run_step, self.pipeline.get_step(name), stdout_w,
+                  stderr_w, fds_to_close),
+            name="kale-step-%s" % name)
+        process.start()
+        os.close(stdout_w)
+        os.close(stderr_w)
+        step_process = _StepProcess(name, process, stdout_r, stderr_r,
+                                    self._demands[name])
+        self._running[name] = step_process
+        for fd in step_process.pipes:
+            self._selector.register(fd, selectors.EVENT_READ, step_process)
+        self._selector.register(process.sentinel, selectors.EVENT_READ,
+                                step_process)
+
+    def _wait(self):
+        """Forward the output of the steps until some of them complete.
+
+        Returns: The names of the completed steps
+        """
+        completed = []
+        while not completed:
+            for key, _ in self._selector.select():
+                step_process = key.data
+                if key.fd == step_process.process.sentinel:
+                    step_process.process.join()
+                    self._close(step_process)
+                    completed.append(step_process.name)
+                elif key.fd in self._selector.get_map():
+                    if not step_process.forward(key.fd):
+                        self._selector.unregister(key.fd)
+        return completed
+
+    def _close(self, step_process: _StepProcess):
+        """Forward the rest of the output of a step and close its pipes."""
+        self._selector.unregister(step_process.process.sentinel)
+        for fd in step_process.pipes:
+            if fd in self._selector.get_map():
+                self._selector.unregister(fd)
+                # read what the step wrote before exiting, without waiting
+                # for its subprocesses (e.g., kernels) to close the pipe
+                os.set_blocking(fd, False)
+                try:
+                    while step_process.forward(fd):
+                        pass
+                except BlockingIOError:
+                    step_process.flush(fd)
+            os.close(fd)
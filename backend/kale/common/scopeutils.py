@@ -0,0 +1,738 @@
+# Copyright 2020 The Kale Authors
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Resolve the names of a code block in a single pass over its AST.
+
+The analysis follows the scoping rules of PyFlakes, so that a name is
+reported undefined exactly when PyFlakes would report an 'undefined name':
+function bodies see the final bindings of their enclosing scopes, class
+scopes are hidden from nested functions, names guarded by an
+`except NameError` are ignored, and so on.
+
+On top of the names of the whole block, the analysis collects the names that
+every global function reads from the global scope. This way, the free
+variables of a function in the context of some other code can be computed
+without analyzing them together, see `get_free_variables`.
+"""
+
+import ast
+import sys
+import builtins
+
+from collections import deque
+from functools import lru_cache
+from typing import Dict, List, NamedTuple, Optional, Set
+
+BUILTINS = frozenset(dir(builtins)) | {
+    # Names that are available in every module, but are not builtins
+    '__file__', '__builtins__', '__annotations__', 'WindowsError'}
+# Names defined in the body of every class
+CLASS_NAMES = frozenset(('__module__', '__qualname__'))
+
+MODULE = "module"
+CLASS = "class"
+FUNCTION = "function"
+COMPREHENSION = "comprehension"
+TYPE = "type"
+
+# Annotation states
+BARE = "bare"
+STRING = "string"
+# Strings are annotations, but the expression is not, e.g. `cast("int", x)`
+TYPE_EXPRESSION = "type_expression"
+
+TYPING_MODULES = frozenset(('typing', 'typing_extensions'))
+# `typing` functions taking types as arguments
+TYPING_CALLS = frozenset(('cast', 'assert_type', 'TypeVar', 'ParamSpec',
+                          'TypeVarTuple', 'NewType', 'TypedDict',
+                          'NamedTuple'))
+
+
+class FunctionNames(NamedTuple):
+    """The names a global function resolves in the global scope."""
+    # Names read from the global scope, when not defined by the function.
+    # Builtins are left out.
+    globals_used: Set[str]
+    # Names declared `global` (or `nonlocal`) in the function
+    globals_declared: Set[str]
+
+
+class ScopeReport(NamedTuple):
+    """The names of a code block."""
+    # Names that are used but not defined, i.e., the free variables of the
+    # block
+    undefined: Set[str]
+    # Names defined in the global scope once the block has run, builtins
+    # included
+    defined: Set[str]
+    # Whether the block imports `*` from some module, making any name
+    # possibly defined
+    star_import: bool
+    # The global functions of the block, see `astutils.parse_functions`
+    functions: Dict[str, FunctionNames]
+
+
+class _Scope:
+    def __init__(self, kind: str):
+        self.kind = kind
+        self.names = set()
+        # Names that are only annotated, e.g. `x: int`. Only postponed
+        # annotations can read them.
+        self.annotated = set()
+        self.star_import = False
+        # Names imported from `typing`: name -> the imported member, or ""
+        # for the module itself
+        self.typing = dict()
+
+    def __contains__(self, name):
+        """Check whether a name is bound in the scope."""
+        return name in self.names or name in self.annotated
+
+    def bind(self, name: str):
+        """Bind a name to the scope."""
+        self.names.add(name)
+        self.annotated.discard(name)
+        self.typing.pop(name, None)
+
+    def unbind(self, name: str):
+        """Remove a name from the scope."""
+        self.names.discard(name)
+        self.annotated.discard(name)
+        self.typing.pop(name, None)
+
+
+@lru_cache(maxsize=None)
+def _get_fields(node_type: type) -> List[str]:
+    # The iterable of a loop (or the value of an assignment) is evaluated
+    # before the names it binds
+    fields = node_type._fields
+    if "iter" in fields:
+        first = "iter"
+    elif "generators" in fields:
+        first = "generators"
+    else:
+        first = "value"
+    return sorted(fields, key=lambda field: field != first)
+
+
+def _iter_child_nodes(node: ast.AST, omit=()):
+    for field in _get_fields(type(node)):
+        if field in omit:
+            continue
+        value = getattr(node, field, None)
+        if isinstance(value, ast.AST):
+            yield value
+        elif isinstance(value, list):
+            for item in value:
+                if isinstance(item, ast.AST):
+                    yield item
+
+
+def _is_name_or_attr(node: ast.AST, name: str) -> bool:
+    return ((isinstance(node, ast.Name) and node.id == name)
+            or (isinstance(node, ast.Attribute) and node.attr == name))
+
+
+def _get_exception_name(node: Optional[ast.AST]) -> Optional[str]:
+    return getattr(node, "id", None) or getattr(node, "name", None)
+
+
+def _get_export_names(node: ast.AST) -> List[str]:
+    """Get the names of an `__all__` list, or of lists added together."""
+    names = list()
+
+    def _add_names(container):
+        names.extend(elt.value for elt in container.elts
+                     if isinstance(elt, ast.Constant)
+                     and isinstance(elt.value, str))
+
+    if isinstance(node, (ast.List, ast.Tuple)):
+        _add_names(node)
+    elif isinstance(node, ast.BinOp):
+        while isinstance(node.right, (ast.List, ast.Tuple)):
+            _add_names(node.right)
+            if isinstance(node.left, ast.BinOp):
+                node = node.left
+            elif isinstance(node.left, (ast.List, ast.Tuple)):
+                _add_names(node.left)
+                break
+            else:
+                break
+    return names
+
+
+class _ScopeVisitor:
+    """Resolve the names of a module.
+
+    Bodies of functions are visited after the module, in order, seeing the
+    final bindings of the scopes enclosing them.
+    """
+
+    def __init__(self):
+        module = _Scope(MODULE)
+        module.names.update(BUILTINS)
+        self.stack: List[_Scope] = [module]
+        self.undefined = set()
+        self.functions: Dict[str, FunctionNames] = dict()
+        # The global function being visited, and the number of scopes and
+        # handlers enclosing its definition
+        self.function: Optional[FunctionNames] = None
+        self.function_depth = 0
+        self.function_handlers = 1
+        # Functions defined in the body of a function or class are not global
+        self.nested = False
+        # The exceptions handled by the enclosing `try` statements
+        self.handlers = [set()]
+        self.conditional = 0
+        self.annotation = None
+        self.future_annotations = False
+        self.exports = None
+        self._pending_exports = None
+        self._deferred = deque()
+        self._visitors = dict()
+
+    @property
+    def scope(self) -> _Scope:
+        """Get the innermost scope."""
+        return self.stack[-1]
+
+    def run(self, tree: ast.Module) -> ScopeReport:
+        """Resolve the names of a module."""
+        self.visit(tree)
+        while self._deferred:
+            (func, self.stack, self.function, self.function_depth,
+             self.nested, self.conditional,
+             self.annotation) = self._deferred.popleft()
+            self.handlers = [set()]
+            self.function_handlers = 1
+            func()
+        module = self.stack[0]
+        if self.exports and not module.star_import:
+            self.undefined.update(name for name in self.exports
+                                  if name not in module)
+        return ScopeReport(undefined=self.undefined,
+                           defined=set(module.names),
+                           star_import=module.star_import,
+                           functions=self.functions)
+
+    def defer(self, func, annotation=None):
+        """Run a function after the module, in the current context."""
+        self._deferred.append((func, list(self.stack), self.function,
+                               self.function_depth, self.nested,
+                               self.conditional, annotation))
+
+    def visit(self, node: Optional[ast.AST]):
+        """Visit a node."""
+        if node is None:
+            return
+        visitor = self._visitors.get(type(node))
+        if visitor is None:
+            visitor = getattr(self, "visit_" + type(node).__name__,
+                              self.visit_children)
+            self._visitors[type(node)] = visitor
+        visitor(node)
+
+    def visit_children(self, node: ast.AST, omit=()):
+        """Visit the children of a node."""
+        for child in _iter_child_nodes(node, omit):
+            self.visit(child)
+
+    # Names
+
+    def load(self, name: str):
+        """Resolve a name that is read."""
+        postponed = (self.annotation == STRING
+                     or (self.annotation == BARE
+                         and (self.future_annotations
+                              or sys.version_info >= (3, 14))))
+        can_access_class = None
+        star_import = False
+        outside_function = False
+        for depth in range(len(self.stack) - 1, -1, -1):
+            scope = self.stack[depth]
+            if scope.kind == CLASS:
+                if name == "__class__":
+                    return
+                if can_access_class is False:
+                    continue
+            if depth < self.function_depth and not outside_function:
+                # Global functions are analyzed as if they were defined in
+                # the global scope
+                outside_function = True
+                self._use_global(name)
+            if name in scope.annotated and not postponed:
+                continue
+            if name in scope:
+                return
+            star_import = star_import or scope.star_import
+            if can_access_class is not False:
+                can_access_class = scope.kind in (COMPREHENSION, TYPE)
+        if star_import:
+            return
+        if name in CLASS_NAMES and self.scope.kind == CLASS:
+            return
+        if "NameError" not in self.handlers[-1]:
+            self.undefined.add(name)
+
+    def _use_global(self, name: str):
+        if name in BUILTINS:
+            return
+        if name in CLASS_NAMES and self.scope.kind == CLASS:
+            return
+        # Handlers outside of the function don't protect it elsewhere
+        if (len(self.handlers) > self.function_handlers
+                and "NameError" in self.handlers[-1]):
+            return
+        self.function.globals_used.add(name)
+
+    def store(self, name: str, annotated: bool = False):
+        """Bind a name to the current scope."""
+        scope = self.scope
+        if scope.kind == MODULE and name == "__all__":
+            self.exports = self._pending_exports
+        self._pending_exports = None
+        if not annotated:
+            scope.bind(name)
+        elif name not in scope:
+            scope.annotated.add(name)
+
+    def delete(self, name: str):
+        """Remove a name from the current scope."""
+        if self.conditional:
+            # The branch might not run
+            return
+        if name in self.scope:
+            self.scope.unbind(name)
+        else:
+            self.undefined.add(name)
+            if self.function is not None:
+                self.function.globals_used.add(name)
+
+    def visit_Name(self, node):
+        """Resolve a name."""
+        if isinstance(node.ctx, ast.Load):
+            self.load(node.id)
+        elif isinstance(node.ctx, ast.Store):
+            self.store(node.id)
+        else:
+            self.delete(node.id)
+
+    def visit_Global(self, node):
+        """Bind the names declared global to the enclosing scopes."""
+        if self.scope.kind == MODULE:
+            return
+        module = self.stack[0]
+        for name in node.names:
+            self.undefined.discard(name)
+            if self.function is not None:
+                self.function.globals_declared.add(name)
+            if name not in module:
+                module.names.add(name)
+            for scope in self.stack[1:]:
+                scope.bind(name)
+
+    visit_Nonlocal = visit_Global
+
+    # Statements
+
+    def visit_Assign(self, node):
+        """Resolve an assignment, and the names of `__all__`."""
+        self.visit(node.value)
+        for target in node.targets:
+            self._visit_target(target, node.value)
+
+    def visit_AugAssign(self, node):
+        """Resolve an augmented assignment, reading its target first."""
+        if isinstance(node.target, ast.Name):
+            self.load(node.target.id)
+        self.visit(node.value)
+        if (isinstance(node.target, ast.Name) and node.target.id == "__all__"
+                and self.scope.kind == MODULE and "__all__" in self.scope):
+            self._pending_exports = list(self.exports or ())
+        self._visit_target(node.target, node.value)
+
+    def visit_AnnAssign(self, node):
+        """Resolve an annotated assignment."""
+        self.visit_annotation(node.annotation)
+        if node.value is None:
+            if isinstance(node.target, ast.Name):
+                self.store(node.target.id, annotated=True)
+            else:
+                self.visit(node.target)
+            return
+        if self.get_typing_member(node.annotation) == "TypeAlias":
+            self.visit_as(node.value, TYPE_EXPRESSION)
+        else:
+            self.visit(node.value)
+        self._visit_target(node.target, node.value)
+
+    def _visit_target(self, target, value):
+        if isinstance(target, ast.Name) and target.id == "__all__":
+            self._pending_exports = ((self._pending_exports or [])
+                                     + _get_export_names(value))
+        self.visit(target)
+
+    def visit_NamedExpr(self, node):
+        """Bind the target of `:=` outside of comprehensions."""
+        self.visit(node.value)
+        scope = next(s for s in reversed(self.stack)
+                     if s.kind != COMPREHENSION)
+        scope.bind(node.target.id)
+
+    def visit_Import(self, node):
+        """Bind imported modules."""
+        for alias in node.names:
+            name = alias.asname or alias.name.split(".")[0]
+            self.store(name)
+            if alias.name in TYPING_MODULES:
+                self.scope.typing[name] = ""
+
+    def visit_ImportFrom(self, node):
+        """Bind imported names."""
+        for alias in node.names:
+            if node.module == "__future__" and alias.name == "annotations":
+                self.future_annotations = True
+            if alias.name == "*":
+                if self.scope.kind == MODULE:
+                    self.scope.star_import = True
+                continue
+            name = alias.asname or alias.name
+            self.store(name)
+            if node.level == 0 and node.module in TYPING_MODULES:
+                self.scope.typing[name] = alias.name
+
+    def visit_Try(self, node):
+        """Resolve a `try` statement, tracking the exceptions it handles."""
+        handled = set()
+        for handler in node.handlers:
+            if isinstance(handler.type, ast.Tuple):
+                handled.update(_get_exception_name(exc)
+                               for exc in handler.type.elts)
+            elif handler.type:
+                handled.add(_get_exception_name(handler.type))
+        self.handlers.append(handled)
+        for stmt in node.body:
+            self.visit(stmt)
+        self.handlers.pop()
+        self.visit_children(node, omit=("body",))
+
+    visit_TryStar = visit_Try
+
+    def visit_ExceptHandler(self, node):
+        """Bind the exception to the body of the handler only."""
+        if node.name is None:
+            self.visit_children(node)
+            return
+        scope = self.scope
+        previous = None
+        if node.name in scope.names:
+            previous = "names"
+        elif node.name in scope.annotated:
+            previous = "annotated"
+        scope.unbind(node.name)
+        self.store(node.name)
+        self.visit_children(node)
+        scope.unbind(node.name)
+        if previous:
+            getattr(scope, previous).add(node.name)
+
+    def _visit_conditional(self, node):
+        self.conditional += 1
+        self.visit_children(node)
+        self.conditional -= 1
+
+    visit_If = visit_While = visit_IfExp = _visit_conditional
+
+    def _visit_function_value(self, node):
+        # Values returned or yielded outside of functions are ignored
+        if self.scope.kind not in (MODULE, CLASS):
+            self.visit_children(node)
+
+    visit_Return = visit_Yield = visit_YieldFrom = visit_Await = \
+        _visit_function_value
+
+    def visit_MatchAs(self, node):
+        """Bind the capture names of `match` patterns."""
+        name = getattr(node, "name", None) or getattr(node, "rest", None)
+        if name:
+            self.store(name)
+        self.visit_children(node)
+
+    visit_MatchStar = visit_MatchMapping = visit_MatchAs
+
+    # Functions and classes
+
+    def _visit_type_params(self, node):
+        self.stack.append(_Scope(TYPE))
+        for param in node.type_params:
+            self.store(param.name)
+            bound = getattr(param, "bound", None)
+            if bound is not None:
+                self.defer(lambda bound=bound: self.visit(bound), BARE)
+
+    def visit_FunctionDef(self, node):
+        """Resolve the definition of a function, deferring its body."""
+        context = (self.function, self.function_depth, self.function_handlers)
+        if isinstance(node, ast.FunctionDef) and not self.nested:
+            self.function = FunctionNames(set(), set())
+            self.functions[node.name] = self.function
+            self.function_depth = len(self.stack)
+            self.function_handlers = len(self.handlers)
+        for decorator in node.decorator_list:
+            self.visit(decorator)
+        type_params = getattr(node, "type_params", None)
+        if type_params:
+            self._visit_type_params(node)
+        self.visit_Lambda(node)
+        if type_params:
+            self.stack.pop()
+        self.function, self.function_depth, self.function_handlers = context
+        self.store(node.name)
+
+    visit_AsyncFunctionDef = visit_FunctionDef
+
+    def visit_Lambda(self, node):
+        """Resolve the signature of a function, deferring its body."""
+        args = node.args
+        annotations = [arg.annotation for arg in (
+            args.posonlyargs + args.args + args.kwonlyargs)]
+        annotations.extend(arg.annotation for arg in (args.vararg, args.kwarg)
+                           if arg)
+        if not isinstance(node, ast.Lambda):
+            annotations.append(node.returns)
+        for annotation in annotations:
+            self.visit_annotation(annotation)
+        for default in args.defaults + args.kw_defaults:
+            self.visit(default)
+
+        def _visit_body():
+            if isinstance(node, ast.FunctionDef):
+                self.nested = True
+            self.stack.append(_Scope(FUNCTION))
+            self.visit_children(node, omit=("decorator_list", "returns",
+                                            "type_params"))
+            self.stack.pop()
+
+        self.defer(_visit_body)
+
+    def visit_arguments(self, node):
+        """Bind the arguments of a function."""
+        self.visit_children(node, omit=("defaults", "kw_defaults"))
+
+    def visit_arg(self, node):
+        """Bind an argument of a function."""
+        self.store(node.arg)
+
+    def visit_ClassDef(self, node):
+        """Resolve the definition of a class."""
+        for decorator in node.decorator_list:
+            self.visit(decorator)
+        type_params = getattr(node, "type_params", None)
+        if type_params:
+            self._visit_type_params(node)
+        for base in node.bases + node.keywords:
+            self.visit(base)
+        self.stack.append(_Scope(CLASS))
+        nested, self.nested = self.nested, True
+        for stmt in node.body:
+            self.visit(stmt)
+        self.nested = nested
+        self.stack.pop()
+        if type_params:
+            self.stack.pop()
+        self.store(node.name)
+
+    def visit_TypeAlias(self, node):
+        """Resolve a `type` statement, deferring its value."""
+        self._visit_type_params(node)
+        self.defer(lambda: self.visit(node.value), BARE)
+        self.stack.pop()
+        self.visit(node.name)
+
+    def _visit_comprehension(self, node):
+        # The first iterable is evaluated in the enclosing scope
+        first = node.generators[0]
+        self.visit(first.iter)
+        self.stack.append(_Scope(COMPREHENSION))
+        self.visit_children(first, omit=("iter",))
+        for generator in node.generators[1:]:
+            self.visit(generator)
+        self.visit_children(node, omit=("generators",))
+        self.stack.pop()
+
+    visit_GeneratorExp = visit_ListComp = visit_SetComp = visit_DictComp = \
+        _visit_comprehension
+
+    # Annotations
+
+    def visit_annotation(self, node: Optional[ast.AST]):
+        """Resolve a type annotation."""
+        if node is None:
+            return
+        if self.future_annotations or sys.version_info >= (3, 14):
+            self.defer(lambda: self.visit(node), BARE)
+        else:
+            self.visit_as(node, BARE)
+
+    def visit_Constant(self, node):
+        """Resolve the names of string annotations."""
+        if isinstance(node.value, str) and self.annotation:
+            self.defer(lambda: self._visit_string_annotation(node.value),
+                       STRING)
+
+    def _visit_string_annotation(self, source: str):
+        try:
+            tree = ast.parse(source)
+        except SyntaxError:
+            return
+        if len(tree.body) == 1 and isinstance(tree.body[0], ast.Expr):
+            self.visit(tree.body[0].value)
+
+    def get_typing_member(self, node: ast.AST) -> Optional[str]:
+        """Get the `typing` member a name or an attribute refers to."""
+        if isinstance(node, ast.Name):
+            name, attr = node.id, None
+        elif (isinstance(node, ast.Attribute)
+              and isinstance(node.value, ast.Name)):
+            name, attr = node.value.id, node.attr
+        else:
+            return None
+        scope = next((s for s in reversed(self.stack) if name in s), None)
+        member = scope.typing.get(name) if scope else None
+        if attr is None:
+            return member or None
+        return attr if member == "" else None
+
+    def visit_Subscript(self, node):
+        """Skip the values of `Literal` and `Annotated` annotations."""
+        if _is_name_or_attr(node.value, "Literal"):
+            self.visit(node.value)
+            self.visit_as(node.slice, None)
+        elif _is_name_or_attr(node.value, "Annotated"):
+            self.visit(node.value)
+            elts = (node.slice.elts if isinstance(node.slice, ast.Tuple)
+                    else [])
+            if len(elts) < 2:
+                self.visit(node.slice)
+            else:
+                self.visit(elts[0])
+                self.visit_as(elts[1:], None)
+        elif self.get_typing_member(node.value):
+            self.visit_as(node, BARE, self.visit_children)
+        else:
+            self.visit_children(node)
+
+    def visit_Call(self, node):
+        """Resolve the types passed to `typing` functions as annotations."""
+        member = self.get_typing_member(node.func)
+        if member not in TYPING_CALLS:
+            self.visit_children(node)
+            return
+        self.visit_as(node.func, None)
+        args = node.args
+        # Keywords passing types
+        type_keywords = ("bound", "default")
+        if member == "cast":
+            self.visit_as(args[:1], TYPE_EXPRESSION)
+            self.visit_as(args[1:], None)
+            type_keywords = ("typ",)
+        elif member == "assert_type":
+            self.visit_as(args[:1], None)
+            self.visit_as(args[1:], TYPE_EXPRESSION)
+            type_keywords = ()
+        elif member in ("TypeVar", "NewType"):
+            self.visit_as(args[:1], None)
+            self.visit_as(args[1:], TYPE_EXPRESSION)
+            if member == "NewType":
+                type_keywords = ("tp",)
+        elif member in ("ParamSpec", "TypeVarTuple"):
+            self.visit_as(args, None)
+        else:
+            self._visit_typed_fields(member, args)
+            # Fields can be passed as keywords too
+            if sys.version_info < (3, 13 if member == "TypedDict" else 15):
+                type_keywords = [keyword.arg for keyword in node.keywords]
+            else:
+                type_keywords = ()
+        for keyword in node.keywords:
+            self.visit_as(keyword, (TYPE_EXPRESSION
+                                    if keyword.arg in type_keywords
+                                    else None))
+
+    def _visit_typed_fields(self, member: str, args: List[ast.AST]):
+        # e.g. TypedDict("A", {"a": int}) or NamedTuple("A", [("a", int)])
+        self.visit_as(args[:1], None)
+        fields = args[1] if len(args) > 1 else None
+        if member == "TypedDict" and isinstance(fields, ast.Dict):
+            for key, value in zip(fields.keys, fields.values):
+                self.visit_as(key, None)
+                self.visit_as(value, TYPE_EXPRESSION)
+        elif (member == "NamedTuple"
+              and isinstance(fields, (ast.List, ast.Tuple))):
+            for field in fields.elts:
+                if isinstance(field, (ast.List, ast.Tuple)):
+                    self.visit_as(field.elts[:1], None)
+                    self.visit_as(field.elts[1:], TYPE_EXPRESSION)
+                else:
+                    self.visit_as(field, None)
+        else:
+            self.visit_as(args[1:2], None)
+        self.visit_as(args[2:], None)
+
+    def visit_as(self, nodes, annotation: Optional[str], visit=None):
+        """Visit nodes in or out of an annotation."""
+        visit = visit or self.visit
+        previous, self.annotation = self.annotation, annotation
+        for node in (nodes if isinstance(nodes, list) else [nodes]):
+            visit(node)
+        self.annotation = previous
+
+
+def analyze(code: str) -> ScopeReport:
+    """Resolve the names of a code block.
+
+    Args:
+        code: Multiline Python source code
+
+    Returns (ScopeReport): the names of the block and of its global
+        functions
+    """
+    return _ScopeVisitor().run(ast.parse(code))
+
+
+def get_free_variables(report: ScopeReport,
+                       context: Optional[ScopeReport] = None
+                       ) -> Dict[str, Set[str]]:
+    """Get the free variables of the global functions of a code block.
+
+    The free variables of a function are the names it would miss if it were
+    defined right after some context code, i.e., the names that PyFlakes
+    reports undefined in the context code followed by the function.
+
+    Args:
+        report: The analysis of the code block defining the functions
+        context: The analysis of the context code
+
+    Returns (dict): A dictionary [fn_name] -> free variables
+    """
+    if context is None:
+        context = ScopeReport(set(), set(BUILTINS), False, dict())
+    free_vars = dict()
+    for fn_name, names in report.functions.items():
+        if context.star_import:
+            free_vars[fn_name] = set()
+            continue
+        free = context.undefined | (names.globals_used - context.defined)
+        free_vars[fn_name] = free - names.globals_declared - {fn_name}
+    return free_vars
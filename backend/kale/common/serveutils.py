@@ -243,7 +243,16 @@ def serve(model: Any,
 
     # Dump the model
     marshal.set_data_dir(PREDICTOR_MODEL_DIR)
-    model_filepath = marshal.save(model, "model")
+    if predictor == "tensorflow":
+        # TF Serving restores SavedModels, not native Keras files
+        model_filepath = marshal.get_backend_by_name(
+            "TensorflowKerasBackend").wrapped_save(model, "model")
+    elif predictor == "xgboost":
+        # The XGBoost server restores a `model.bst` file
+        model_filepath = marshal.get_backend_by_name(
+            "XGBoostLegacyModelBackend").wrapped_save(model, "model")
+    else:
+        model_filepath = marshal.save(model, "model")
     log.info("Model saved successfully at '%s'", model_filepath)
 
     # Take snapshot
@@ -397,12 +406,15 @@ def create_inference_service(name: str,
 
 
 def _get_runtime_version(predictor: str):
-    library = [backend.display_name
-               for backend in marshal.get_backends().values()
-               if backend.predictor_type == predictor]
+    library = sorted({backend.display_name
+                      for backend in marshal.get_backends().values()
+                      if backend.predictor_type == predictor})
     if not library:
         raise ValueError("The provided predictor is not backed by any"
                          " Kale marshalling backend.")
+    # e.g., both Keras and Tensorflow models are served by TF Serving
+    if predictor in library:
+        library = [predictor]
     if len(library) > 1:
         raise ValueError("Too many backends are matching the '%s' predictor:"
                          " %s" % (predictor, library))
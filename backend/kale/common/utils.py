@@ -141,7 +141,7 @@ def graceful_exit(exit_code):
 
     In case the code is running inside an IPython kernel, this function raises
     a `KaleGracefulExit` exception. This exception is expected to ke captured
-    inside the `kale.common.jputils.capture_streams` function.
+    by the `kale.common.jputils.run_code` function.
     """
     if is_ipython():
         from kale.common.jputils import KaleGracefulExit
@@ -16,9 +16,11 @@ import os
 import re
 import logging
 import argparse
+import functools
 import autopep8
 from typing import NamedTuple
-from jinja2 import Environment, PackageLoader, FileSystemLoader
+from jinja2 import (Environment, PackageLoader, FileSystemLoader,
+                    FileSystemBytecodeCache)
 
 from kale.pipeline import Pipeline, Step, PipelineParam
 from kale.common import kfputils
@@ -30,6 +32,8 @@ NB_FN_TEMPLATE = "new_nb_function_template.jinja2"
 PIPELINE_TEMPLATE = "new_pipeline_template.jinja2"
 PIPELINE_ORIGIN = {"nb": NB_FN_TEMPLATE,
                    "py": PY_FN_TEMPLATE}
+# Directory where the compiled templates are persisted across processes
+TEMPLATE_CACHE_DIR_ENV = "KALE_TEMPLATE_CACHE_DIR"
 
 KFP_DSL_ARTIFACT_IMPORTS = [
     "Dataset",
@@ -41,6 +45,43 @@ KFP_DSL_ARTIFACT_IMPORTS = [
 ]
 
 
+@functools.lru_cache(maxsize=None)
+def get_templating_env(templates_path: str = None) -> Environment:
+    """Get the process-wide Jinja environment of the templates.
+
+    The environment keeps the templates it compiles, so every template is
+    loaded and compiled once per process. When `KALE_TEMPLATE_CACHE_DIR` is
+    set, the compiled bytecode is also persisted there and shared by
+    processes.
+
+    Args:
+        templates_path: A directory of templates, instead of Kale's own
+
+    Returns (Environment): The Jinja environment
+    """
+    if templates_path:
+        loader = FileSystemLoader(templates_path)
+    else:
+        loader = PackageLoader('kale', 'templates')
+    bytecode_cache = None
+    cache_dir = os.environ.get(TEMPLATE_CACHE_DIR_ENV)
+    if cache_dir:
+        os.makedirs(cache_dir, exist_ok=True)
+        bytecode_cache = FileSystemBytecodeCache(cache_dir)
+    # Kale's own templates never change while the process runs
+    template_env = Environment(loader=loader,
+                               bytecode_cache=bytecode_cache,
+                               auto_reload=bool(templates_path))
+    # add custom filters
+    template_env.filters['add_suffix'] = lambda s, suffix: s + suffix
+    template_env.filters['add_prefix'] = lambda s, prefix: prefix + s
+    # quote a string when it is materialized in the template
+    template_env.filters['quote_if_not_none'] = lambda x: ('"%s"' % x
+                                                           if x is not None
+                                                           else None)
+    return template_env
+
+
 class Artifact(NamedTuple):
     """A Step artifact."""
     name: str
@@ -57,9 +98,14 @@ class Compiler:
 
     The Pipeline object is assumed to provide all the necessary information
     (environment, configuration, etc...) for the script to be compiled.
+
+    The style of the generated script is fixed with autopep8, unless
+    `fix_code_style` is False.
     """
-    def __init__(self, pipeline: Pipeline, imports_and_functions: str):
+    def __init__(self, pipeline: Pipeline, imports_and_functions: str,
+                 fix_code_style: bool = True):
         self.pipeline = pipeline
+        self.fix_code_style = fix_code_style
         self.templating_env = None
         self.dsl_source = ""
         self.dsl_script_path = None
@@ -105,6 +151,10 @@ class Compiler:
             for step in self.pipeline.steps
         ]
         pipeline_code = self.generate_pipeline(lightweight_components)
+        if self.fix_code_style:
+            # fix code style using pep8 guidelines, once for the whole
+            # script rather than for every component
+            pipeline_code = autopep8.fix_code(pipeline_code)
         return pipeline_code
 
     def generate_lightweight_component(self, step: Step):
@@ -210,10 +260,13 @@ class Compiler:
             packages_list=packages_list,
             step_inputs=step_inputs,
             step_outputs=step_outputs,
+            step_marshal_config=self.pipeline.get_marshal_config(step),
+            imports_cells_count=getattr(self.pipeline.processor,
+                                        "imports_cells_count", 0),
             kfp_dsl_artifact_imports=KFP_DSL_ARTIFACT_IMPORTS,
             **self.pipeline.config.to_dict()
         )
-        return autopep8.fix_code(fn_code)
+        return fn_code
 
     def generate_pipeline(self, lightweight_components):
         """Generate Python code using the pipeline template."""
@@ -256,8 +309,7 @@ class Compiler:
             component_names=component_names,
             **self.pipeline.config.to_dict()
         )
-        # fix code style using pep8 guidelines
-        return autopep8.fix_code(pipeline_code)
+        return pipeline_code
 
     def _get_package_list_from_imports(self):
         """Extracts unique package names from the tagged imports cell.
@@ -297,23 +349,9 @@ class Compiler:
         return sorted(list(package_names))
 
     def _get_templating_env(self, templates_path=None):
-        if self.templating_env:
-            return self.templating_env
-
-        if templates_path:
-            loader = FileSystemLoader(templates_path)
-        else:
-            loader = PackageLoader('kale', 'templates')
-        template_env = Environment(loader=loader)
-        # add custom filters
-        template_env.filters['add_suffix'] = lambda s, suffix: s + suffix
-        template_env.filters['add_prefix'] = lambda s, prefix: prefix + s
-        # quote a string when it is materialized in the template
-        template_env.filters['quote_if_not_none'] = lambda x: ('"%s"' % x
-                                                               if x is not None
-                                                               else None)
-        self.templating_env = template_env
-        return template_env
+        if not self.templating_env:
+            self.templating_env = get_templating_env(templates_path)
+        return self.templating_env
 
     def _save_compiled_code(self, path: str = None) -> str:
         if not path:
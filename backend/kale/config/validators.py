@@ -198,6 +198,18 @@ class VolumeAccessModeValidator(EnumValidator):
     enum = ("", "rom", "rwo", "rwm")
 
 
+class MmapModeValidator(EnumValidator):
+    """Validates the mode used to memory-map marshalled arrays."""
+
+    enum = ("off", "r", "c")
+
+
+class CompressionValidator(EnumValidator):
+    """Validates the codec used to compress marshalled objects."""
+
+    enum = ("none", "auto", "gzip", "lz4", "zstd")
+
+
 class IsLowerValidator(Validator):
     """Validates if a string is all lowercase."""
 
@@ -63,8 +63,9 @@ class KaleTransformer(kfserving.KFModel):
 
         log.info("Loading transformer's assets...")
         for file in os.listdir(serveutils.TRANSFORMER_ASSETS_DIR):
-            if file in [serveutils.TRANSFORMER_SRC_NOTEBOOK_NAME,
-                        serveutils.TRANSFORMER_FN_ASSET_NAME]:
+            if (file in [serveutils.TRANSFORMER_SRC_NOTEBOOK_NAME,
+                         serveutils.TRANSFORMER_FN_ASSET_NAME]
+                    or file.startswith(".")):
                 continue
             # The marshal mechanism works by looking at the name of the files
             # without extensions.
@@ -14,15 +14,21 @@
 
 # Import all backends so that they register themselves to the Dispatcher
 from .backends import *
-from .backend import get_dispatcher, set_data_dir, get_data_dir
+from .backend import (get_dispatcher, set_data_dir, get_data_dir, set_config,
+                      get_config, report_stats, MarshalConfig)
 
 save = get_dispatcher().save
 load = get_dispatcher().load
+save_all = get_dispatcher().save_all
+load_all = get_dispatcher().load_all
+locate = get_dispatcher().locate
+add_entry = get_dispatcher().add_entry
 get_backend = get_dispatcher().get_backend
 get_backends = get_dispatcher().get_backends
 get_backend_by_name = get_dispatcher().get_backend_by_name
 
 from .decorator import Marshaller
+from .lazy import LazyObject, unwrap
 
 # External code shouldn't care about the Dispatcher instance
 del get_dispatcher
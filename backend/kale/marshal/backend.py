@@ -14,24 +14,137 @@
 
 import os
 import re
+import sys
+import json
+import time
+import hashlib
+import tempfile
 import logging
+import itertools
+import functools
+import threading
 
-from typing import Dict, Any, Type
+from typing import (Callable, Dict, Any, Iterator, List, Optional, Pattern,
+                    Set, Type)
+from concurrent.futures import ThreadPoolExecutor
 
 from kale.common import utils
+from kale.config import Config, Field, validators
+from kale.marshal import lazy, remote, stats, store
 
 log = logging.getLogger(__name__)
 
+# Written inside the data directory. Entries starting with a dot are never
+# considered marshalled objects.
+MANIFEST_FILENAME = ".kale.manifest.json"
+MANIFEST_VERSION = 1
+
+# Created inside the data directory, unless configured otherwise
+STATS_DIRNAME = ".kale.stats"
+
+# With `compression="auto"`, objects are compressed with the first available
+# codec, based on their estimated size.
+AUTO_COMPRESSION_MIN_SIZE = 1024 * 1024
+AUTO_COMPRESSION_LARGE_SIZE = 256 * 1024 * 1024
+AUTO_COMPRESSION_CODECS = ("lz4", "zstd", "gzip")
+AUTO_COMPRESSION_LARGE_CODECS = ("zstd", "lz4", "gzip")
+# Number of items of a container used to estimate its size
+_SIZE_ESTIMATE_SAMPLES = 100
+
+
+class MarshalConfig(Config):
+    """Configure how objects are marshalled in and out of the data dir."""
+
+    # Keep a manifest of the marshalled objects next to them, so that
+    # consumers can find them without listing the data directory.
+    write_manifest = Field(type=bool, default=False)
+    # Number of threads used to save or load multiple objects at once.
+    # Most backends release the GIL while doing I/O and (de)compression.
+    max_workers = Field(type=int, default=1,
+                        validators=[validators.PositiveIntegerValidator])
+    # Memory-map NumPy arrays stored in files of at least
+    # `numpy_mmap_threshold` bytes, instead of reading them in memory.
+    # "r" maps them read-only, "c" copy-on-write (see `numpy.memmap`) and
+    # "off" disables memory-mapping.
+    numpy_mmap_mode = Field(type=str, default="r",
+                            validators=[validators.MmapModeValidator])
+    numpy_mmap_threshold = Field(
+        type=int, default=64 * 1024 * 1024,
+        validators=[validators.PositiveIntegerValidator])
+    # Codec used to compress the objects marshalled by the default backend:
+    # "none", "gzip", "lz4", "zstd", or "auto" to choose one based on the
+    # estimated size of the object. The level is codec-specific, `None`
+    # uses the codec's default.
+    compression = Field(type=str, default="none",
+                        validators=[validators.CompressionValidator])
+    compression_level = Field(type=int)
+    # Write the large contiguous buffers (e.g. of NumPy arrays) held by the
+    # objects marshalled by the default backend to separate files, using
+    # pickle protocol 5. Loading maps them in memory instead of copying
+    # them. Takes precedence over `compression`.
+    out_of_band = Field(type=bool, default=False)
+    out_of_band_min_size = Field(
+        type=int, default=64 * 1024,
+        validators=[validators.PositiveIntegerValidator])
+    # Write a JSON summary of the size and duration of the I/O of every
+    # object at the end of each step, to `<stats_dir>/<step name>.json`.
+    # By default, to a folder of the data dir, including remote ones. See
+    # `kale.marshal.stats`.
+    stats_report = Field(type=bool, default=False)
+    stats_dir = Field(type=str)
+    # Also report the totals of the I/O as KFP pipeline metrics
+    stats_kfp_metrics = Field(type=bool, default=False)
+    # Number of items of an iterator pickled together by `StreamBackend`
+    stream_chunk_size = Field(
+        type=int, default=1000,
+        validators=[validators.PositiveIntegerValidator])
+    # Store every saved object once, under the hash of its content, and
+    # link it by name from the data dir. See `kale.marshal.store`. The store
+    # defaults to a hidden folder inside the data dir.
+    content_store = Field(type=bool, default=False)
+    content_store_dir = Field(type=str)
+    # Restore objects on their first use, instead of when they are loaded.
+    # `load` returns proxies, see `kale.marshal.lazy.LazyObject`.
+    lazy_load = Field(type=bool, default=False)
+    # Transfers to and from an object store data dir. Files larger than the
+    # threshold are transferred in parallel parts. See `kale.marshal.remote`.
+    remote_multipart_threshold = Field(
+        type=int, default=8 * 1024 * 1024,
+        validators=[validators.PositiveIntegerValidator])
+    remote_chunk_size = Field(
+        type=int, default=8 * 1024 * 1024,
+        validators=[validators.PositiveIntegerValidator])
+    remote_max_concurrency = Field(
+        type=int, default=10,
+        validators=[validators.PositiveIntegerValidator])
+
+
 __DATA_DIR = os.path.curdir
+__REMOTE_URI = None
+__CONFIG = MarshalConfig()
 
 
 def set_data_dir(path):
-    """Set the data directory where marshalling happens."""
-    global __DATA_DIR  # noqa: F824
+    """Set the data directory where marshalling happens.
+
+    The data dir can be an object store URI (see `kale.marshal.remote`). In
+    that case, objects are staged in a local temporary directory, which
+    `get_data_dir` returns.
+    """
+    global __DATA_DIR, __REMOTE_URI  # noqa: F824
+    if remote.is_remote_uri(path):
+        __REMOTE_URI = str(path).rstrip("/")
+        path = os.path.join(tempfile.gettempdir(), "kale-marshal-%s" % (
+            hashlib.sha1(__REMOTE_URI.encode()).hexdigest()[:16]))
+    else:
+        __REMOTE_URI = None
     __DATA_DIR = path
     # create dir if not exists
     if not os.path.isdir(__DATA_DIR):
         os.makedirs(__DATA_DIR, exist_ok=True)
+    # The content of the directory might have changed since the last time
+    # it was indexed.
+    get_dispatcher().invalidate_index()
 
 
 def get_data_dir():
@@ -40,6 +153,63 @@ def get_data_dir():
     return __DATA_DIR
 
 
+def get_remote_store() -> Optional[remote.RemoteStore]:
+    """Get the object store of the data dir, None if it is local."""
+    global __REMOTE_URI  # noqa: F824
+    if __REMOTE_URI is None:
+        return None
+    config = get_config()
+    return _get_remote_store(__REMOTE_URI, config.remote_multipart_threshold,
+                             config.remote_chunk_size,
+                             config.remote_max_concurrency)
+
+
+@functools.lru_cache()
+def _get_remote_store(uri: str, multipart_threshold: int, chunk_size: int,
+                      max_concurrency: int) -> remote.RemoteStore:
+    return remote.get_remote_store(uri,
+                                   multipart_threshold=multipart_threshold,
+                                   chunk_size=chunk_size,
+                                   max_concurrency=max_concurrency)
+
+
+def set_config(**kwargs):
+    """Set the marshalling configuration. See `MarshalConfig`'s fields."""
+    global __CONFIG  # noqa: F824
+    __CONFIG = MarshalConfig(**kwargs)
+
+
+def get_config() -> MarshalConfig:
+    """Get the marshalling configuration."""
+    global __CONFIG  # noqa: F824
+    return __CONFIG
+
+
+def report_stats(step_name: str):
+    """Report the I/O of the objects marshalled by a step.
+
+    Does nothing unless `MarshalConfig.stats_report` is set.
+    """
+    config = get_config()
+    if not config.stats_report:
+        return
+    stats_dir = config.stats_dir or os.path.join(get_data_dir(),
+                                                 STATS_DIRNAME)
+    path = os.path.join(stats_dir, step_name + ".json")
+    stats.report(path, kfp_metrics=config.stats_kfp_metrics)
+    remote_store = get_remote_store()
+    if not config.stats_dir and remote_store is not None:
+        # The local data dir just stages the objects of the step. Keep the
+        # report next to the objects, where it outlives the step.
+        remote_store.upload(path, "%s/%s.json" % (STATS_DIRNAME, step_name))
+
+
+def get_content_store_dir() -> str:
+    """Get the directory of the content-addressed store."""
+    return (get_config().content_store_dir
+            or os.path.join(get_data_dir(), store.STORE_DIRNAME))
+
+
 class MarshalBackend(object):
     """Base class for marshalling Python objects.
 
@@ -54,6 +224,16 @@ class MarshalBackend(object):
                    to restore. NOTE: Currently this can be just *one* ext.
     * `obj_type_regex`: A regex which is matched against the `type` of an
                         object.
+    * `compression`: The codec used by the backend to compress the objects
+                     that no specialized backend matches. See
+                     `MarshalConfig.compression`.
+    * `out_of_band`: Whether the backend marshals the objects that no
+                     specialized backend matches using out-of-band buffers.
+                     See `MarshalConfig.out_of_band`.
+
+    Backends that can restore just a subset of the columns of an object
+    (e.g. of a DataFrame) set `column_projection` to True and accept a
+    `columns` argument in `load`.
 
     Take a look at `backend.py` for some examples on how to create custom
     marshal backends.
@@ -63,6 +243,9 @@ class MarshalBackend(object):
     file_type: str = "dillpkl"
     obj_type_regex: str = None
     predictor_type: str = None  # Used for creating serving predictors
+    column_projection: bool = False
+    compression: str = None
+    out_of_band: bool = False
 
     # Set to False if you want your backend not to use the default backend
     # in case of a missing library.
@@ -91,6 +274,8 @@ class MarshalBackend(object):
         abs_path = os.path.join(get_data_dir(), name + "." + self.file_type)
         log.info("Saving %s object using %s: %s to %s",
                  self.display_name, self.name, name, abs_path)
+        start = time.perf_counter()
+        backend = self
         try:
             self.save(obj, abs_path)
         except ImportError as e:
@@ -98,7 +283,17 @@ class MarshalBackend(object):
                 raise e
             log.warning("Failed to import %s (%s). Falling back to default"
                         " backend.", self.display_name, e)
-            self._default_save(obj, name)  # always try the default save
+            abs_path = os.path.join(get_data_dir(),
+                                    name + "." + MarshalBackend.file_type)
+            self._default_save(obj, abs_path)  # always try the default save
+            backend = MarshalBackend()
+        if get_config().stats_report:
+            stats.add_record(stats.MarshalRecord(
+                name, "save", backend.name, backend.file_type,
+                store.get_size(abs_path), time.perf_counter() - start,
+                # iterators are consumed by saving them
+                memory_size=(None if isinstance(obj, Iterator)
+                             else _estimate_size(obj))))
         return abs_path
 
     def save(self, obj: Any, path: str):
@@ -111,24 +306,39 @@ class MarshalBackend(object):
         with open(path, "wb") as f:
             dill.dump(obj, f)
 
-    def wrapped_load(self, name: str) -> Any:
+    def wrapped_load(self, name: str, columns: List[str] = None) -> Any:
         """Wrapper around the public `load` function.
 
         This function provides common logging and exception handling for every
         class that extends the base `MarshalBackend`. `Dispatcher` calls
         directly this function instead of `load`.
+
+        `columns` is a hint: backends that do not support column projection
+        restore the whole object.
         """
         abs_path = os.path.join(get_data_dir(), name + "." + self.file_type)
         log.info("Loading %s file using %s: %s",
                  self.display_name, self.name, name)
+        start = time.perf_counter()
         try:
-            return self.load(abs_path)
+            if columns is not None and self.column_projection:
+                log.info("Restoring just columns %s of %s", columns, name)
+                obj = self.load(abs_path, columns=columns)
+            else:
+                obj = self.load(abs_path)
         except ImportError as e:
             if not self.fallback_on_missing_lib:
                 raise e
             log.warning("Failed to import %s (%s). Falling back to default"
                         " backend.", self.display_name, e)
-            return self._default_load(abs_path)  # always try the default load
+            obj = self._default_load(abs_path)  # always try the default load
+        if get_config().stats_report:
+            # NOTE: Projected columns and memory-mapped data are not read
+            #  entirely, so this is an upper bound of the bytes read.
+            stats.add_record(stats.MarshalRecord(
+                name, "load", self.name, self.file_type,
+                store.get_size(abs_path), time.perf_counter() - start))
+        return obj
 
     def load(self, file_path: str) -> Any:
         """Restore `file_path` to memory."""
@@ -140,9 +350,50 @@ class MarshalBackend(object):
         return dill.load(open(file_path, "rb"))
 
 
+def _estimate_size(obj: Any, depth: int = 3) -> int:
+    """Roughly estimate the size of an object, in bytes.
+
+    Objects exposing `nbytes` (e.g. arrays) report their own size. The size
+    of containers and of objects' attributes is extrapolated from the first
+    items, up to `depth` levels deep.
+    """
+    nbytes = getattr(obj, "nbytes", None)
+    if isinstance(nbytes, int):
+        return nbytes
+    size = sys.getsizeof(obj, 0)
+    if depth == 0:
+        return size
+    if isinstance(obj, dict):
+        samples = list(itertools.islice(obj.items(),
+                                        _SIZE_ESTIMATE_SAMPLES))
+        samples_size = sum(_estimate_size(k, depth - 1)
+                           + _estimate_size(v, depth - 1) for k, v in samples)
+    elif isinstance(obj, (list, tuple, set, frozenset)):
+        samples = list(itertools.islice(obj, _SIZE_ESTIMATE_SAMPLES))
+        samples_size = sum(_estimate_size(i, depth - 1) for i in samples)
+    elif isinstance(getattr(obj, "__dict__", None), dict):
+        return size + _estimate_size(obj.__dict__, depth - 1)
+    else:
+        return size
+    if samples:
+        size += samples_size * len(obj) // len(samples)
+    return size
+
+
 dispatcher = None
 
 
+def _get_type_name(cls: type) -> str:
+    """Get the name of a type as printed by `str(type(obj))`.
+
+    Object types are printed as <class 'module.name'>. The module is omitted
+    for builtin types.
+    """
+    if cls.__module__ == "builtins":
+        return cls.__qualname__
+    return "%s.%s" % (cls.__module__, cls.__qualname__)
+
+
 def get_dispatcher():
     """Get the unique instance of dispatcher.
 
@@ -187,6 +438,21 @@ class Dispatcher(object):
 
     def __init__(self):
         self.backends: Dict[str, MarshalBackend] = dict()
+        # backend name -> compiled `obj_type_regex`
+        self._obj_type_patterns: Dict[str, Pattern] = dict()
+        # type -> resolved backend. `None` means that no specialized backend
+        # matches the type and the default one should be used.
+        self._obj_type_cache: Dict[type, Optional[MarshalBackend]] = dict()
+        # codec -> backend compressing objects with it
+        self._compression_backends: Dict[str, MarshalBackend] = dict()
+        self._out_of_band_backend: Optional[MarshalBackend] = None
+        # basename -> entries of the data dir. Built lazily, see `_get_index`
+        self._index: Optional[Dict[str, List[str]]] = None
+        # Objects can be saved and loaded concurrently, see `save_all`
+        self._index_lock = threading.RLock()
+        # Entries of an object store data dir that are up to date in the
+        # local staging dir
+        self._staged: Set[str] = set()
 
     def register(self, cls: Type[MarshalBackend]) -> Type[MarshalBackend]:
         """Register a new marshalling backend.
@@ -197,7 +463,18 @@ class Dispatcher(object):
         Returns: the class itself
         """
         if cls.__name__ not in self.backends:
-            self.backends[cls.__name__] = cls()
+            backend = cls()
+            self.backends[cls.__name__] = backend
+            if backend.compression:
+                self._compression_backends[backend.compression] = backend
+            if backend.out_of_band:
+                self._out_of_band_backend = backend
+            # Backends without a regex can only be dispatched by file type
+            if backend.obj_type_regex:
+                self._obj_type_patterns[cls.__name__] = re.compile(
+                    backend.obj_type_regex)
+            # A new backend could match types that were already resolved
+            self._obj_type_cache.clear()
         return cls
 
     def get_backend(self, obj: Any):
@@ -221,8 +498,18 @@ class Dispatcher(object):
             obj: Object to be marshalled
             obj_name: Name of the object to be saved
         """
+        # The input of a step might be saved again as its output
+        obj = lazy.unwrap(obj)
         try:
-            return self._dispatch_obj_type(obj).wrapped_save(obj, obj_name)
+            # A previous save might have used a different backend, or linked
+            # the object to a store that must not be written through.
+            self._remove_entries(obj_name)
+            path = self._dispatch_obj_type(obj).wrapped_save(obj, obj_name)
+            if get_config().content_store:
+                store.link_to_store(path, get_content_store_dir())
+            self._upload(path)
+            self._add_to_index(path)
+            return path
         except Exception as e:
             error_msg = ("During data passing, Kale could not marshal the"
                          " following object:\n\n  - path: '%s'\n  - type: '%s'"
@@ -231,39 +518,298 @@ class Dispatcher(object):
             log.debug("Original Traceback", exc_info=e.__traceback__)
             utils.graceful_exit(1)
 
-    def load(self, basename: str):
+    def load(self, basename: str, columns: List[str] = None):
         """Restore a file to memory.
 
         Args:
             basename: The name of the serialized object to be loaded
+            columns: The only columns of the object that the caller needs, if
+                known. Just a hint, see `MarshalBackend.column_projection`
 
-        Returns: restored object
+        Returns: restored object, or a `LazyObject` restoring it on first use
+            if `MarshalConfig.lazy_load` is set
         """
         try:
+            # Resolve the backend right away, so that missing objects are
+            # reported by the step loading them, even when lazy
             entry_name = self._unique_ls(basename)
-            return self._dispatch_file_type(entry_name).wrapped_load(basename)
+            backend = self._dispatch_file_type(entry_name)
         except Exception as e:
-            error_msg = ("During data passing, Kale could not load the"
-                         " following file:\n\n\n  - name: '%s'" % basename)
-            log.error(error_msg + self.END_USER_EXC_MSG % e)
-            log.debug("Original Traceback", exc_info=e.__traceback__)
-            utils.graceful_exit(1)
+            self._exit_on_load_error(basename, e)
+        if get_config().lazy_load:
+            return lazy.LazyObject(functools.partial(
+                self._load_with, backend, entry_name, columns))
+        return self._load_with(backend, entry_name, columns)
+
+    def _load_with(self, backend: MarshalBackend, entry_name: str,
+                   columns: List[str] = None):
+        basename = os.path.splitext(entry_name)[0]
+        try:
+            self._download(entry_name)
+            return backend.wrapped_load(basename, columns)
+        except Exception as e:
+            self._exit_on_load_error(basename, e)
+
+    def _exit_on_load_error(self, basename: str, e: Exception):
+        error_msg = ("During data passing, Kale could not load the"
+                     " following file:\n\n\n  - name: '%s'" % basename)
+        log.error(error_msg + self.END_USER_EXC_MSG % e)
+        log.debug("Original Traceback", exc_info=e.__traceback__)
+        utils.graceful_exit(1)
+
+    def save_all(self, objs: Dict[str, Any]) -> Dict[str, str]:
+        """Save multiple objects to file.
+
+        Objects are saved concurrently when `MarshalConfig.max_workers` is
+        greater than one. Failures are reported for every single object, just
+        like `save` does.
+
+        Args:
+            objs: Objects to be marshalled, by name
+
+        Returns: the paths of the saved files, by name
+        """
+        return self._run_all(self.save, {name: (obj, name)
+                                         for name, obj in objs.items()})
+
+    def load_all(self, basenames: List[str],
+                 columns: Dict[str, List[str]] = None) -> Dict[str, Any]:
+        """Restore multiple files to memory.
+
+        Files are loaded concurrently when `MarshalConfig.max_workers` is
+        greater than one. Failures are reported for every single file, just
+        like `load` does.
+
+        Args:
+            basenames: The names of the serialized objects to be loaded
+            columns: The only columns needed for some of the objects, by name.
+                See `load`
+
+        Returns: the restored objects, by name
+        """
+        columns = columns or {}
+        if get_config().lazy_load:
+            # Nothing to parallelize, objects are restored on first use
+            return {basename: self.load(basename, columns.get(basename))
+                    for basename in basenames}
+        return self._run_all(self.load, {
+            basename: (basename, columns.get(basename))
+            for basename in basenames})
 
     @staticmethod
-    def _unique_ls(basename: str):
+    def _run_all(fn: Callable, args: Dict[str, tuple]) -> Dict[str, Any]:
+        max_workers = min(get_config().max_workers, len(args))
+        if max_workers <= 1:
+            return {name: fn(*fn_args) for name, fn_args in args.items()}
+        log.info("Marshalling %d objects using %d threads",
+                 len(args), max_workers)
+        with ThreadPoolExecutor(max_workers=max_workers,
+                                thread_name_prefix="kale-marshal") as executor:
+            futures = {name: executor.submit(fn, *fn_args)
+                       for name, fn_args in args.items()}
+        # Every call has completed at this point and has already reported
+        # its own failure, if any. Re-raise the first one.
+        return {name: future.result() for name, future in futures.items()}
+
+    def locate(self, basename: str) -> str:
+        """Get the path to the file/folder of a saved object.
+
+        Args:
+            basename: The name of the saved object
+        """
+        entry_name = self._unique_ls(basename)
+        self._download(entry_name)
+        return os.path.join(get_data_dir(), entry_name)
+
+    def add_entry(self, path: str) -> str:
+        """Add a file/folder saved by a backend elsewhere to the data dir.
+
+        The object with the same name is replaced. Files are hard-linked when
+        possible, and copied otherwise.
+
+        Args:
+            path: Path to a file/folder saved by a marshal backend
+
+        Returns: the path to the new file/folder in the data dir
+        """
+        entry_name = os.path.basename(path)
+        new_path = os.path.join(get_data_dir(), entry_name)
+        with self._index_lock:
+            self._remove_entries(os.path.splitext(entry_name)[0])
+            store.copy(path, new_path)
+            self._upload(new_path)
+            self._add_to_index(new_path)
+        return new_path
+
+    def invalidate_index(self):
+        """Drop the index of the data directory.
+
+        The index will be rebuilt the next time an object is loaded.
+        """
+        with self._index_lock:
+            self._index = None
+            self._staged.clear()
+
+    def _upload(self, path: str):
+        """Upload a saved file/folder to the object store, if any."""
+        remote_store = get_remote_store()
+        if remote_store is None:
+            return
+        entry_name = os.path.basename(path)
+        remote_store.upload(path, entry_name)
+        with self._index_lock:
+            self._staged.add(entry_name)
+
+    def _download(self, entry_name: str):
+        """Stage an entry of the object store, if any, in the data dir."""
+        remote_store = get_remote_store()
+        if remote_store is None:
+            return
+        with self._index_lock:
+            if entry_name in self._staged:
+                return
+        path = os.path.join(get_data_dir(), entry_name)
+        store.remove(path)  # left over by a previous run
+        remote_store.download(entry_name, path)
+        with self._index_lock:
+            self._staged.add(entry_name)
+
+    def _get_index(self, refresh: bool = False) -> Dict[str, List[str]]:
+        """Get the basename -> entries index of the current data dir.
+
+        Args:
+            refresh: Rebuild the index scanning the data dir, ignoring any
+                manifest.
+        """
+        with self._index_lock:
+            if self._index is None or refresh:
+                manifest = None if refresh else self._read_manifest()
+                if manifest is not None:
+                    self._index = {basename: [obj["file"]]
+                                   for basename, obj in manifest.items()}
+                else:
+                    self._index = self._scan_data_dir()
+            return self._index
+
+    @staticmethod
+    def _scan_data_dir() -> Dict[str, List[str]]:
+        index = dict()
+        remote_store = get_remote_store()
+        if remote_store is not None:
+            for entry_name in remote_store.list_entries():
+                basename = os.path.splitext(entry_name)[0]
+                index.setdefault(basename, []).append(entry_name)
+            return index
+        with os.scandir(get_data_dir()) as entries:
+            for entry in entries:
+                if entry.name.startswith("."):
+                    continue
+                if entry.is_file() or entry.is_dir():
+                    basename = os.path.splitext(entry.name)[0]
+                    index.setdefault(basename, []).append(entry.name)
+        return index
+
+    def _remove_entries(self, basename: str):
+        """Remove the files/folders of a previously saved object."""
+        with self._index_lock:
+            remote_store = get_remote_store()
+            for entry_name in self._get_index().pop(basename, []):
+                store.remove(os.path.join(get_data_dir(), entry_name))
+                if remote_store is not None:
+                    remote_store.delete(entry_name)
+                self._staged.discard(entry_name)
+            if self._has_manifest():
+                self._update_manifest(basename)
+
+    def _add_to_index(self, path: str):
+        """Register a newly saved file/folder to the data dir index."""
+        entry_name = os.path.basename(path)
+        basename = os.path.splitext(entry_name)[0]
+        with self._index_lock:
+            if self._index is not None:
+                entries = self._index.setdefault(basename, [])
+                if entry_name not in entries:
+                    entries.append(entry_name)
+            # An existing manifest is always kept up to date, so that it
+            # can be trusted, whatever the config of the process saving
+            if get_config().write_manifest or self._has_manifest():
+                backend = self._dispatch_file_type(entry_name)
+                self._update_manifest(basename, entry_name,
+                                      backend.__class__.__name__)
+
+    @staticmethod
+    def _has_manifest() -> bool:
+        # Listing an object store is a single request, no need for a
+        # manifest
+        return (get_remote_store() is None
+                and os.path.isfile(os.path.join(get_data_dir(),
+                                                MANIFEST_FILENAME)))
+
+    @staticmethod
+    def _read_manifest() -> Optional[Dict[str, Dict[str, str]]]:
+        path = os.path.join(get_data_dir(), MANIFEST_FILENAME)
+        if get_remote_store() is not None or not os.path.isfile(path):
+            return None
+        try:
+            with open(path, "r") as f:
+                manifest = json.load(f)
+        except (OSError, ValueError) as e:
+            log.warning("Could not read marshal manifest %s: %s", path, e)
+            return None
+        if manifest.get("version") != MANIFEST_VERSION:
+            log.warning("Ignoring marshal manifest %s with unsupported"
+                        " version %s", path, manifest.get("version"))
+            return None
+        return manifest["objects"]
+
+    def _update_manifest(self, basename: str, entry_name: str = None,
+                         backend: str = None):
+        """Add an object to the manifest, or remove it if no `entry_name`."""
+        if get_remote_store() is not None:
+            return
+        import fcntl  # POSIX only, like the manifest
+        path = os.path.join(get_data_dir(), MANIFEST_FILENAME)
+        # Other processes (e.g., steps running in parallel) might be saving
+        # objects to the same directory, so merge with the latest manifest
+        # on disk, one process at a time.
+        with open(path + ".lock", "a") as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            objects = self._read_manifest() or dict()
+            if entry_name is None:
+                if objects.pop(basename, None) is None:
+                    return
+            else:
+                objects[basename] = {"file": entry_name, "backend": backend}
+            tmp_path = "%s.%s" % (path, utils.random_string())
+            with open(tmp_path, "w") as f:
+                json.dump({"version": MANIFEST_VERSION, "objects": objects},
+                          f)
+            os.replace(tmp_path, path)
+
+    @staticmethod
+    def _entries_exist(entries: List[str]) -> bool:
+        # Entries of an object store are staged on load
+        if get_remote_store() is not None:
+            return True
+        return all(os.path.exists(os.path.join(get_data_dir(), entry_name))
+                   for entry_name in entries)
+
+    def _unique_ls(self, basename: str):
         # get the unique file/folder inside _DATA_DIR: there could be
         # multiple files with the same name and different extension.
-        entries = [ls for ls in os.listdir(get_data_dir())
-                   if ((os.path.isfile(os.path.join(get_data_dir(), ls))
-                        or os.path.isdir(os.path.join(get_data_dir(), ls)))
-                       and os.path.splitext(ls)[0] == basename)]
+        entries = self._get_index().get(basename)
+        if not entries or not self._entries_exist(entries):
+            # The object might have been saved or removed by another process
+            # after the index was built, or by one that does not keep the
+            # manifest up to date.
+            entries = self._get_index(refresh=True).get(basename, [])
         log.info("Found %d entries for basename '%s': %s",
                  len(entries), basename, entries)
         if not entries:
             log.info("Looking for unique file/folder with basename '%s' in %s",
                      basename, get_data_dir())
             raise ValueError("No file or folder found with basename '%s' in %s"
-                             % basename, get_data_dir())
+                             % (basename, get_data_dir()))
         if len(entries) > 1:
             raise ValueError("Found multiple files/folders with name %s: %s"
                              % (basename, entries))
@@ -272,30 +818,83 @@ class Dispatcher(object):
     def _dispatch_obj_type(self, obj: Any) -> MarshalBackend:
         """Dispatch to a backend based on the object's type matching regex.
 
+        The resolution is cached per type, so that objects of the same type
+        do not go through the regex matching again.
+
         Args:
             obj: any Python object
         """
-        # object types are printed as <class 'obj type'>
-        _type = re.sub(r"'>$", "",
-                       re.sub(r"^<class '", "",
-                              str(type(obj))))
-        # type of base class
-        _type_base = re.sub(r"'>$", "",
-                            re.sub(r"^<class '", "",
-                                   str(obj.__class__.__bases__[0])))
-        _backends = [backend for backend in self.backends.values()
-                     if re.match(backend.obj_type_regex, _type)
-                     or re.match(backend.obj_type_regex, _type_base)]
-        if len(_backends) > 1:
-            raise RuntimeError("Too many matching marshalling backends for"
-                               " object type %s (base type %s): %s"
-                               % (_type, _type_base, _backends))
-        if not _backends:
-            log.debug("No backends found for type %s (%s). Falling back to"
-                      " default backend." % (_type, _type_base))
+        _type = type(obj)
+        try:
+            backend = self._obj_type_cache[_type]
+        except KeyError:
+            backend = self._resolve_obj_type(_type)
+            self._obj_type_cache[_type] = backend
+        if backend is None:
+            return self._get_default_backend(obj)
+        return backend
+
+    def _get_default_backend(self, obj: Any) -> MarshalBackend:
+        """Get the backend for objects that no specialized backend matches.
+
+        This is the default backend, writing out-of-band buffers or
+        compressing objects according to `MarshalConfig`. Codecs whose library
+        is not installed are skipped.
+
+        Args:
+            obj: any Python object
+        """
+        config = get_config()
+        if config.out_of_band and self._out_of_band_backend:
+            return self._out_of_band_backend
+        compression = config.compression
+        if compression == "none":
             return MarshalBackend()
+        if compression != "auto":
+            codecs = (compression,)
         else:
-            return _backends[0]
+            size = _estimate_size(obj)
+            if size < AUTO_COMPRESSION_MIN_SIZE:
+                return MarshalBackend()
+            codecs = (AUTO_COMPRESSION_LARGE_CODECS
+                      if size >= AUTO_COMPRESSION_LARGE_SIZE
+                      else AUTO_COMPRESSION_CODECS)
+        for codec in codecs:
+            backend = self._compression_backends.get(codec)
+            if backend and backend.is_available():
+                return backend
+        log.warning("No library available for compression codecs %s. Saving"
+                    " uncompressed.", codecs)
+        return MarshalBackend()
+
+    def _resolve_obj_type(self, _type: type) -> Optional[MarshalBackend]:
+        """Find the backend whose regex matches a type or its closest base.
+
+        The classes of the type's MRO are matched in order, so the most
+        specialized class with a matching backend wins.
+
+        Args:
+            _type: the type of the object to be marshalled
+
+        Returns: the matching backend, None if no backend matches
+        """
+        for cls in _type.__mro__:
+            if cls is object:
+                break
+            type_name = _get_type_name(cls)
+            _backends = [self.backends[name]
+                         for name, pattern in self._obj_type_patterns.items()
+                         if pattern.match(type_name)]
+            if len(_backends) > 1:
+                raise RuntimeError("Too many matching marshalling backends for"
+                                   " object type %s (matching type %s): %s"
+                                   % (_get_type_name(_type), type_name,
+                                      _backends))
+            if _backends:
+                return _backends[0]
+        log.debug("No backends found for type %s. Falling back to default"
+                  " backend." % _get_type_name(_type))
+        return None
 
     def _dispatch_file_type(self, filename: str) -> MarshalBackend:
         """Dispatch to a backend based on the matching file type.
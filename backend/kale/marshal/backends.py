@@ -12,9 +12,18 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
+import io
+import os
+import mmap
+import shutil
+import struct
 import logging
+import inspect
+import itertools
+import importlib.util
 
-from kale.marshal.backend import get_dispatcher, MarshalBackend
+from kale.marshal.backend import (get_dispatcher, get_config, get_data_dir,
+                                  MarshalBackend)
 
 
 log = logging.getLogger(__name__)
@@ -23,6 +32,173 @@ log = logging.getLogger(__name__)
 register_backend = get_dispatcher().register
 
 
+class CompressedBackend(MarshalBackend):
+    """Base class for backends compressing generic objects.
+
+    Objects are pickled with dill, just like the default backend does, and
+    streamed through a compression codec. These backends don't match any
+    object type: `Dispatcher` uses them in place of the default backend,
+    based on `MarshalConfig.compression`. Each codec has its own file type,
+    so that files are restored by the right backend.
+    """
+    library: str = None
+
+    # The default backend can't restore compressed files. `Dispatcher` does
+    # not select backends whose library is not installed.
+    fallback_on_missing_lib = False
+
+    def is_available(self) -> bool:
+        """Check whether the library implementing the codec is installed."""
+        return importlib.util.find_spec(self.library) is not None
+
+    def open(self, path, mode, level=None):
+        """Open a file, compressing or decompressing its content."""
+        raise NotImplementedError
+
+    def save(self, obj, path):
+        """Save a compressed pickle."""
+        import dill
+        with self.open(path, "wb", get_config().compression_level) as f:
+            dill.dump(obj, f)
+
+    def load(self, file_path):
+        """Restore a compressed pickle."""
+        import dill
+        with self.open(file_path, "rb") as f:
+            return dill.load(f)
+
+
+@register_backend
+class GzipBackend(CompressedBackend):
+    """Marshal generic objects to gzip-compressed pickles."""
+    name = "Gzip backend"
+    file_type = "dillgz"
+    compression = "gzip"
+    library = "gzip"
+
+    def open(self, path, mode, level=None):
+        """Open a gzip file."""
+        import gzip
+        # gzip defaults to the slowest level, 9
+        return gzip.open(path, mode, compresslevel=6 if level is None
+                         else level)
+
+
+@register_backend
+class LZ4Backend(CompressedBackend):
+    """Marshal generic objects to LZ4-compressed pickles."""
+    name = "LZ4 backend"
+    file_type = "dilllz4"
+    compression = "lz4"
+    library = "lz4"
+
+    def open(self, path, mode, level=None):
+        """Open an LZ4 frame file."""
+        import lz4.frame
+        kwargs = {} if level is None else {"compression_level": level}
+        return lz4.frame.open(path, mode, **kwargs)
+
+
+@register_backend
+class ZstdBackend(CompressedBackend):
+    """Marshal generic objects to Zstandard-compressed pickles."""
+    name = "Zstandard backend"
+    file_type = "dillzst"
+    compression = "zstd"
+    library = "zstandard"
+
+    def open(self, path, mode, level=None):
+        """Open a Zstandard file, compressing with all the available cores."""
+        import zstandard
+        if "w" in mode:
+            kwargs = {} if level is None else {"level": level}
+            cctx = zstandard.ZstdCompressor(threads=-1, **kwargs)
+            return zstandard.open(path, mode, cctx=cctx)
+        # the decompression reader does not support `readline`, which
+        # unpickling requires
+        return io.BufferedReader(zstandard.open(path, mode))
+
+
+@register_backend
+class OutOfBandBackend(MarshalBackend):
+    """Marshal generic objects using pickle protocol 5 out-of-band buffers.
+
+    The object is pickled with dill to `<path>/object.pkl`, while its large
+    contiguous buffers are written as they are to `<path>/<n>.buf` files,
+    without copying them into the pickle stream. Loading maps the buffer
+    files in memory copy-on-write, so the restored objects are writable but
+    the files are never modified.
+    """
+    name = "Out-of-band backend"
+    file_type = "dilloob"
+    out_of_band = True
+
+    OBJECT_FILENAME = "object.pkl"
+    BUFFER_FILENAME = "%d.buf"
+
+    def save(self, obj, path):
+        """Save an object and its out-of-band buffers."""
+        if os.path.isdir(path):
+            shutil.rmtree(path)
+        os.makedirs(path)
+        min_size = get_config().out_of_band_min_size
+        counter = itertools.count()
+
+        def _buffer_callback(buf):
+            try:
+                raw = buf.raw()
+            except BufferError:  # not contiguous
+                return True
+            if raw.nbytes < min_size:
+                return True  # serialize in-band
+            buf_path = os.path.join(path, self.BUFFER_FILENAME % next(counter))
+            with open(buf_path, "wb") as f:
+                f.write(raw)
+            return False
+
+        with open(os.path.join(path, self.OBJECT_FILENAME), "wb") as f:
+            _get_out_of_band_pickler()(
+                f, protocol=5, buffer_callback=_buffer_callback).dump(obj)
+
+    def load(self, file_path):
+        """Restore an object, mapping its out-of-band buffers in memory."""
+        import dill
+
+        def _buffers():
+            for i in itertools.count():
+                buf_path = os.path.join(file_path, self.BUFFER_FILENAME % i)
+                if not os.path.exists(buf_path):
+                    return
+                with open(buf_path, "rb") as f:
+                    # the mapping outlives the file descriptor
+                    yield mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_COPY)
+
+        with open(os.path.join(file_path, self.OBJECT_FILENAME), "rb") as f:
+            return dill.load(f, buffers=_buffers())
+
+
+def _get_out_of_band_pickler():
+    """Get a dill Pickler that lets NumPy arrays use out-of-band buffers.
+
+    dill pickles arrays with their protocol 2 `__reduce__`, which always
+    copies the data in-band.
+    """
+    import dill
+
+    class _OutOfBandPickler(dill.Pickler):
+        def save(self, obj, save_persistent_id=True):
+            obj_type = type(obj)
+            if (obj_type.__module__ == "numpy"
+                    and obj_type.__name__ == "ndarray"
+                    and id(obj) not in self.memo):
+                self.framer.commit_frame()
+                self.save_reduce(*obj.__reduce_ex__(self.proto), obj=obj)
+                return
+            super().save(obj, save_persistent_id)
+
+    return _OutOfBandPickler
+
+
 @register_backend
 class FunctionBackend(MarshalBackend):
     """Marshal Python functions."""
@@ -32,6 +208,63 @@ class FunctionBackend(MarshalBackend):
     obj_type_regex = r"function"
 
 
+@register_backend
+class StreamBackend(MarshalBackend):
+    """Marshal iterators and generators as a stream of pickled chunks.
+
+    The iterator is consumed while it is saved, writing its items in chunks
+    of `MarshalConfig.stream_chunk_size`. Every chunk is a list pickled with
+    dill and prefixed by its length. Loading returns an iterator that reads
+    one chunk at a time, so neither side holds all the items in memory.
+
+    NOTE: Like any iterator, the restored one can be consumed only once.
+    The infinite iterators of `itertools` are left to the default backend.
+    """
+    name = "Stream backend"
+    display_name = "stream"
+    file_type = "dillstream"
+    obj_type_regex = (r"(generator|map|filter|zip|enumerate|reversed"
+                      r"|\w*iterator"
+                      r"|itertools\.(?!(count|cycle|repeat)$)\w+)$")
+
+    LENGTH_FORMAT = "<Q"
+
+    def save(self, obj, path):
+        """Save the items of an iterator, consuming it."""
+        import dill
+        chunk_size = get_config().stream_chunk_size
+        with open(path, "wb") as f:
+            while True:
+                chunk = list(itertools.islice(obj, chunk_size))
+                if not chunk:
+                    break
+                data = dill.dumps(chunk)
+                f.write(struct.pack(self.LENGTH_FORMAT, len(data)))
+                f.write(data)
+
+    def load(self, file_path):
+        """Restore an iterator over the saved items."""
+        # Fail here, not on the first `next()`, if the file is missing
+        f = open(file_path, "rb")
+        return self._iter_items(f)
+
+    def _iter_items(self, f):
+        import dill
+        header_size = struct.calcsize(self.LENGTH_FORMAT)
+        with f:
+            while True:
+                header = f.read(header_size)
+                if not header:
+                    return
+                if len(header) < header_size:
+                    raise EOFError("Truncated stream: %s" % f.name)
+                data_size, = struct.unpack(self.LENGTH_FORMAT, header)
+                data = f.read(data_size)
+                if len(data) < data_size:
+                    raise EOFError("Truncated stream: %s" % f.name)
+                yield from dill.loads(data)
+
+
 @register_backend
 class SKLearnBackend(MarshalBackend):
     """Marshal SKLearn objects."""
@@ -66,23 +299,44 @@ class NumpyBackend(MarshalBackend):
     obj_type_regex = r"numpy\..*"
 
     def save(self, obj, path):
-        """Save a Numpy object."""
+        """Save a Numpy object.
+
+        `np.save` writes an uncompressed `.npy` file, padding the header so
+        that the array data is aligned. This keeps the file mappable by
+        `load`.
+        """
         import numpy as np
         np.save(path, obj)
 
     def load(self, file_path):
-        """Restore a Numpy object."""
+        """Restore a Numpy object.
+
+        Large arrays are memory-mapped according to `MarshalConfig`, so that
+        only the pages that are actually accessed are read from disk.
+        """
         import numpy as np
+        config = get_config()
+        if (config.numpy_mmap_mode != "off"
+                and os.path.getsize(file_path) >= config.numpy_mmap_threshold):
+            try:
+                return np.load(file_path, mmap_mode=config.numpy_mmap_mode)
+            except ValueError as e:
+                # e.g., arrays of Python objects cannot be memory-mapped
+                log.debug("Could not memory-map %s: %s", file_path, e)
         return np.load(file_path)
 
 
 @register_backend
 class PandasBackend(MarshalBackend):
-    """Marshal Pandas objects."""
+    """Marshal Pandas objects.
+
+    DataFrames are marshalled by `PandasDataFrameBackend`, which falls back to
+    this backend for the frames that Parquet cannot store.
+    """
     name = "Pandas backend"
     display_name = "pandas"
     file_type = "pdpkl"
-    obj_type_regex = r"pandas\..*(DataFrame|Series)"
+    obj_type_regex = r"pandas\..*Series"
 
     def save(self, obj, path):
         """Save a Pandas object."""
@@ -95,12 +349,79 @@ class PandasBackend(MarshalBackend):
         return pd.read_pickle(file_path)
 
 
+@register_backend
+class PandasDataFrameBackend(MarshalBackend):
+    """Marshal Pandas DataFrames to the columnar Parquet format.
+
+    Frames are converted to and from Arrow using multiple threads and can be
+    restored just partially, reading only some of their columns.
+    """
+    name = "Pandas DataFrame backend"
+    display_name = "pandas-parquet"
+    file_type = "parquet"
+    obj_type_regex = r"pandas\..*DataFrame"
+    column_projection = True
+
+    # A `.parquet` file can't be restored by the default backend. Saving
+    # falls back to `PandasBackend` instead, see `wrapped_save`.
+    fallback_on_missing_lib = False
+
+    def wrapped_save(self, obj, name):
+        """Save a DataFrame, falling back to pickle if Parquet can't store it.
+
+        Parquet requires string column names and columns of a single type.
+        """
+        if not all(isinstance(c, str) for c in obj.columns):
+            log.info("DataFrame %s has non-string column names. Saving it"
+                     " using %s", name, PandasBackend.name)
+            return PandasBackend().wrapped_save(obj, name)
+        try:
+            return super().wrapped_save(obj, name)
+        except (ImportError, TypeError, ValueError) as e:
+            # pyarrow's `ArrowInvalid` and `ArrowTypeError` are subclasses of
+            # `ValueError` and `TypeError`
+            log.warning("Failed to save DataFrame %s to Parquet (%s). Falling"
+                        " back to %s.", name, e, PandasBackend.name)
+            path = os.path.join(get_data_dir(), name + "." + self.file_type)
+            if os.path.exists(path):
+                os.remove(path)
+            return PandasBackend().wrapped_save(obj, name)
+
+    def save(self, obj, path):
+        """Save a Pandas DataFrame."""
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+        table = pa.Table.from_pandas(obj, nthreads=os.cpu_count())
+        pq.write_table(table, path)
+
+    def load(self, file_path, columns=None):
+        """Restore a Pandas DataFrame, or just some of its columns."""
+        import pyarrow.parquet as pq
+        try:
+            # `use_pandas_metadata` restores the index even when projecting
+            table = pq.read_table(file_path, columns=columns,
+                                  use_threads=True, use_pandas_metadata=True)
+        except ValueError as e:
+            if columns is None:
+                raise
+            # e.g. a column selected by the step's source does not exist
+            log.warning("Failed to restore columns %s of %s (%s). Restoring"
+                        " the whole DataFrame.", columns, file_path, e)
+            table = pq.read_table(file_path, use_threads=True)
+        return table.to_pandas(use_threads=True)
+
+
 @register_backend
 class XGBoostModelBackend(MarshalBackend):
-    """Marshal XGBoost Model object."""
+    """Marshal XGBoost Model object.
+
+    Models are saved in the UBJSON format, which XGBoost selects based on the
+    file extension. Unlike the legacy binary format, it is forward compatible
+    and preserves the whole model, including its feature names and types.
+    """
     name = "XGBoost Model backend"
     display_name = "xgboost"
-    file_type = "bst"
+    file_type = "ubj"
     obj_type_regex = r"xgboost\.core\.Booster"
     predictor_type = "xgboost"
 
@@ -116,6 +437,20 @@ class XGBoostModelBackend(MarshalBackend):
         return obj_xgb
 
 
+@register_backend
+class XGBoostLegacyModelBackend(XGBoostModelBackend):
+    """Restore XGBoost Model objects saved in the legacy binary format.
+
+    Models are no longer marshalled in this format, see
+    `XGBoostModelBackend`. `serveutils.serve` still exports them in it, for
+    the KFServing XGBoost server expects a `model.bst` file.
+    """
+    name = "XGBoost legacy Model backend"
+    file_type = "bst"
+    obj_type_regex = None
+    predictor_type = None
+
+
 @register_backend
 class XGBoostDMatrixBackend(MarshalBackend):
     """Marshal XGBoost DMatrix object."""
@@ -136,22 +471,44 @@ class XGBoostDMatrixBackend(MarshalBackend):
 
 @register_backend
 class PyTorchBackend(MarshalBackend):
-    """Marshal PyTorch objects."""
+    """Marshal PyTorch modules and tensors.
+
+    Objects are saved with `torch.save`, which writes the storages of their
+    tensors as separate records of a zip archive. Restoring them memory-maps
+    the archive, so that tensors are paged in from disk when they are used.
+
+    Whole modules are pickled with dill, not just their state dicts. Classes
+    defined in the notebook are pickled by value, but the classes of other
+    modules must be importable where the module is restored.
+
+    NOTE: KFServing's PyTorch server restores state dicts along with the
+    source of the model's class, so modules cannot be served as saved here.
+    """
     name = "PyTorch backend"
     display_name = "pytorch"
     file_type = "pt"
-    obj_type_regex = r"torch\.nn\.modules\.module\.Module"
+    obj_type_regex = r"torch\.(nn\.modules\.module\.Module|Tensor)$"
 
     def save(self, obj, path):
         """Save a PyTorch object."""
+        import dill
         import torch
-        model_script = torch.jit.script(obj)
-        model_script.save(path)
+        # dill pickles the classes defined in the notebook by value
+        torch.save(obj, path, pickle_module=dill)
 
     def load(self, file_path):
         """Restore a PyTorch object."""
+        import dill
         import torch
-        obj_torch = torch.jit.load(file_path)
+        # `mmap` is not supported by torch<2.1, `weights_only` by torch<1.13
+        parameters = inspect.signature(torch.load).parameters
+        kwargs = {name: value
+                  for name, value in (("mmap", True), ("weights_only", False))
+                  if name in parameters}
+        obj_torch = torch.load(file_path, pickle_module=dill, **kwargs)
+        if not isinstance(obj_torch, torch.jit.ScriptModule):
+            return obj_torch
+        # Files written by older versions of Kale hold scripted modules
         # `jit.load` returns a `ScirptModule` object.
         # To turn it into a PyTorch `Module` again
         # we pass it inside a `Sequential` container.
@@ -167,11 +524,16 @@ class PyTorchBackend(MarshalBackend):
 
 @register_backend
 class KerasBackend(MarshalBackend):
-    """Marshal Keras objects."""
+    """Marshal Keras objects to the native `.keras` format.
+
+    TF Serving restores SavedModels instead, so `serveutils.serve` saves
+    Keras models to serve with `TensorflowKerasBackend`.
+    """
     name = "Keras backend"
     display_name = "keras"
     file_type = "keras"
     obj_type_regex = r"keras\..*"
+    predictor_type = "tensorflow"
 
     def save(self, obj, path):
         """Save a Keras object."""
@@ -198,7 +560,11 @@ class TensorflowKerasBackend(MarshalBackend):
         import tensorflow.keras  # noqa: F401
         # XXX: Adding `/1` since tensorflow serve expects the model's models
         #  to be saved under a versioned folder
-        obj.save(path + "/1")
+        try:
+            obj.save(path + "/1")
+        except ValueError:
+            # Keras 3 saves only `.keras` files and exports SavedModels
+            obj.export(path + "/1")
 
     def load(self, file_path):
         """Restore a Tensorflow Keras object."""
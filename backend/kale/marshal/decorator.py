@@ -17,7 +17,7 @@ import logging
 
 from typing import Dict, List, Any, Union, NamedTuple
 
-import marshal as marshal_utils
+from kale import marshal as marshal_utils
 
 
 log = logging.getLogger(__name__)
@@ -76,13 +76,12 @@ class Marshaller:
         self._save(results)
 
     def _load(self):
-        loads = []  # load in the same order as in self._ins.
-        for var_name in self._ins:
-            if var_name not in self._parameters:
-                loads.append(marshal_utils.load(var_name))
-            else:
-                loads.append(self._parameters[var_name].param_value)
-        return loads
+        loads = marshal_utils.load_all([var_name for var_name in self._ins
+                                        if var_name not in self._parameters])
+        # return the objects in the same order as in self._ins.
+        return [loads[var_name] if var_name not in self._parameters
+                else self._parameters[var_name].param_value
+                for var_name in self._ins]
 
     def _save(self, values):
         if self._introspect:  # get vars from function locals
@@ -90,7 +89,8 @@ class Marshaller:
                 if var_name not in self._func.locals:
                     raise RuntimeError("Variable %s not found in function's"
                                        " locals" % var_name)
-                marshal_utils.save(self._func.locals[var_name], var_name)
+            marshal_utils.save_all({var_name: self._func.locals[var_name]
+                                    for var_name in self._outs})
         else:  # get vars from return value
             if len(self._outs) == 0:
                 return
@@ -102,8 +102,7 @@ class Marshaller:
                                        " returning a tuple, make sure the "
                                        " return value it is properly"
                                        " unpacked.")
-                for name, value in dict(zip(self._outs, values)).items():
-                    marshal_utils.save(value, name)
+                marshal_utils.save_all(dict(zip(self._outs, values)))
             else:  # any other object?
                 if len(self._outs) > 1:
                     raise RuntimeError("The function returned a single object,"
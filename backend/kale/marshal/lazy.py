@@ -0,0 +1,175 @@
+# Copyright 2020 The Kale Authors
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Proxies restoring marshalled objects on first use.
+
+The proxy forwards attribute access and the most common special methods to
+the restored object, following the approach of Django's `LazyObject`.
+"""
+
+import math
+import operator
+import threading
+
+from typing import Any, Callable
+
+_empty = object()
+
+
+def _proxy_method(func):
+    def inner(self, *args):
+        return func(self._get_wrapped(), *args)
+    return inner
+
+
+def _proxy_reflected_method(func):
+    def inner(self, other):
+        return func(other, self._get_wrapped())
+    return inner
+
+
+class LazyObject:
+    """A proxy to a marshalled object, restored on first use.
+
+    `isinstance` checks are forwarded as well. Note that `type()` still
+    returns `LazyObject`.
+    """
+
+    _wrapped = None
+
+    def __init__(self, loader: Callable[[], Any]):
+        self.__dict__["_loader"] = loader
+        self.__dict__["_wrapped"] = _empty
+        self.__dict__["_lock"] = threading.Lock()
+
+    def _get_wrapped(self) -> Any:
+        if self._wrapped is _empty:
+            with self._lock:
+                if self._wrapped is _empty:
+                    self.__dict__["_wrapped"] = self._loader()
+                    self.__dict__["_loader"] = None
+        return self._wrapped
+
+    def __getattr__(self, name):
+        """Get an attribute of the restored object."""
+        return getattr(self._get_wrapped(), name)
+
+    def __setattr__(self, name, value):
+        """Set an attribute of the restored object."""
+        setattr(self._get_wrapped(), name, value)
+
+    def __delattr__(self, name):
+        """Delete an attribute of the restored object."""
+        delattr(self._get_wrapped(), name)
+
+    def __call__(self, *args, **kwargs):
+        """Call the restored object."""
+        return self._get_wrapped()(*args, **kwargs)
+
+    def __enter__(self):
+        """Enter the context of the restored object."""
+        return self._get_wrapped().__enter__()
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        """Exit the context of the restored object."""
+        return self._get_wrapped().__exit__(exc_type, exc_value, traceback)
+
+    def __reduce_ex__(self, protocol):
+        """Pickle (and copy) the restored object instead of the proxy."""
+        return self._get_wrapped().__reduce_ex__(protocol)
+
+    __class__ = property(_proxy_method(operator.attrgetter("__class__")))
+    __dir__ = _proxy_method(dir)
+    __repr__ = _proxy_method(repr)
+    __str__ = _proxy_method(str)
+    __bytes__ = _proxy_method(bytes)
+    __format__ = _proxy_method(format)
+    __bool__ = _proxy_method(bool)
+    __int__ = _proxy_method(int)
+    __float__ = _proxy_method(float)
+    __complex__ = _proxy_method(complex)
+    __index__ = _proxy_method(operator.index)
+    __round__ = _proxy_method(round)
+    __trunc__ = _proxy_method(math.trunc)
+    __floor__ = _proxy_method(math.floor)
+    __ceil__ = _proxy_method(math.ceil)
+    __hash__ = _proxy_method(hash)
+    __len__ = _proxy_method(len)
+    __iter__ = _proxy_method(iter)
+    __reversed__ = _proxy_method(reversed)
+    __next__ = _proxy_method(next)
+    __contains__ = _proxy_method(operator.contains)
+    __getitem__ = _proxy_method(operator.getitem)
+    __setitem__ = _proxy_method(operator.setitem)
+    __delitem__ = _proxy_method(operator.delitem)
+    __eq__ = _proxy_method(operator.eq)
+    __ne__ = _proxy_method(operator.ne)
+    __lt__ = _proxy_method(operator.lt)
+    __le__ = _proxy_method(operator.le)
+    __gt__ = _proxy_method(operator.gt)
+    __ge__ = _proxy_method(operator.ge)
+    __neg__ = _proxy_method(operator.neg)
+    __pos__ = _proxy_method(operator.pos)
+    __abs__ = _proxy_method(operator.abs)
+    __invert__ = _proxy_method(operator.invert)
+    __add__ = _proxy_method(operator.add)
+    __radd__ = _proxy_reflected_method(operator.add)
+    __sub__ = _proxy_method(operator.sub)
+    __rsub__ = _proxy_reflected_method(operator.sub)
+    __mul__ = _proxy_method(operator.mul)
+    __rmul__ = _proxy_reflected_method(operator.mul)
+    __matmul__ = _proxy_method(operator.matmul)
+    __rmatmul__ = _proxy_reflected_method(operator.matmul)
+    __truediv__ = _proxy_method(operator.truediv)
+    __rtruediv__ = _proxy_reflected_method(operator.truediv)
+    __floordiv__ = _proxy_method(operator.floordiv)
+    __rfloordiv__ = _proxy_reflected_method(operator.floordiv)
+    __mod__ = _proxy_method(operator.mod)
+    __rmod__ = _proxy_reflected_method(operator.mod)
+    __pow__ = _proxy_method(operator.pow)
+    __rpow__ = _proxy_reflected_method(operator.pow)
+    __and__ = _proxy_method(operator.and_)
+    __rand__ = _proxy_reflected_method(operator.and_)
+    __or__ = _proxy_method(operator.or_)
+    __ror__ = _proxy_reflected_method(operator.or_)
+    __xor__ = _proxy_method(operator.xor)
+    __rxor__ = _proxy_reflected_method(operator.xor)
+    __lshift__ = _proxy_method(operator.lshift)
+    __rlshift__ = _proxy_reflected_method(operator.lshift)
+    __rshift__ = _proxy_method(operator.rshift)
+    __rrshift__ = _proxy_reflected_method(operator.rshift)
+    __divmod__ = _proxy_method(divmod)
+    __rdivmod__ = _proxy_reflected_method(divmod)
+    # In-place operators rebind the name to the result, i.e. to the restored
+    # object itself for mutable objects, and to a new object otherwise.
+    __iadd__ = _proxy_method(operator.iadd)
+    __isub__ = _proxy_method(operator.isub)
+    __imul__ = _proxy_method(operator.imul)
+    __imatmul__ = _proxy_method(operator.imatmul)
+    __itruediv__ = _proxy_method(operator.itruediv)
+    __ifloordiv__ = _proxy_method(operator.ifloordiv)
+    __imod__ = _proxy_method(operator.imod)
+    __ipow__ = _proxy_method(operator.ipow)
+    __iand__ = _proxy_method(operator.iand)
+    __ior__ = _proxy_method(operator.ior)
+    __ixor__ = _proxy_method(operator.ixor)
+    __ilshift__ = _proxy_method(operator.ilshift)
+    __irshift__ = _proxy_method(operator.irshift)
+
+
+def unwrap(obj: Any) -> Any:
+    """Get the object behind a `LazyObject`, restoring it if needed."""
+    if type(obj) is LazyObject:
+        return obj._get_wrapped()
+    return obj
@@ -0,0 +1,261 @@
+# Copyright 2020 The Kale Authors
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Marshal data dirs living in an object store.
+
+Backends keep saving and loading local files. When the data dir is a URI,
+the files are saved to a local staging dir and uploaded to the object store,
+or downloaded to the staging dir before being loaded. Every entry of the
+data dir (a file, or a folder of files) is stored under the URI's prefix,
+keeping its name.
+
+Supported URIs:
+    s3://<bucket>/<prefix>: An S3-compatible object store, e.g. MinIO. Set
+        `AWS_ENDPOINT_URL` and the usual AWS credentials variables to
+        configure the client. Requires `boto3`.
+    file://<path>: A local (or mounted) directory, standing in for an
+        object store.
+"""
+
+import os
+import shutil
+import logging
+import posixpath
+
+from typing import List
+from urllib.parse import urlparse
+from concurrent.futures import ThreadPoolExecutor
+
+log = logging.getLogger(__name__)
+
+SCHEMES = ("s3", "file")
+
+
+def is_remote_uri(path: str) -> bool:
+    """Check whether a data dir is an object store URI."""
+    return urlparse(str(path)).scheme in SCHEMES
+
+
+def get_remote_store(uri: str, **kwargs) -> "RemoteStore":
+    """Get the store of an object store URI.
+
+    Args:
+        uri: An object store URI, see the supported schemes
+        kwargs: Transfer settings, see `RemoteStore`
+    """
+    parsed = urlparse(uri)
+    if parsed.scheme == "s3":
+        return S3Store(parsed.netloc, parsed.path.strip("/"), **kwargs)
+    if parsed.scheme == "file":
+        return FileStore(parsed.netloc + parsed.path, **kwargs)
+    raise ValueError("Unsupported object store URI: %s. Use one of the"
+                     " following schemes: %s" % (uri, SCHEMES))
+
+
+class RemoteStore:
+    """Base class for the object stores holding a data dir.
+
+    Subclasses implement the primitives on single objects (keys). Files
+    larger than `multipart_threshold` are transferred in parts of
+    `chunk_size` bytes, using up to `max_concurrency` threads.
+    """
+
+    def __init__(self, multipart_threshold: int = 8 * 1024 * 1024,
+                 chunk_size: int = 8 * 1024 * 1024,
+                 max_concurrency: int = 10):
+        self.multipart_threshold = multipart_threshold
+        self.chunk_size = chunk_size
+        self.max_concurrency = max_concurrency
+
+    def list_entries(self) -> List[str]:
+        """List the names of the entries of the data dir."""
+        # Entries starting with a dot are never marshalled objects
+        return sorted({key.split("/", 1)[0] for key in self._list_keys("")
+                       if not key.startswith(".")})
+
+    def upload(self, path: str, entry_name: str):
+        """Upload a saved file or folder, replacing the existing entry."""
+        self.delete(entry_name)
+        if not os.path.isdir(path):
+            self._put(path, entry_name)
+            return
+        for root, _, files in os.walk(path, followlinks=True):
+            for name in files:
+                file_path = os.path.join(root, name)
+                rel_path = os.path.relpath(file_path, path)
+                self._put(file_path, posixpath.join(
+                    entry_name, *rel_path.split(os.sep)))
+
+    def download(self, entry_name: str, path: str):
+        """Download an entry to a local file or folder."""
+        keys = self._list_keys(entry_name)
+        if keys == [entry_name]:
+            self._get(entry_name, path)
+            return
+        for key in keys:
+            rel_path = key[len(entry_name) + 1:]
+            file_path = os.path.join(path, *rel_path.split("/"))
+            os.makedirs(os.path.dirname(file_path), exist_ok=True)
+            self._get(key, file_path)
+
+    def delete(self, entry_name: str):
+        """Delete an entry, if it exists."""
+        for key in self._list_keys(entry_name):
+            self._delete(key)
+
+    def _list_keys(self, entry_name: str) -> List[str]:
+        """List the keys of an entry, or all of them if `entry_name` is "".
+
+        Keys are relative to the prefix of the data dir.
+        """
+        raise NotImplementedError
+
+    def _put(self, path: str, key: str):
+        raise NotImplementedError
+
+    def _get(self, key: str, path: str):
+        raise NotImplementedError
+
+    def _delete(self, key: str):
+        raise NotImplementedError
+
+
+class S3Store(RemoteStore):
+    """A data dir in an S3-compatible object store.
+
+    boto3's transfer manager uploads large files with parallel multipart
+    uploads and downloads them with parallel ranged requests.
+    """
+
+    def __init__(self, bucket: str, prefix: str, **kwargs):
+        super().__init__(**kwargs)
+        import boto3
+        self.bucket = bucket
+        self.prefix = prefix
+        self._client = boto3.client("s3")
+
+    def _get_key(self, key: str) -> str:
+        return posixpath.join(self.prefix, key) if self.prefix else key
+
+    def _get_transfer_config(self):
+        from boto3.s3.transfer import TransferConfig
+        return TransferConfig(multipart_threshold=self.multipart_threshold,
+                              multipart_chunksize=self.chunk_size,
+                              max_concurrency=self.max_concurrency)
+
+    def _list_keys(self, entry_name):
+        prefix = self._get_key("") if not entry_name else self._get_key(
+            entry_name)
+        keys = []
+        paginator = self._client.get_paginator("list_objects_v2")
+        for page in paginator.paginate(Bucket=self.bucket, Prefix=prefix):
+            for obj in page.get("Contents", []):
+                key = obj["Key"][len(self._get_key("")):]
+                # `Prefix` also matches other entries starting with the name
+                if (not entry_name or key == entry_name
+                        or key.startswith(entry_name + "/")):
+                    keys.append(key)
+        return keys
+
+    def _put(self, path, key):
+        log.info("Uploading %s to s3://%s/%s", path, self.bucket,
+                 self._get_key(key))
+        self._client.upload_file(path, self.bucket, self._get_key(key),
+                                 Config=self._get_transfer_config())
+
+    def _get(self, key, path):
+        log.info("Downloading s3://%s/%s to %s", self.bucket,
+                 self._get_key(key), path)
+        self._client.download_file(self.bucket, self._get_key(key), path,
+                                   Config=self._get_transfer_config())
+
+    def _delete(self, key):
+        self._client.delete_object(Bucket=self.bucket, Key=self._get_key(key))
+
+
+class FileStore(RemoteStore):
+    """A data dir in a directory, standing in for an object store.
+
+    Large files are copied in ranges by parallel threads, just like the
+    parts of a multipart transfer.
+    """
+
+    def __init__(self, root: str, **kwargs):
+        super().__init__(**kwargs)
+        self.root = root
+
+    def _get_path(self, key: str) -> str:
+        return os.path.join(self.root, *key.split("/"))
+
+    def _list_keys(self, entry_name):
+        path = self._get_path(entry_name) if entry_name else self.root
+        if os.path.isfile(path):
+            return [entry_name]
+        keys = []
+        for root, _, files in os.walk(path):
+            for name in files:
+                rel_path = os.path.relpath(os.path.join(root, name),
+                                           self.root)
+                keys.append("/".join(rel_path.split(os.sep)))
+        return keys
+
+    def _put(self, path, key):
+        self._copy(path, self._get_path(key))
+
+    def _get(self, key, path):
+        self._copy(self._get_path(key), path)
+
+    def delete(self, entry_name):
+        """Delete an entry, if it exists, along with its folder."""
+        path = self._get_path(entry_name)
+        if os.path.isdir(path):
+            shutil.rmtree(path)
+        elif os.path.exists(path):
+            os.remove(path)
+
+    def _delete(self, key):
+        os.remove(self._get_path(key))
+
+    def _copy(self, src: str, dst: str):
+        os.makedirs(os.path.dirname(os.path.abspath(dst)), exist_ok=True)
+        size = os.path.getsize(src)
+        # Readers never see partial files
+        tmp_dst = os.path.join(os.path.dirname(dst), ".%s.%d.tmp" % (
+            os.path.basename(dst), os.getpid()))
+        with open(src, "rb") as fsrc, open(tmp_dst, "wb") as fdst:
+            fdst.truncate(size)
+            ranges = [(offset, min(self.chunk_size, size - offset))
+                      for offset in range(0, size, self.chunk_size)]
+
+            def _copy_range(offset, length):
+                while length > 0:
+                    data = os.pread(fsrc.fileno(), length, offset)
+                    if not data:
+                        raise EOFError("%s shrank while being copied" % src)
+                    os.pwrite(fdst.fileno(), data, offset)
+                    offset += len(data)
+                    length -= len(data)
+
+            if size < self.multipart_threshold or len(ranges) < 2:
+                for r in ranges:
+                    _copy_range(*r)
+            else:
+                with ThreadPoolExecutor(
+                        max_workers=self.max_concurrency,
+                        thread_name_prefix="kale-remote") as executor:
+                    # `result` re-raises the failures of the threads
+                    for future in [executor.submit(_copy_range, *r)
+                                   for r in ranges]:
+                        future.result()
+        os.replace(tmp_dst, dst)
@@ -0,0 +1,141 @@
+# Copyright 2020 The Kale Authors
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Instrumentation of the marshalling I/O.
+
+`MarshalBackend` records the size and the duration of every save and load.
+Records accumulate in memory until they are reported, usually at the end of
+a step, as a JSON summary and, optionally, as KFP metrics.
+"""
+
+import os
+import json
+import logging
+import threading
+
+from typing import Any, Dict, List, NamedTuple, Optional
+
+log = logging.getLogger(__name__)
+
+REPORT_VERSION = 1
+
+
+class MarshalRecord(NamedTuple):
+    """The I/O of a single save or load of an object."""
+    name: str
+    operation: str  # "save" or "load"
+    backend: str
+    file_type: str
+    # Bytes written to or read from the data dir
+    size: int
+    duration: float  # seconds
+    # Estimated size of the object in memory. Only known when saving
+    memory_size: Optional[int] = None
+
+    @property
+    def throughput(self) -> Optional[float]:
+        """Get the throughput, in bytes per second."""
+        return self.size / self.duration if self.duration > 0 else None
+
+    @property
+    def compression_ratio(self) -> Optional[float]:
+        """Get the ratio of the object's estimated size to its file's size."""
+        if self.memory_size is None or not self.size:
+            return None
+        return self.memory_size / self.size
+
+    def to_dict(self) -> Dict[str, Any]:
+        """Get the record as a dict, along with its derived values."""
+        record = self._asdict()
+        record["throughput"] = self.throughput
+        record["compression_ratio"] = self.compression_ratio
+        return record
+
+
+__RECORDS: List[MarshalRecord] = list()
+# Objects can be saved and loaded concurrently, see `Dispatcher.save_all`
+__LOCK = threading.Lock()
+
+
+def add_record(record: MarshalRecord):
+    """Add a record to the ones to be reported."""
+    with __LOCK:
+        __RECORDS.append(record)
+
+
+def get_records() -> List[MarshalRecord]:
+    """Get the records that have not been reported yet."""
+    with __LOCK:
+        return list(__RECORDS)
+
+
+def clear_records():
+    """Discard the records that have not been reported yet."""
+    with __LOCK:
+        __RECORDS.clear()
+
+
+def get_summary(records: List[MarshalRecord]) -> Dict[str, Any]:
+    """Summarize records, with totals for every operation.
+
+    Objects are sorted by duration, so the most expensive ones come first.
+    """
+    totals = dict()
+    for operation in ("save", "load"):
+        _records = [r for r in records if r.operation == operation]
+        size = sum(r.size for r in _records)
+        duration = sum(r.duration for r in _records)
+        totals[operation] = {
+            "count": len(_records),
+            "size": size,
+            "duration": duration,
+            "throughput": size / duration if duration > 0 else None}
+    return {
+        "version": REPORT_VERSION,
+        "objects": [r.to_dict() for r in sorted(
+            records, key=lambda r: r.duration, reverse=True)],
+        "totals": totals}
+
+
+def report(path: str, kfp_metrics: bool = False) -> Dict[str, Any]:
+    """Write the summary of the pending records to a JSON file.
+
+    Args:
+        path: Path to the JSON file
+        kfp_metrics: Also write the totals as KFP pipeline metrics
+
+    Returns: the summary, see `get_summary`
+    """
+    with __LOCK:
+        records = list(__RECORDS)
+        __RECORDS.clear()
+    summary = get_summary(records)
+    for operation, totals in summary["totals"].items():
+        if totals["count"]:
+            log.info("Marshal %s: %d objects, %d bytes in %.3fs",
+                     operation, totals["count"], totals["size"],
+                     totals["duration"])
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    with open(path, "w") as f:
+        json.dump(summary, f, indent=2)
+    log.info("Marshal I/O summary written to %s", path)
+    if kfp_metrics:
+        # kfputils requires kfp, which is not needed otherwise
+        from kale.common import kfputils
+        # Keep the pipeline metrics of the step
+        kfputils.generate_mlpipeline_metrics({
+            "marshal-%s-%s" % (operation, key): totals[key]
+            for operation, totals in summary["totals"].items()
+            for key in ("size", "duration")}, merge=True)
+    return summary
@@ -0,0 +1,151 @@
+# Copyright 2020 The Kale Authors
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Content-addressed storage of marshalled objects.
+
+Saved files and folders are moved to a store directory, under a name derived
+from the hash of their content, and linked back to their original path. Equal
+objects, saved by different steps or pipeline runs, are stored just once.
+"""
+
+import os
+import errno
+import shutil
+import hashlib
+import logging
+
+log = logging.getLogger(__name__)
+
+# Created inside the data directory, unless configured otherwise. Entries
+# starting with a dot are never considered marshalled objects.
+STORE_DIRNAME = ".kale.store"
+_CHUNK_SIZE = 1024 * 1024
+
+
+def _new_hash():
+    """Get a hash object, using xxHash if it is installed."""
+    try:
+        import xxhash
+        return "xxh3", xxhash.xxh3_128()
+    except ImportError:
+        return "blake2b", hashlib.blake2b(digest_size=16)
+
+
+def _update_hash(h, path: str):
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(_CHUNK_SIZE), b""):
+            h.update(chunk)
+
+
+def compute_digest(path: str) -> str:
+    """Hash a file, or the files of a folder along with their paths.
+
+    Returns (str): the name of the hash algorithm and the hex digest,
+        joined by a dash.
+    """
+    algorithm, h = _new_hash()
+    if os.path.isdir(path):
+        for root, dirs, files in os.walk(path):
+            dirs.sort()
+            for name in sorted(files):
+                file_path = os.path.join(root, name)
+                h.update(("%s:%d\0" % (os.path.relpath(file_path, path),
+                                       os.path.getsize(file_path))).encode())
+                _update_hash(h, file_path)
+    else:
+        _update_hash(h, path)
+    return "%s-%s" % (algorithm, h.hexdigest())
+
+
+def get_size(path: str) -> int:
+    """Get the size of a saved file, or of the files of a folder."""
+    if not os.path.isdir(path):
+        return os.path.getsize(path)
+    size = 0
+    for root, _, files in os.walk(path):
+        size += sum(os.path.getsize(os.path.join(root, name))
+                    for name in files)
+    return size
+
+
+def remove(path: str):
+    """Remove a saved file or folder, or a link to the store."""
+    if os.path.islink(path) or os.path.isfile(path):
+        os.unlink(path)
+    elif os.path.isdir(path):
+        shutil.rmtree(path)
+
+
+def _link_or_copy(src: str, dst: str):
+    try:
+        os.link(src, dst)
+    except OSError:
+        shutil.copy2(src, dst)
+
+
+def copy(src: str, dst: str):
+    """Copy a saved file or folder, hard-linking files when possible.
+
+    Marshal backends never write through existing files, so linked files
+    can be shared safely.
+    """
+    if os.path.isdir(src):
+        shutil.copytree(src, dst, copy_function=_link_or_copy)
+    else:
+        _link_or_copy(src, dst)
+
+
+def link_to_store(path: str, store_dir: str) -> str:
+    """Move a saved file or folder to the store and link it back.
+
+    If the store already contains the same content, the saved copy is just
+    removed. Files are hard-linked, falling back to symbolic links when the
+    store is on a different file system. Folders are symlinked. Symbolic
+    links are relative, so that they survive mounting the volume elsewhere.
+
+    Args:
+        path: Path to a saved file or folder
+        store_dir: Path to the store directory
+
+    Returns (str): the path to the stored file or folder
+    """
+    digest = compute_digest(path)
+    stored_path = os.path.join(store_dir,
+                               digest + os.path.splitext(path)[1])
+    os.makedirs(store_dir, exist_ok=True)
+    if os.path.exists(stored_path):
+        log.info("Found %s in the store: %s", path, stored_path)
+        remove(path)
+    else:
+        try:
+            os.replace(path, stored_path)
+        except OSError as e:
+            if e.errno == errno.EXDEV:
+                shutil.move(path, stored_path)
+            elif os.path.exists(stored_path):
+                # stored by another process in the meantime
+                remove(path)
+            else:
+                raise
+        log.info("Moved %s to the store: %s", path, stored_path)
+
+    if not os.path.isdir(stored_path):
+        try:
+            os.link(stored_path, path)
+            return stored_path
+        except OSError as e:
+            log.debug("Could not hard-link %s (%s). Using a symbolic link.",
+                      stored_path, e)
+    os.symlink(os.path.relpath(stored_path, os.path.dirname(path)), path)
+    return stored_path
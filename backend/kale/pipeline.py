@@ -17,13 +17,14 @@ import copy
 import logging
 import networkx as nx
 
-from typing import Iterable, Dict
+from typing import Any, Iterable, Dict
 from kubernetes.config import ConfigException
 from kubernetes.client.rest import ApiException
 
+from kale import marshal
 from kale.step import Step, PipelineParam
 from kale.config import Config, Field, validators
-from kale.common import graphutils, utils, podutils
+from kale.common import cacheutils, graphutils, utils, podutils, schedutils
 
 log = logging.getLogger(__name__)
 
@@ -106,6 +107,9 @@ class PipelineConfig(Config):
     abs_working_dir = Field(type=str, default="")
     marshal_volume = Field(type=bool, default=True)
     marshal_path = Field(type=str, default="/marshal")
+    # Marshal data into an object store instead of a volume, e.g.
+    # `s3://bucket/prefix`. See `kale.marshal.remote`.
+    marshal_uri = Field(type=str)
     autosnapshot = Field(type=bool, default=True)
     steps_defaults = Field(type=dict, default=dict())
     kfp_host = Field(type=str)
@@ -115,6 +119,19 @@ class PipelineConfig(Config):
         type=str, validators=[validators.IsLowerValidator,
                               validators.VolumeAccessModeValidator])
     timeout = Field(type=int, validators=[validators.PositiveIntegerValidator])
+    marshal_config = Field(type=marshal.MarshalConfig)
+    # Restore the outputs of the steps that already ran with the same
+    # source, parameters and inputs, when running the pipeline locally.
+    # See `kale.common.cacheutils.StepCache`.
+    step_cache = Field(type=bool, default=False)
+    step_cache_dir = Field(type=str, default=".kale.cache/")
+    step_cache_max_size = Field(
+        type=int, default=10 * 1024 ** 3,
+        validators=[validators.PositiveIntegerValidator])
+    # Run up to this many independent steps at the same time, when running
+    # the pipeline locally. See `kale.common.schedutils.LocalScheduler`.
+    max_parallelism = Field(type=int, default=1,
+                            validators=[validators.PositiveIntegerValidator])
 
     @property
     def source_path(self):
@@ -213,9 +230,38 @@ class Pipeline(nx.DiGraph):
         self._pps_names = None
 
     def run(self):
-        """Runs the steps locally in topological sort."""
-        for step in self.steps:
-            step.run(self.pipeline_parameters)
+        """Runs the steps locally in topological sort.
+
+        When `max_parallelism` is greater than 1, independent steps run at
+        the same time, in separate processes.
+        """
+        cache = None
+        if self.config.step_cache:
+            cache = cacheutils.StepCache(self.config.step_cache_dir,
+                                         self.config.step_cache_max_size)
+
+        def _run_step(step: Step):
+            marshal.set_config(**self.get_marshal_config(step))
+            step.run(self.pipeline_parameters, cache)
+
+        try:
+            if self.config.max_parallelism > 1:
+                schedutils.LocalScheduler(
+                    self, _run_step, self.config.max_parallelism).run()
+            else:
+                for step in self.steps:
+                    _run_step(step)
+        finally:
+            # Do not leave the config of the last step in place
+            marshal.set_config()
+
+    def get_marshal_config(self, step: Step) -> Dict[str, Any]:
+        """Get the marshal config of a step, overriding the pipeline's one."""
+        marshal_config = dict()
+        if self.config.marshal_config:
+            marshal_config.update(self.config.marshal_config.to_dict())
+        marshal_config.update(step.config.marshal_config)
+        return marshal_config
 
     def add_step(self, step: Step):
         """Add a new Step to the pipeline."""
@@ -15,13 +15,14 @@
 import os
 import re
 
-from typing import Any, Dict, Optional
+from typing import Any, Callable, Dict, List, Optional
 
 import nbformat as nb
 
 from kale.config import Field
 from kale.step import Step, PipelineParam
-from kale.common import astutils, flakeutils, graphutils, utils
+from kale.common import (astutils, cacheutils, graphutils, scopeutils,
+                         utils)
 from kale.pipeline import PipelineConfig
 from .baseprocessor import BaseProcessor
 
@@ -175,12 +176,16 @@ class NotebookProcessor(BaseProcessor):
     def __init__(self,
                  nb_path: str,
                  nb_metadata_overrides: Optional[Dict[str, Any]] = None,
+                 analysis_workers: Optional[int] = None,
                  **kwargs):
         """Instantiate a new NotebookProcessor.
 
         Args:
             nb_path: Path to source notebook
             nb_metadata_overrides: Override notebook config settings
+            analysis_workers: Analyze the sources of the steps in this many
+                processes before resolving their dependencies. Set to 0 to
+                use all the CPUs. By default, steps are analyzed one by one.
             skip_validation: Set to True in order to skip the notebook's
                 metadata validation. This is useful in case the
                 NotebookProcessor is used to parse a part of the notebook
@@ -189,6 +194,14 @@ class NotebookProcessor(BaseProcessor):
         """
         self.nb_path = os.path.expanduser(nb_path)
         self.notebook = self._read_notebook()
+        self.analysis_workers = analysis_workers
+        # The analysis of the last imports and functions block, along with
+        # the block, see `_analyze_imports_and_functions`
+        self._imports_and_functions = None
+        # See `_index_ancestors`
+        self._ancestor_index = None
+        # The number of `imports` cells prepended to the source of every step
+        self.imports_cells_count = 0
 
         nb_metadata = self.notebook.metadata.get(KALE_NB_METADATA_KEY, dict())
         nb_metadata.update({"notebook_path": nb_path})
@@ -336,6 +349,7 @@ class NotebookProcessor(BaseProcessor):
                 prev_step_name = step_name
 
         # Prepend any `imports` and `functions` cells to every Pipeline step
+        self.imports_cells_count = len(imports_block)
         for step in self.pipeline.steps:
             step.source = imports_block + functions_block + step.source
 
@@ -579,10 +593,9 @@ class NotebookProcessor(BaseProcessor):
                 break
 
             anc_step = self.pipeline.get_step(anc)
-            anc_source = '\n'.join(anc_step.source)
             # get all the marshal candidates from father's source and intersect
             # with the metrics that have not been matched yet
-            marshal_candidates = astutils.get_marshal_candidates(anc_source)
+            marshal_candidates = self._get_marshal_candidates(anc_step)
             assigned_metrics = metrics_left.intersection(marshal_candidates)
             # Remove the metrics that have already been assigned.
             metrics_left.difference_update(assigned_metrics)
@@ -598,6 +611,46 @@ class NotebookProcessor(BaseProcessor):
 
         self.pipeline.remove_node(tmp_step_name)
 
+    def _analyze_cells(self, step: Step, kind: str,
+                       analyze: Callable[[str], Any]) -> List[Any]:
+        """Analyze the cells of a step one by one, caching the results.
+
+        Only the cells that changed since the last analysis are analyzed
+        again. See `cacheutils.AnalysisCache`. The analysis must give the same
+        result on the whole source of the step as the union of the results on
+        its cells.
+
+        Returns (list): a result for every cell, or just one for the whole
+            source of the step if some cell can't be parsed on its own.
+        """
+        analysis_cache = cacheutils.get_analysis_cache()
+        try:
+            return [analysis_cache.get(kind, cell, analyze)
+                    for cell in step.source]
+        except SyntaxError:
+            # e.g., a statement spanning multiple cells
+            return [analysis_cache.get(kind, '\n'.join(step.source),
+                                       analyze)]
+
+    def _get_marshal_candidates(self, step: Step) -> set:
+        """Get the marshal candidates of a step, see `_analyze_cells`."""
+        return set().union(*self._analyze_cells(
+            step, "marshal_candidates", astutils.get_marshal_candidates))
+
+    def _analyze_imports_and_functions(self, imports_and_functions: str
+                                       ) -> scopeutils.ScopeReport:
+        """Resolve the names of the code prepended to every step.
+
+        The block is the same for all the steps, so it is analyzed once per
+        compilation, no matter how many steps and functions there are.
+        """
+        if (self._imports_and_functions is None
+                or self._imports_and_functions[0] != imports_and_functions):
+            self._imports_and_functions = (
+                imports_and_functions,
+                scopeutils.analyze(imports_and_functions))
+        return self._imports_and_functions[1]
+
     def _ensure_fns_free_variables(self, anc_step, anc_source: str,
                                    imports_and_functions: str):
         """Lazily compute ancestor functions' free vars if missing."""
@@ -608,6 +661,43 @@ class NotebookProcessor(BaseProcessor):
                 self.pipeline.pipeline_parameters
             )
 
+    def _prefetch_analysis(self):
+        """Analyze the sources of all the steps in parallel processes.
+
+        The results land in the analysis cache, where the dependency
+        detection finds them. See `cacheutils.AnalysisCache.prefetch`.
+        """
+        analyses = list()
+        for step in self.pipeline.steps:
+            source = '\n'.join(step.source)
+            analyses.append(("scopes", utils.comment_magic_commands(source),
+                             scopeutils.analyze))
+            analyses.append(("scopes", source, scopeutils.analyze))
+            for cell in step.source:
+                analyses.append(("marshal_candidates", cell,
+                                 astutils.get_marshal_candidates))
+                analyses.append(("function_calls", cell,
+                                 astutils.get_function_calls))
+        cacheutils.get_analysis_cache().prefetch(
+            analyses, max_workers=self.analysis_workers or None)
+
+    def _index_ancestors(self, imports_and_functions: str
+                         ) -> graphutils.AncestorIndex:
+        """Index the ancestors of the steps and the names they provide.
+
+        The index records the marshal candidates and the functions of every
+        step, so that the ancestors providing the names a step misses are
+        found without going through all of them.
+        """
+        index = graphutils.AncestorIndex(self.pipeline)
+        for step in self.pipeline.steps:
+            self._ensure_fns_free_variables(step, '\n'.join(step.source),
+                                            imports_and_functions)
+            index.add_names(step.name, self._get_marshal_candidates(step),
+                            "marshal_candidates")
+            index.add_names(step.name, step.fns_free_variables, "functions")
+        return index
+
     def _propagate_free_vars_from_function(self, step: Step, anc_step: Step,
                                            fn_name: str):
         """Helper method.
@@ -617,10 +707,12 @@ class NotebookProcessor(BaseProcessor):
         nested functions' free variables. Also apply artifact heuristics.
         Additionally, propagate transitive free variables via earlier ancestors
         of anc_step.
+
+        Returns (set): the names of the propagated free variables
         """
         anc_fns_free_vars = getattr(anc_step, 'fns_free_variables', {})
         if fn_name not in anc_fns_free_vars:
-            return
+            return set()
         fn_free_vars, _ = anc_fns_free_vars[fn_name]
         aggregated = set(fn_free_vars)
         queue = list(fn_free_vars)
@@ -637,14 +729,20 @@ class NotebookProcessor(BaseProcessor):
 
         # Then, expand transitively using functions defined in earlier
         # ancestors of anc_step (i.e., ancestors that lead to anc_step).
-        earlier_ancestors = graphutils.get_ordered_ancestors(self.pipeline,
-                                                             anc_step.name)
-        for ea_name in earlier_ancestors:
+        # Only the ancestors defining some of the aggregated names matter.
+        index = self._ancestor_index
+        earlier_ancestors = index.ancestors[anc_step.name]
+        # The earlier ancestors defining some of the aggregated names
+        providers = index.get_providers(aggregated, "functions")
+        visited = 0
+        for ea_name in graphutils.iter_ordered_ancestors(self.pipeline,
+                                                         anc_step.name):
+            if not providers & earlier_ancestors & ~visited:
+                break
+            visited |= index.bits[ea_name]
+            if not providers & index.bits[ea_name]:
+                continue
             ea_step = self.pipeline.get_step(ea_name)
-            ea_source = '\n'.join(ea_step.source)
-            # Ensure their fns_free_variables are computed
-            self._ensure_fns_free_variables(ea_step, ea_source,
-                                            self.get_imports_and_functions())
             ea_fns_free_vars = getattr(ea_step, 'fns_free_variables', {})
             # We iterate over a snapshot of aggregated to allow growth
             # during the loop
@@ -659,6 +757,8 @@ class NotebookProcessor(BaseProcessor):
                         if n not in aggregated:
                             aggregated.add(n)
                             to_check.append(n)
+                            providers |= index.get_providers([n],
+                                                             "functions")
 
         # Apply artifact heuristic and update step.ins and anc_step.outs
         # for all aggregated names
@@ -679,6 +779,7 @@ class NotebookProcessor(BaseProcessor):
                 if is_artifact:
                     anc_step.add_artifact(fv_name, inferred_type,
                                           is_input=False)
+        return aggregated
 
     def dependencies_detection(self, imports_and_functions: str = ""):
         """Detects data dependencies between pipeline steps to support KFPv2.
@@ -709,6 +810,12 @@ class NotebookProcessor(BaseProcessor):
             its detected `ins`, `outs`, `parameters`, and `fns_free_variables`
             to facilitate KFP v2 artifact handling.
         """
+        if self.analysis_workers is not None:
+            self._prefetch_analysis()
+        # step name -> free variables of the functions used by the step
+        fns_names = dict()
+        index = self._ancestor_index = self._index_ancestors(
+            imports_and_functions)
         # resolve the data dependencies between steps, looping through the
         # graph
         for step in self.pipeline.steps:
@@ -728,7 +835,10 @@ class NotebookProcessor(BaseProcessor):
             # Get all the function calls. This will be used below to check if
             # any of the ancestors declare any of these functions. Is that is
             # so, the free variables of those functions will have to be loaded.
-            fn_calls = astutils.get_function_calls(step_source)
+            fn_calls = set().union(*self._analyze_cells(
+                step, "function_calls", astutils.get_function_calls))
+            # free variables of the ancestors' functions used by this step
+            anc_fns_names = set()
             # add OUT dependencies annotations in the PARENT nodes-------------
             # Intersect the missing names of this father's child with all
             # the father's names. The intersection is the list of variables
@@ -736,21 +846,22 @@ class NotebookProcessor(BaseProcessor):
             # The ancestors are the the nodes that have a path to `step`,
             # ordered by path length.
             ins_left = ins.copy()
-            for anc in (graphutils.get_ordered_ancestors(self.pipeline,
-                                                         step.name)):
+            if ins_left and index.ancestors[step.name]:
+                step.fns_free_variables = fns_free_vars
+            # Skip the ancestors that provide neither the missing names nor
+            # the called functions
+            providers = (
+                index.get_providers(ins_left | fn_calls, "marshal_candidates")
+                | index.get_providers(fn_calls, "functions"))
+            for anc in index.iter_ancestors(step.name, providers):
                 if not ins_left:
                     # if there are no more variables that need to be
                     # marshalled, stop the graph traverse
                     break
                 anc_step = self.pipeline.get_step(anc)
-                anc_source = '\n'.join(anc_step.source)
-                # Ensure ancestor's functions free variables are available
-                self._ensure_fns_free_variables(anc_step, anc_source,
-                                                imports_and_functions)
                 # get all the marshal candidates from father's source and
                 # intersect with the required names of the current node
-                marshal_candidates = astutils.get_marshal_candidates(
-                    anc_source)
+                marshal_candidates = self._get_marshal_candidates(anc_step)
                 outs = ins_left.intersection(marshal_candidates)
                 for out_name in outs:
                     # Heuristic for type inference:
@@ -784,8 +895,9 @@ class NotebookProcessor(BaseProcessor):
                     # If the marshaled name is a function defined in the
                     # ancestor, propagate its free variables as additional
                     # ins/outs.
-                    self._propagate_free_vars_from_function(step, anc_step,
-                                                            out_name)
+                    anc_fns_names.update(
+                        self._propagate_free_vars_from_function(
+                            step, anc_step, out_name))
 
                 # Include free variables and add them as inputs/outputs
                 to_remove_fn_calls = set()
@@ -793,8 +905,9 @@ class NotebookProcessor(BaseProcessor):
                     anc_fns_free_vars = anc_step.fns_free_variables
                     if fn_call in anc_fns_free_vars.keys():
                         # Ensure free vars of the called fn are propagated
-                        self._propagate_free_vars_from_function(step, anc_step,
-                                                                fn_call)
+                        anc_fns_names.update(
+                            self._propagate_free_vars_from_function(
+                                step, anc_step, fn_call))
                         to_remove_fn_calls.add(fn_call)
                         fns_free_vars[fn_call] = anc_fns_free_vars[fn_call]
 
@@ -812,8 +925,50 @@ class NotebookProcessor(BaseProcessor):
                                 step.parameters[_pname] = _pval
 
                 fn_calls.difference_update(to_remove_fn_calls)
-                # finalize bookkeeping for this step
-                step.fns_free_variables = fns_free_vars
+
+            # Descendants can call the functions of the ancestors this step
+            # calls, see `fns_free_vars`
+            index.add_names(step.name, step.fns_free_variables, "functions")
+
+            fns_names[step.name] = anc_fns_names.union(
+                *(fn_free_vars for fn_free_vars, _ in fns_free_vars.values()))
+
+        # The `outs` of a step are known once all its descendants have been
+        # processed
+        for step in self.pipeline.steps:
+            step.ins_columns = self._detect_ins_columns(
+                step, '\n'.join(step.source), imports_and_functions,
+                fns_names[step.name])
+
+    def _detect_ins_columns(self, step: Step, source_code: str,
+                            imports_and_functions: str,
+                            fns_names: set) -> Dict[str, List[str]]:
+        """Detect the columns that a step reads from its inputs.
+
+        This allows the step to restore just those columns (e.g. of a
+        DataFrame), instead of whole objects. See
+        `astutils.get_column_projections`.
+
+        Args:
+            step: The pipeline step, with its `ins` and `outs` detected
+            source_code: Multiline Python source code of the step
+            imports_and_functions: Multiline Python source that is prepended
+                to every pipeline step
+            fns_names: Free variables of the functions used by the step
+
+        Returns (dict): A dictionary [input name] -> list of column names
+        """
+        # Functions might need whole objects. Objects that the step saves
+        # again must not lose their columns.
+        names = set(step.ins).difference(fns_names, step.outs)
+        if not names:
+            return {}
+        projections = astutils.get_column_projections(
+            imports_and_functions + "\n" + source_code, names)
+        # Column names are rendered inside the step's triple-quoted source
+        return {name: columns for name, columns in projections.items()
+                if all(c.isprintable() and "\\" not in c and "'" not in c
+                       for c in columns)}
 
     def _detect_in_dependencies(self,
                                 source_code: str,
@@ -825,7 +980,8 @@ class NotebookProcessor(BaseProcessor):
             pipeline_parameters: Pipeline parameters dict
         """
         commented_source_code = utils.comment_magic_commands(source_code)
-        ins = flakeutils.pyflakes_report(code=commented_source_code)
+        ins = cacheutils.get_analysis_cache().get(
+            "scopes", commented_source_code, scopeutils.analyze).undefined
         # Pipeline parameters will be part of the names that are missing,
         # but of course we don't want to marshal them in as they will be
         # present as parameters
@@ -859,30 +1015,32 @@ class NotebookProcessor(BaseProcessor):
         In the example above, `x` is a free variable for function `foo`,
         because it is defined outside of the context of `foo`.
 
-        Here we run the PyFlakes report over the function body to get all the
-        missing names (i.e. free variables), excluding the function arguments.
+        Here we resolve the names of the source code and get the missing names
+        of every function (i.e. free variables) as if they were defined right
+        after `imports_and_functions`. See `scopeutils.get_free_variables`.
 
         Args:
             source_code: Multiline Python source code
             imports_and_functions: Multiline Python source that is prepended
                 to every pipeline step. It should contain the code cells that
-                where tagged as `import` and `functions`. We prepend this code
-                to the function body because it will always be present in any
-                pipeline step.
+                where tagged as `import` and `functions`. Names it defines
+                are not free variables, because it will always be present in
+                any pipeline step.
             step_parameters: Step parameters names. The step parameters
-                are removed from the pyflakes report, as these names will
+                are removed from the free variables, as these names will
                 always be available in the step's context.
 
         Returns (dict): A dictionary with the name of the function as key and
             a list of variables names + consumed pipeline parameters as values.
         """
         fns_free_vars = dict()
-        # now check the functions' bodies for free variables. fns is a
-        # dict function_name -> function_source
-        fns = astutils.parse_functions(source_code)
-        for fn_name, fn in fns.items():
-            code = imports_and_functions + "\n" + fn
-            free_vars = flakeutils.pyflakes_report(code=code)
+        analysis_cache = cacheutils.get_analysis_cache()
+        # The functions are resolved against the names defined by the imports
+        # and functions block, without analyzing it again
+        report = analysis_cache.get("scopes", source_code, scopeutils.analyze)
+        free_variables = scopeutils.get_free_variables(
+            report, self._analyze_imports_and_functions(imports_and_functions))
+        for fn_name, free_vars in free_variables.items():
             # the pipeline parameters that are used in the function
             consumed_params = {}
             if step_parameters:
@@ -176,9 +176,11 @@ def unmarshal_data(source_notebook_path):
         return {}
 
     marshal.set_data_dir(kale_marshal_dir)
+    # skip Kale's own bookkeeping files, e.g. the marshal manifest
     return {os.path.splitext(f)[0]:
             marshal.load(os.path.splitext(f)[0])
-            for f in os.listdir(kale_marshal_dir)}
+            for f in os.listdir(kale_marshal_dir)
+            if not f.startswith(".")}
 
 
 def explore_notebook(request, source_notebook_path):
@@ -14,11 +14,17 @@
 
 import logging
 
-from typing import Any, Dict, List, Callable, Union, NamedTuple
+from typing import (Any, Dict, List, Callable, Union, NamedTuple,
+                    TYPE_CHECKING)
 
-from kale.marshal import Marshaller
+from kale import marshal
+from kale.marshal import Marshaller, MarshalConfig
 from kale.common import astutils, runutils
 from kale.config import Config, Field, validators
+
+if TYPE_CHECKING:
+    from kale.common.cacheutils import StepCache
+
 log = logging.getLogger(__name__)
 
 
@@ -51,6 +57,13 @@ class StepConfig(Config):
     retry_factor = Field(type=int)
     retry_max_interval = Field(type=str)
     timeout = Field(type=int, validators=[validators.PositiveIntegerValidator])
+    # Override the pipeline's marshal config for this step, e.g.
+    # `{"compression": "zstd"}`. See `kale.marshal.MarshalConfig`.
+    marshal_config = Field(type=dict, default=dict())
+
+    def _validate(self):
+        # Fail early on unknown or invalid marshal settings
+        MarshalConfig(**self.marshal_config)
 
 
 class Step:
@@ -75,6 +88,8 @@ class Step:
         self._pps_names = None
         # used to keep track of the "free variables" used by the step
         self.fns_free_variables = dict()
+        # the only columns that the step reads from some of its `ins`
+        self.ins_columns: Dict[str, List[str]] = dict()
 
     def __call__(self, *args, **kwargs):
         """Handler for when the @step decorated function is called."""
@@ -109,16 +124,31 @@ class Step:
         )
         self.artifacts.append(new_artifact)
 
-    def run(self, pipeline_parameters_values: Dict[str, PipelineParam]):
-        """Run the step locally."""
+    def run(self, pipeline_parameters_values: Dict[str, PipelineParam],
+            cache: "StepCache" = None):
+        """Run the step locally.
+
+        Args:
+            pipeline_parameters_values: The values of the pipeline parameters
+            cache: Restore the step's outputs from this cache, if the step
+                already ran with the same source, parameters and inputs
+        """
         log.info("%s Running step '%s'... %s", "-" * 10, self.name, "-" * 10)
         # select just the pipeline parameters consumed by this step
         _params = {k: pipeline_parameters_values[k] for k in self.parameters}
         marshaller = Marshaller(func=self.source, ins=self.ins, outs=self.outs,
                                 parameters=_params, marshal_dir='.marshal/')
-        marshaller()
-        log.info("%s Successfully ran step '%s'... %s", "-" * 10, self.name,
-                 "-" * 10)
+        cache_key = cache.get_key(self, _params) if cache else None
+        if cache_key and cache.restore(cache_key):
+            log.info("%s Restored the outputs of step '%s' from the cache"
+                     " %s", "-" * 10, self.name, "-" * 10)
+        else:
+            marshaller()
+            marshal.report_stats(self.name)
+            if cache_key:
+                cache.save(cache_key, self)
+            log.info("%s Successfully ran step '%s'... %s", "-" * 10,
+                     self.name, "-" * 10)
         runutils.link_artifacts({a.name: a.path for a in self.artifacts},
                                 link=False)
 
@@ -46,14 +46,13 @@ def load_transform_data_step(load_transform_data_html_report: Output[HTML], x_tr
     # -----------------------DATA SAVING START---------------------------------
     from kale import marshal as _kale_marshal
     _kale_marshal.set_data_dir("/marshal")
-    # Save x_trn to output artifact
-    _kale_marshal.save(x_trn, "x_trn_artifact")
-    # Save x_tst to output artifact
-    _kale_marshal.save(x_tst, "x_tst_artifact")
-    # Save y_trn to output artifact
-    _kale_marshal.save(y_trn, "y_trn_artifact")
-    # Save y_tst to output artifact
-    _kale_marshal.save(y_tst, "y_tst_artifact")
+    # Save the output artifacts, concurrently if configured
+    _kale_marshal.save_all({
+        "x_trn_artifact": x_trn,
+        "x_tst_artifact": x_tst,
+        "y_trn_artifact": y_trn,
+        "y_tst_artifact": y_tst,
+    })
     # -----------------------DATA SAVING END-----------------------------------
     '''
 
@@ -72,9 +71,13 @@ def load_transform_data_step(load_transform_data_html_report: Output[HTML], x_tr
         _kale_data_saving_block
     )
 
-    _kale_html_artifact = _kale_run_code(_kale_blocks)
-    with open(load_transform_data_html_report.path, "w") as f:
-        f.write(_kale_html_artifact)
+    # write the HTML report of the outputs while the code runs
+    _kale_run_code(_kale_blocks,
+                   # pooled kernels run the imports in advance
+                   warmup_code="\n".join((
+                       _kale_block1,
+                   )),
+                   html_report_path=load_transform_data_html_report.path)
     _kale_update_uimetadata('load_transform_data_html_report')
 
     # _kale_mlmdutils.call("mark_execution_complete")
@@ -98,10 +101,14 @@ def train_model_step(train_model_html_report: Output[HTML], x_trn_artifact: Inpu
     # -----------------------DATA LOADING START--------------------------------
     from kale import marshal as _kale_marshal
     _kale_marshal.set_data_dir("/marshal")
-    # Load x_trn_artifact from input artifact
-    x_trn = _kale_marshal.load("x_trn_artifact")
-    # Load y_trn_artifact from input artifact
-    y_trn = _kale_marshal.load("y_trn_artifact")
+    # Load the input artifacts, concurrently if configured
+    _kale_inputs = _kale_marshal.load_all([
+        "x_trn_artifact",
+        "y_trn_artifact",
+    ])
+    x_trn = _kale_inputs["x_trn_artifact"]
+    y_trn = _kale_inputs["y_trn_artifact"]
+    del _kale_inputs
     # -----------------------DATA LOADING END----------------------------------
     '''
 
@@ -128,8 +135,10 @@ def train_model_step(train_model_html_report: Output[HTML], x_trn_artifact: Inpu
     # -----------------------DATA SAVING START---------------------------------
     from kale import marshal as _kale_marshal
     _kale_marshal.set_data_dir("/marshal")
-    # Save model to output artifact
-    _kale_marshal.save(model, "model_artifact")
+    # Save the output artifacts, concurrently if configured
+    _kale_marshal.save_all({
+        "model_artifact": model,
+    })
     # -----------------------DATA SAVING END-----------------------------------
     '''
 
@@ -148,9 +157,13 @@ def train_model_step(train_model_html_report: Output[HTML], x_trn_artifact: Inpu
         _kale_data_saving_block
     )
 
-    _kale_html_artifact = _kale_run_code(_kale_blocks)
-    with open(train_model_html_report.path, "w") as f:
-        f.write(_kale_html_artifact)
+    # write the HTML report of the outputs while the code runs
+    _kale_run_code(_kale_blocks,
+                   # pooled kernels run the imports in advance
+                   warmup_code="\n".join((
+                       _kale_block1,
+                   )),
+                   html_report_path=train_model_html_report.path)
     _kale_update_uimetadata('train_model_html_report')
 
     # _kale_mlmdutils.call("mark_execution_complete")
@@ -174,12 +187,16 @@ def evaluate_model_step(evaluate_model_html_report: Output[HTML], model_artifact
     # -----------------------DATA LOADING START--------------------------------
     from kale import marshal as _kale_marshal
     _kale_marshal.set_data_dir("/marshal")
-    # Load model_artifact from input artifact
-    model = _kale_marshal.load("model_artifact")
-    # Load x_tst_artifact from input artifact
-    x_tst = _kale_marshal.load("x_tst_artifact")
-    # Load y_tst_artifact from input artifact
-    y_tst = _kale_marshal.load("y_tst_artifact")
+    # Load the input artifacts, concurrently if configured
+    _kale_inputs = _kale_marshal.load_all([
+        "model_artifact",
+        "x_tst_artifact",
+        "y_tst_artifact",
+    ])
+    model = _kale_inputs["model_artifact"]
+    x_tst = _kale_inputs["x_tst_artifact"]
+    y_tst = _kale_inputs["y_tst_artifact"]
+    del _kale_inputs
     # -----------------------DATA LOADING END----------------------------------
     '''
 
@@ -238,9 +255,13 @@ def evaluate_model_step(evaluate_model_html_report: Output[HTML], model_artifact
         _kale_data_saving_block
     )
 
-    _kale_html_artifact = _kale_run_code(_kale_blocks)
-    with open(evaluate_model_html_report.path, "w") as f:
-        f.write(_kale_html_artifact)
+    # write the HTML report of the outputs while the code runs
+    _kale_run_code(_kale_blocks,
+                   # pooled kernels run the imports in advance
+                   warmup_code="\n".join((
+                       _kale_block1,
+                   )),
+                   html_report_path=evaluate_model_html_report.path)
     _kale_update_uimetadata('evaluate_model_html_report')
 
     # _kale_mlmdutils.call("mark_execution_complete")
@@ -46,8 +46,10 @@ def create_matrix_step(create_matrix_html_report: Output[HTML], rnd_matrix_artif
     # -----------------------DATA SAVING START---------------------------------
     from kale import marshal as _kale_marshal
     _kale_marshal.set_data_dir("/marshal")
-    # Save rnd_matrix to output artifact
-    _kale_marshal.save(rnd_matrix, "rnd_matrix_artifact")
+    # Save the output artifacts, concurrently if configured
+    _kale_marshal.save_all({
+        "rnd_matrix_artifact": rnd_matrix,
+    })
     # -----------------------DATA SAVING END-----------------------------------
     '''
 
@@ -66,9 +68,13 @@ def create_matrix_step(create_matrix_html_report: Output[HTML], rnd_matrix_artif
         _kale_data_saving_block
     )
 
-    _kale_html_artifact = _kale_run_code(_kale_blocks)
-    with open(create_matrix_html_report.path, "w") as f:
-        f.write(_kale_html_artifact)
+    # write the HTML report of the outputs while the code runs
+    _kale_run_code(_kale_blocks,
+                   # pooled kernels run the imports in advance
+                   warmup_code="\n".join((
+                       _kale_block1,
+                   )),
+                   html_report_path=create_matrix_html_report.path)
     _kale_update_uimetadata('create_matrix_html_report')
 
     # _kale_mlmdutils.call("mark_execution_complete")
@@ -93,8 +99,12 @@ def sum_matrix_step(sum_matrix_html_report: Output[HTML], rnd_matrix_artifact: I
     # -----------------------DATA LOADING START--------------------------------
     from kale import marshal as _kale_marshal
     _kale_marshal.set_data_dir("/marshal")
-    # Load rnd_matrix_artifact from input artifact
-    rnd_matrix = _kale_marshal.load("rnd_matrix_artifact")
+    # Load the input artifacts, concurrently if configured
+    _kale_inputs = _kale_marshal.load_all([
+        "rnd_matrix_artifact",
+    ])
+    rnd_matrix = _kale_inputs["rnd_matrix_artifact"]
+    del _kale_inputs
     # -----------------------DATA LOADING END----------------------------------
     '''
 
@@ -136,9 +146,13 @@ def sum_matrix_step(sum_matrix_html_report: Output[HTML], rnd_matrix_artifact: I
         _kale_data_saving_block
     )
 
-    _kale_html_artifact = _kale_run_code(_kale_blocks)
-    with open(sum_matrix_html_report.path, "w") as f:
-        f.write(_kale_html_artifact)
+    # write the HTML report of the outputs while the code runs
+    _kale_run_code(_kale_blocks,
+                   # pooled kernels run the imports in advance
+                   warmup_code="\n".join((
+                       _kale_block1,
+                   )),
+                   html_report_path=sum_matrix_html_report.path)
     _kale_update_uimetadata('sum_matrix_html_report')
 
     # _kale_mlmdutils.call("mark_execution_complete")
@@ -174,6 +174,26 @@ def foo():
     assert kale_ast.parse_functions(code) == target
 
 
+@pytest.mark.parametrize("code,target", [
+    ('df["a"].mean()', {"df": ["a"]}),
+    ('x = df["b"]\ny = df[["a", "b"]]', {"df": ["a", "b"]}),
+    ('df["a"].mean()\ndf.head()', {}),
+    ('df["a"].mean()\ndf[col]', {}),
+    ('df["a"] = 1', {}),
+    ('df["a"].mean()\nprint(df)', {}),
+    ('df["a"].mean()\ndef foo(df):\n    pass', {}),
+    ('df["a"].mean()\nimport x as df', {}),
+    ('other["a"]', {}),
+    ('x = df["a"]\n%time y = df["b"]', {}),
+    ('x = df["a"]\n%time y = other["b"]', {"df": ["a"]}),
+    ('x = df["a"]\neval(\'df["b"]\')', {}),
+    ('x = df["a"]\nexec(code)', {}),
+])
+def test_get_column_projections(code, target):
+    """Test that only variables used through column selections qualify."""
+    assert kale_ast.get_column_projections(code, ["df"]) == target
+
+
 def test_get_calls():
     """Test that just function calls are detected."""
     code = '''
@@ -0,0 +1,125 @@
+#  Copyright 2020 The Kale Authors
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#       http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+
+import os
+
+import pytest
+
+from kale import marshal, Step
+from kale.step import PipelineParam
+from kale.common import astutils, flakeutils
+from kale.common.cacheutils import AnalysisCache, StepCache
+
+_calls = []
+
+
+def _double(x):
+    _calls.append(x)
+    return x * 2
+
+
+@pytest.fixture
+def cache(tmp_path, monkeypatch):
+    """Run steps in a temporary directory, with an empty cache."""
+    monkeypatch.chdir(tmp_path)
+    os.makedirs(".marshal")
+    _calls.clear()
+    yield StepCache(str(tmp_path / "cache"))
+    marshal.set_data_dir(os.path.curdir)
+
+
+def test_step_cache(cache):
+    """Test that steps run again only when their inputs change."""
+    step = Step(source=_double, name="double", ins=["x"], outs=["y"])
+    marshal.set_data_dir(".marshal/")
+
+    marshal.save(1, "x")
+    step.run({}, cache)
+    step.run({}, cache)
+    assert _calls == [1]
+    assert marshal.load("y") == 2
+
+    marshal.save(2, "x")
+    step.run({}, cache)
+    assert marshal.load("y") == 4
+
+    # restore the outputs of the first run
+    marshal.save(1, "x")
+    marshal.save(0, "y")
+    step.run({}, cache)
+    assert _calls == [1, 2]
+    assert marshal.load("y") == 2
+
+
+def test_step_cache_parameters(cache):
+    """Test that pipeline parameters are part of the fingerprint."""
+    step = Step(source=_double, name="double", ins=["x"], outs=["y"])
+    step.parameters = {"x": None}
+    step.run({"x": PipelineParam("int", 1)}, cache)
+    step.run({"x": PipelineParam("int", 1)}, cache)
+    step.run({"x": PipelineParam("int", 2)}, cache)
+    assert _calls == [1, 2]
+
+
+def test_step_cache_eviction(cache):
+    """Test that the least recently used entries are evicted."""
+    cache.max_size = 1
+    step = Step(source=_double, name="double", ins=["x"], outs=["y"])
+    step.parameters = {"x": None}
+    step.run({"x": PipelineParam("int", 1)}, cache)
+    step.run({"x": PipelineParam("int", 2)}, cache)
+    assert len(os.listdir(cache.cache_dir)) == 0
+
+    cache.max_size = 10 ** 6
+    step.run({"x": PipelineParam("int", 1)}, cache)
+    step.run({"x": PipelineParam("int", 1)}, cache)
+    assert _calls == [1, 2, 1]
+    assert len(os.listdir(cache.cache_dir)) == 1
+
+
+def test_analysis_cache(tmp_path):
+    """Test that analyses are cached in memory and on disk."""
+    analyzed = []
+
+    def _analyze(code):
+        analyzed.append(code)
+        return flakeutils.pyflakes_report(code)
+
+    cache = AnalysisCache(max_size=1, cache_dir=str(tmp_path))
+    assert cache.get("pyflakes", "print(x)", _analyze) == {"x"}
+    # Results can be modified by the callers
+    cache.get("pyflakes", "print(x)", _analyze).add("y")
+    assert cache.get("pyflakes", "print(x)", _analyze) == {"x"}
+    assert analyzed == ["print(x)"]
+    # Evicted from memory, restored from disk
+    assert cache.get("pyflakes", "print(z)", _analyze) == {"z"}
+    assert AnalysisCache(cache_dir=str(tmp_path)).get(
+        "pyflakes", "print(x)", _analyze) == {"x"}
+    assert analyzed == ["print(x)", "print(z)"]
+
+
+def test_analysis_cache_prefetch():
+    """Test that analyses run in parallel processes ahead of `get`."""
+    cache = AnalysisCache()
+    cache.prefetch([("calls", "foo()", astutils.get_function_calls),
+                    ("calls", "bar(", astutils.get_function_calls)],
+                   max_workers=2)
+
+    def _analyze(code):
+        raise AssertionError("%s was not prefetched" % code)
+
+    assert cache.get("calls", "foo()", _analyze) == {"foo"}
+    # Failures are not cached
+    with pytest.raises(SyntaxError):
+        cache.get("calls", "bar(", astutils.get_function_calls)
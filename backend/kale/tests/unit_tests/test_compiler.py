@@ -0,0 +1,31 @@
+#  Copyright 2020 The Kale Authors
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#       http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+
+import os
+
+from kale import compiler
+
+
+def test_get_templating_env(tmpdir, monkeypatch):
+    """Test that the templates are compiled once and their bytecode kept."""
+    monkeypatch.setenv(compiler.TEMPLATE_CACHE_DIR_ENV, str(tmpdir))
+    compiler.get_templating_env.cache_clear()
+    try:
+        env = compiler.get_templating_env()
+        assert compiler.get_templating_env() is env
+        template = env.get_template(compiler.PIPELINE_TEMPLATE)
+        assert env.get_template(compiler.PIPELINE_TEMPLATE) is template
+        assert os.listdir(str(tmpdir))
+    finally:
+        compiler.get_templating_env.cache_clear()
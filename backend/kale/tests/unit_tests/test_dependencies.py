@@ -100,6 +100,78 @@ foo()
     assert sorted(pipeline.get_step("step3").outs) == []
 
 
+@pytest.mark.parametrize("analysis_workers", [2, None])
+def test_dependencies_detection_analysis_workers(notebook_processor,
+                                                 dummy_nb_config,
+                                                 monkeypatch,
+                                                 analysis_workers):
+    """Test dependencies detection with the steps analyzed in parallel."""
+    monkeypatch.setattr(notebook_processor, "analysis_workers",
+                        analysis_workers)
+    pipeline = Pipeline(dummy_nb_config)
+    pipeline.add_step(Step(name="step1", source=["a = 1\nb = 2"]))
+    pipeline.add_step(Step(name="step2", source=["def foo():\n"
+                                                 "    return a"]))
+    pipeline.add_step(Step(name="step3", source=["c = b", "foo()"]))
+    pipeline.add_edge("step1", "step2")
+    pipeline.add_edge("step2", "step3")
+
+    notebook_processor.pipeline = pipeline
+    notebook_processor.dependencies_detection()
+    assert sorted(pipeline.get_step("step1").outs) == ["a", "b"]
+    assert sorted(pipeline.get_step("step2").outs) == ["a", "foo"]
+    assert sorted(pipeline.get_step("step3").ins) == ["a", "b", "foo"]
+
+
+def test_dependencies_detection_ins_columns(notebook_processor,
+                                            dummy_nb_config):
+    """Test the detection of the columns that steps read from inputs."""
+    pipeline = Pipeline(dummy_nb_config)
+
+    _source = ["df = make_df()\nother = make_df()"]
+    pipeline.add_step(Step(name="step1", source=_source))
+    _source = ['''
+def foo():
+    return other["a"]
+print(df["a"], df[["b", "c"]], other["a"], foo())
+''']
+    pipeline.add_step(Step(name="step2", source=_source))
+    _source = ["print(df.head())"]
+    pipeline.add_step(Step(name="step3", source=_source))
+
+    pipeline.add_edge("step1", "step2")
+    pipeline.add_edge("step2", "step3")
+
+    notebook_processor.pipeline = pipeline
+    notebook_processor.dependencies_detection()
+    assert sorted(pipeline.get_step("step2").ins) == ["df", "other"]
+    # step3 reads `df` from step2, so step2 must restore it whole
+    assert pipeline.get_step("step2").ins_columns == {}
+    assert pipeline.get_step("step3").ins_columns == {}
+
+
+def test_dependencies_detection_ins_columns_projected(notebook_processor,
+                                                      dummy_nb_config):
+    """Test that steps restore just the columns they select."""
+    pipeline = Pipeline(dummy_nb_config)
+
+    _source = ["df = make_df()\nother = make_df()"]
+    pipeline.add_step(Step(name="step1", source=_source))
+    _source = ['''
+def foo():
+    return other["a"]
+print(df["a"], df[["b", "c"]], other["a"], foo())
+''']
+    pipeline.add_step(Step(name="step2", source=_source))
+
+    pipeline.add_edge("step1", "step2")
+
+    notebook_processor.pipeline = pipeline
+    notebook_processor.dependencies_detection()
+    # `other` is a free variable of `foo`, which might need it whole
+    assert pipeline.get_step("step2").ins_columns == {"df": ["a", "b", "c"]}
+
+
 def test_dependencies_detection_inner_function(notebook_processor,
                                                dummy_nb_config):
     """Test dependencies detection with inner functions."""
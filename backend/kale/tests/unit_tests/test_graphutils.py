@@ -39,3 +39,24 @@ def test_get_ordered_ancestors():
 
     ancs = ["C", "D", "E", "B", "A"]
     assert graphutils.get_ordered_ancestors(g, "R") == ancs
+
+
+def test_ancestor_index():
+    """Test the ancestors providing names, nearest first."""
+    g = nx.DiGraph()
+    g.add_edge("A", "B")
+    g.add_edge("B", "C")
+    g.add_edge("B", "D")
+    g.add_edge("C", "R")
+    g.add_edge("D", "R")
+    index = graphutils.AncestorIndex(g)
+    index.add_names("A", ["x", "y"], "outs")
+    index.add_names("D", ["x"], "outs")
+
+    assert list(index.iter_ancestors("R")) == ["C", "D", "B", "A"]
+    providers = index.get_providers(["y"], "outs")
+    assert list(index.iter_ancestors("R", providers)) == ["A"]
+    assert index.get_nearest_provider("R", "x", "outs") == "D"
+    assert index.get_nearest_provider("C", "x", "outs") == "A"
+    assert index.get_nearest_provider("A", "x", "outs") is None
+    assert index.get_nearest_provider("R", "z", "outs") is None
@@ -53,3 +53,101 @@ def test_run_code():
     # test magic command
     code = ("%%time\nprint('Some dull code')", )
     ju.run_code(code)
+
+
+@mock.patch('kale.common.jputils.process_outputs', new=lambda x: x)
+def test_run_code_kernel_pool():
+    """Test that pooled kernels are warmed up and never reused."""
+    with ju.KernelPool(size=1, warmup_code="import json") as pool:
+        cells = ju.run_code(("a = json.dumps(1)\nprint(a)", ),
+                            kernel_pool=pool)
+        assert cells[0].outputs[0]['text'] == "1\n"
+        cells = ju.run_code(("print('a' in dir())", ), kernel_pool=pool)
+        assert cells[0].outputs[0]['text'] == "False\n"
+
+
+@mock.patch('kale.common.jputils.process_outputs', new=lambda x: x)
+def test_run_code_shared_kernel_pool(monkeypatch):
+    """Test that warm kernels are started once the process ran code."""
+    monkeypatch.delenv(ju.KERNEL_POOL_SIZE_ENV, raising=False)
+    warmup = "import json"
+    code = ("print(json.dumps('a' in dir()))\na = 1", )
+    ju.run_code(code, warmup_code=warmup)
+    pool = ju.get_kernel_pool(warmup_code=warmup)
+    assert pool is ju.get_kernel_pool(warmup_code=warmup)
+    # code that runs once does not need a kernel in advance
+    assert not pool._kernels
+
+    ju.run_code(code, warmup_code=warmup)
+    assert len(pool._kernels) == ju.DEFAULT_KERNEL_POOL_SIZE
+    # started while the previous code ran
+    warm_km = pool._kernels[0][0]
+    with mock.patch.object(pool, "release", wraps=pool.release) as release:
+        cells = ju.run_code(code, warmup_code=warmup)
+    release.assert_called_once_with(warm_km)
+    assert cells[0].outputs[0]['text'] == "false\n"
+
+
+@mock.patch('kale.common.jputils.process_outputs', new=lambda x: x)
+def test_run_code_in_process():
+    """Test that the in-process engine collects the outputs of the cells."""
+    code = ("a = 3\nprint(a)",
+            "%%time\nb = a + 1",
+            "from IPython.display import HTML, display\n"
+            "display(HTML('<b>a</b>'))\nb")
+    cells = ju.run_code(code, engine=ju.IN_PROCESS_ENGINE)
+    assert cells[0].outputs == [
+        {'output_type': 'stream', 'name': 'stdout', 'text': '3\n'}]
+    assert cells[1].outputs[0]['text'].startswith("CPU times")
+    assert cells[2].outputs[0]['data']['text/html'] == '<b>a</b>'
+    assert cells[2].outputs[1]['data'] == {'text/plain': '4'}
+
+    with pytest.raises(SystemExit):
+        ju.run_code(("1 / 0", ), engine=ju.IN_PROCESS_ENGINE)
+
+
+def test_html_report_writer(tmpdir):
+    """Test that the report caps the streams and offloads the images."""
+    path = str(tmpdir.join("report.html"))
+    with ju.HTMLReportWriter(path, max_stream_size=10,
+                             images_dir=str(tmpdir.join("images"))) as report:
+        report.write_output({'output_type': 'stream', 'name': 'stdout',
+                             'text': "12345"})
+        report.write_output({'output_type': 'stream', 'name': 'stdout',
+                             'text': "67890abcde"})
+        report.write_output(_output_display({'image/png': "Ynl0ZXM=",
+                                             'text/plain': "title"})[0])
+    html = open(path).read()
+    assert ju.STREAM_HTML_TEMPLATE.format("1234567890") in html
+    assert "abcde" not in html
+    assert ju.TRUNCATED_STREAMS_HTML_TEMPLATE.format(10) in html
+    assert ju.IMAGE_FILE_HTML_TEMPLATE.format(
+        "title", "images/image-1.png") in html
+    assert tmpdir.join("images", "image-1.png").read_binary() == b"bytes"
+
+    with ju.HTMLReportWriter(path):
+        pass
+    assert open(path).read() == ju.HTML_TEMPLATE % ju.NO_ARTIFACTS_MESSAGE
+
+
+@pytest.mark.parametrize("engine", ju.RUN_CODE_ENGINES)
+def test_run_code_update_display(engine, tmpdir):
+    """Test that the updates of a display are written to the report."""
+    path = str(tmpdir.join("report.html"))
+    code = ("from IPython.display import display\n"
+            "display('first', display_id=True).update('second')", )
+    assert ju.run_code(code, engine=engine, html_report_path=path) == path
+    html = open(path).read()
+    assert "first" in html
+    assert "second" in html
+
+
+@pytest.mark.parametrize("engine", ju.RUN_CODE_ENGINES)
+def test_run_code_failure(engine, capsys):
+    """Test that the first error stops the code and fails the run."""
+    code = ("print('before')", "1 / 0", "print('after')")
+    with pytest.raises(SystemExit):
+        ju.run_code(code, engine=engine)
+    out, err = capsys.readouterr()
+    assert "before" in out and "after" not in out
+    assert "ZeroDivisionError" in err
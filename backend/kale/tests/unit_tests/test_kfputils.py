@@ -97,3 +97,21 @@ def test_update_uimetadata_from_not_empty(podutils, workflowutils, tmpdir):
         'source': 'minio://mlpipeline/artifacts/test_wk/test_pod/test.tgz'
     }]}
     assert updated == target
+
+
+def test_generate_mlpipeline_metrics_merge(tmpdir):
+    """Test that merged metrics keep the ones already in the file."""
+    filepath = os.path.join(tmpdir, 'mlpipeline-metrics.json')
+    with mock.patch.object(kfputils, 'KFP_UI_METRICS_FILE_PATH', filepath):
+        kfputils.generate_mlpipeline_metrics({'accuracy': 0.9, 'loss': 1})
+        kfputils.generate_mlpipeline_metrics({'loss': 2, 'size': 3},
+                                             merge=True)
+        with open(filepath) as f:
+            metrics = [(m['name'], m['numberValue'])
+                       for m in json.load(f)['metrics']]
+        assert metrics == [('accuracy', 0.9), ('loss', 2), ('size', 3)]
+
+        kfputils.generate_mlpipeline_metrics({'size': 4})
+        with open(filepath) as f:
+            assert json.load(f)['metrics'] == [
+                {'name': 'size', 'numberValue': 4, 'format': 'RAW'}]
@@ -0,0 +1,539 @@
+#  Copyright 2020 The Kale Authors
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#       http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+
+import os
+import json
+import math
+import itertools
+import multiprocessing
+import shutil
+
+import pytest
+
+from unittest import mock
+
+from kale import marshal, Pipeline, PipelineConfig, Step
+from kale.marshal.backend import (Dispatcher, MarshalBackend,
+                                  MANIFEST_FILENAME, MANIFEST_VERSION)
+
+
+@pytest.fixture
+def data_dir(tmp_path):
+    """Marshal into a temporary data dir, restoring the defaults after."""
+    marshal.set_data_dir(str(tmp_path))
+    yield str(tmp_path)
+    marshal.set_config()
+    marshal.set_data_dir(os.path.curdir)
+
+
+class _Base:
+    pass
+
+
+class _Child(_Base):
+    pass
+
+
+class _GrandChild(_Child):
+    pass
+
+
+class _BaseBackend(MarshalBackend):
+    name = "Base backend"
+    obj_type_regex = r".*test_marshal\._Base$"
+
+
+class _ChildBackend(MarshalBackend):
+    name = "Child backend"
+    obj_type_regex = r".*test_marshal\._Child$"
+
+
+def test_dispatch_obj_type_mro():
+    """Test that the closest matching class in the MRO wins."""
+    dispatcher = Dispatcher()
+    dispatcher.register(_BaseBackend)
+    assert dispatcher.get_backend(_GrandChild()).name == "Base backend"
+
+    # registering a new backend invalidates the types already resolved
+    dispatcher.register(_ChildBackend)
+    assert dispatcher.get_backend(_GrandChild()).name == "Child backend"
+    assert dispatcher.get_backend(_Base()).name == "Base backend"
+
+
+def test_dispatch_obj_type_default():
+    """Test that unmatched types fall back to the default backend."""
+    dispatcher = Dispatcher()
+    dispatcher.register(_BaseBackend)
+    assert type(dispatcher.get_backend(dict())) is MarshalBackend
+    assert type(dispatcher.get_backend(dict())) is MarshalBackend
+
+
+def test_dispatch_obj_type_too_many_backends():
+    """Test that ambiguous matches on the same class raise an error."""
+    class _AnyBackend(MarshalBackend):
+        obj_type_regex = r".*test_marshal\."
+
+    dispatcher = Dispatcher()
+    dispatcher.register(_BaseBackend)
+    dispatcher.register(_AnyBackend)
+    with pytest.raises(RuntimeError):
+        dispatcher.get_backend(_Base())
+
+
+def test_load_refreshes_index(data_dir):
+    """Test that objects saved after the index was built are found."""
+    marshal.save({"a": 1}, "first")
+    assert marshal.load("first") == {"a": 1}
+
+    # simulate a different process saving an object
+    MarshalBackend._default_save([1, 2], os.path.join(data_dir,
+                                                      "second.dillpkl"))
+    assert marshal.load("second") == [1, 2]
+
+
+def test_manifest(data_dir):
+    """Test that the manifest lets consumers skip scanning the data dir."""
+    marshal.set_config(write_manifest=True)
+    marshal.save({"a": 1}, "obj")
+    marshal.save(lambda x: x, "fn")
+
+    with open(os.path.join(data_dir, MANIFEST_FILENAME)) as f:
+        manifest = json.load(f)
+    assert manifest["objects"] == {
+        "obj": {"file": "obj.dillpkl", "backend": "MarshalBackend"},
+        "fn": {"file": "fn.pyfn", "backend": "FunctionBackend"}}
+
+    marshal.set_data_dir(data_dir)
+    with mock.patch.object(Dispatcher, "_scan_data_dir") as scan:
+        assert marshal.load("obj") == {"a": 1}
+        assert marshal.load("fn")(3) == 3
+    scan.assert_not_called()
+
+
+def test_manifest_kept_in_sync(data_dir):
+    """Test that an existing manifest is updated whatever the config."""
+    marshal.set_config(write_manifest=True)
+    marshal.save({"a": 1}, "obj")
+    marshal.save([1], "other")
+
+    # simulate new processes that do not write a manifest
+    marshal.set_config(write_manifest=False, compression="gzip")
+    marshal.set_data_dir(data_dir)
+    marshal.save({"a": 2}, "obj")
+
+    with open(os.path.join(data_dir, MANIFEST_FILENAME)) as f:
+        manifest = json.load(f)
+    assert manifest["objects"] == {
+        "obj": {"file": "obj.dillgz", "backend": "GzipBackend"},
+        "other": {"file": "other.dillpkl", "backend": "MarshalBackend"}}
+
+    marshal.set_data_dir(data_dir)
+    assert marshal.load("obj") == {"a": 2}
+
+
+def test_manifest_concurrent_saves(data_dir):
+    """Test that processes saving at the same time keep all the entries."""
+    marshal.set_config(write_manifest=True)
+    marshal.save(0, "obj0")
+
+    def _save(i):
+        marshal.set_data_dir(data_dir)
+        for j in range(10):
+            marshal.save(j, "obj%d-%d" % (i, j))
+
+    context = multiprocessing.get_context("fork")
+    processes = [context.Process(target=_save, args=(i,)) for i in range(4)]
+    for process in processes:
+        process.start()
+    for process in processes:
+        process.join()
+    assert all(process.exitcode == 0 for process in processes)
+
+    with open(os.path.join(data_dir, MANIFEST_FILENAME)) as f:
+        assert len(json.load(f)["objects"]) == 41
+
+
+def test_stale_manifest(data_dir):
+    """Test that the data dir is scanned if the manifest is stale."""
+    marshal.save({"a": 1}, "obj")
+    # e.g., written before the object was replaced by an older Kale version
+    with open(os.path.join(data_dir, MANIFEST_FILENAME), "w") as f:
+        json.dump({"version": MANIFEST_VERSION, "objects": {
+            "obj": {"file": "obj.pyfn", "backend": "FunctionBackend"}}}, f)
+    marshal.set_data_dir(data_dir)
+    assert marshal.load("obj") == {"a": 1}
+
+
+@pytest.mark.parametrize("max_workers", [1, 4])
+def test_save_load_all(data_dir, max_workers):
+    """Test saving and loading multiple objects at once."""
+    marshal.set_config(max_workers=max_workers)
+    objs = {"obj%d" % i: list(range(i)) for i in range(8)}
+    paths = marshal.save_all(objs)
+    assert sorted(paths) == sorted(objs)
+    assert marshal.load_all(list(objs)) == objs
+
+
+def test_load_all_failure(data_dir):
+    """Test that a failing object makes the whole batch fail."""
+    marshal.set_config(max_workers=4)
+    marshal.save_all({"a": 1, "b": 2})
+    with pytest.raises(SystemExit):
+        marshal.load_all(["a", "missing", "b"])
+
+
+@pytest.mark.parametrize("config,mmapped", [
+    ({}, False),
+    ({"numpy_mmap_threshold": 1}, True),
+    ({"numpy_mmap_threshold": 1, "numpy_mmap_mode": "off"}, False),
+])
+def test_numpy_mmap(data_dir, config, mmapped):
+    """Test that large arrays are memory-mapped when loaded."""
+    np = pytest.importorskip("numpy")
+    marshal.set_config(**config)
+    arr = np.arange(1000).reshape(10, 100)
+    marshal.save(arr, "arr")
+    loaded = marshal.load("arr")
+    assert isinstance(loaded, np.memmap) == mmapped
+    assert (loaded == arr).all()
+
+
+def test_pandas_parquet(data_dir):
+    """Test that DataFrames are stored to Parquet and partially restored."""
+    pd = pytest.importorskip("pandas")
+    pytest.importorskip("pyarrow")
+    df = pd.DataFrame({"a": [1, 2], "b": ["x", "y"], "c": [.1, .2]},
+                      index=pd.Index([3, 4], name="idx"))
+    assert marshal.save(df, "df").endswith("df.parquet")
+    pd.testing.assert_frame_equal(marshal.load("df"), df)
+    pd.testing.assert_frame_equal(
+        marshal.load_all(["df"], columns={"df": ["c", "a"]})["df"],
+        df[["c", "a"]])
+    # unknown columns fall back to restoring the whole frame
+    pd.testing.assert_frame_equal(marshal.load("df", columns=["z"]), df)
+
+
+@pytest.mark.parametrize("data", [
+    {1: [1, 2]},  # non-string column names
+    {"a": [1, "x"]},  # mixed types
+])
+def test_pandas_parquet_fallback(data_dir, data):
+    """Test that DataFrames that Parquet can't store are pickled."""
+    pd = pytest.importorskip("pandas")
+    pytest.importorskip("pyarrow")
+    df = pd.DataFrame(data)
+    assert marshal.save(df, "df").endswith("df.pdpkl")
+    assert os.listdir(data_dir) == ["df.pdpkl"]
+    pd.testing.assert_frame_equal(marshal.load("df", columns=["a"]), df)
+
+
+@pytest.mark.parametrize("compression,library,file_type", [
+    ("gzip", "gzip", "dillgz"),
+    ("lz4", "lz4", "dilllz4"),
+    ("zstd", "zstandard", "dillzst"),
+])
+def test_compression(data_dir, compression, library, file_type):
+    """Test that generic objects are compressed with the selected codec."""
+    pytest.importorskip(library)
+    marshal.set_config(compression=compression, compression_level=1)
+    obj = {"a": list(range(1000))}
+    assert marshal.save(obj, "obj").endswith("obj." + file_type)
+    # the codec is inferred from the file type, regardless of the config
+    marshal.set_config()
+    assert marshal.load("obj") == obj
+
+
+def test_compression_auto(data_dir):
+    """Test that just large objects are compressed."""
+    marshal.set_config(compression="auto")
+    assert marshal.save([1, 2], "small").endswith(".dillpkl")
+
+    with mock.patch("kale.marshal.backends.LZ4Backend.is_available",
+                    return_value=False), \
+            mock.patch("kale.marshal.backends.ZstdBackend.is_available",
+                       return_value=False):
+        path = marshal.save(["x" * 1024] * 2048, "large")
+    assert path.endswith(".dillgz")
+    assert marshal.load("large") == ["x" * 1024] * 2048
+
+
+def test_compression_missing_lib(data_dir):
+    """Test that codecs whose library is missing are not used."""
+    marshal.set_config(compression="zstd")
+    with mock.patch("kale.marshal.backends.ZstdBackend.is_available",
+                    return_value=False):
+        assert marshal.save([1, 2], "obj").endswith(".dillpkl")
+
+
+def test_step_marshal_config():
+    """Test that steps override the pipeline's marshal config."""
+    config = PipelineConfig(pipeline_name="test", experiment_name="test",
+                            marshal_config={"compression": "gzip",
+                                            "max_workers": 2})
+    pipeline = Pipeline(config)
+    step = Step(name="step", source=[""],
+                marshal_config={"compression": "zstd"})
+    marshal_config = pipeline.get_marshal_config(step)
+    assert marshal_config["compression"] == "zstd"
+    assert marshal_config["max_workers"] == 2
+
+    with pytest.raises(ValueError):
+        Step(name="step", source=[""], marshal_config={"compression": "x"})
+
+
+def test_out_of_band(data_dir):
+    """Test that large buffers are stored in files that are memory-mapped."""
+    np = pytest.importorskip("numpy")
+    marshal.set_config(out_of_band=True, out_of_band_min_size=1024)
+    arr = np.arange(1024)
+    obj = {"arr": arr, "same_arr": arr, "small": np.arange(4),
+           "transposed": np.ones((256, 2)).T, "fn": lambda x: x}
+    path = marshal.save(obj, "obj")
+    assert sorted(os.listdir(path)) == ["0.buf", "1.buf", "object.pkl"]
+
+    loaded = marshal.load("obj")
+    assert loaded["arr"] is loaded["same_arr"]
+    assert (loaded["arr"] == arr).all()
+    assert (loaded["small"] == obj["small"]).all()
+    assert (loaded["transposed"] == obj["transposed"]).all()
+    assert loaded["fn"](3) == 3
+    # buffers are mapped copy-on-write
+    loaded["arr"][0] = 42
+    assert (marshal.load("obj")["arr"] == arr).all()
+
+    # saving again replaces the previous buffers
+    marshal.save({"arr": arr}, "obj")
+    assert sorted(os.listdir(path)) == ["0.buf", "object.pkl"]
+
+
+def test_content_store(data_dir, tmp_path_factory):
+    """Test that equal objects are stored once and linked by name."""
+    np = pytest.importorskip("numpy")
+    store_dir = str(tmp_path_factory.mktemp("store"))
+    marshal.set_config(content_store=True, content_store_dir=store_dir,
+                       out_of_band=True, out_of_band_min_size=1024)
+    marshal.save_all({"a": {"x": 1}, "b": {"x": 1}, "c": {"x": 2}})
+    assert len(os.listdir(store_dir)) == 2
+    # folders are stored as well
+    marshal.save({"arr": np.arange(1024)}, "d")
+    marshal.save({"arr": np.arange(1024)}, "e")
+    assert len(os.listdir(store_dir)) == 3
+    assert os.path.islink(os.path.join(data_dir, "e.dilloob"))
+
+    # saving a different object with the same name leaves the store intact
+    marshal.set_config(content_store=True, content_store_dir=store_dir)
+    marshal.save({"x": 3}, "b")
+    marshal.save([1], "d")
+    assert marshal.load_all(["a", "b", "c", "d"]) == {
+        "a": {"x": 1}, "b": {"x": 3}, "c": {"x": 2}, "d": [1]}
+    assert (marshal.load("e")["arr"] == np.arange(1024)).all()
+    assert len(os.listdir(store_dir)) == 5
+
+
+def test_save_replaces_previous_entries(data_dir):
+    """Test that saving with a different backend replaces the old file."""
+    marshal.set_config(compression="gzip")
+    marshal.save([1], "obj")
+    marshal.set_config()
+    marshal.save([2], "obj")
+    assert os.listdir(data_dir) == ["obj.dillpkl"]
+    assert marshal.load("obj") == [2]
+
+
+def test_lazy_load(data_dir):
+    """Test that objects are restored on first use, just once."""
+    marshal.save({"x": 1}, "obj")
+    marshal.set_config(lazy_load=True)
+    with mock.patch.object(MarshalBackend, "load", autospec=True,
+                           side_effect=MarshalBackend.load) as load:
+        obj = marshal.load_all(["obj"])["obj"]
+        assert type(obj) is marshal.LazyObject
+        load.assert_not_called()
+        assert isinstance(obj, dict)
+        assert obj["x"] == 1
+        assert obj == {"x": 1}
+        obj["y"] = 2
+        load.assert_called_once()
+    # Saving a proxy saves the restored object
+    marshal.save(obj, "other")
+    assert os.path.exists(os.path.join(data_dir, "other.dillpkl"))
+    marshal.set_config()
+    assert marshal.load("other") == {"x": 1, "y": 2}
+    with pytest.raises(SystemExit):
+        marshal.load("missing")
+
+
+@pytest.mark.parametrize("value,use,target", [
+    (3.14159, lambda x: f"{x:.2f}", "3.14"),
+    (3, lambda x: list(range(x)), [0, 1, 2]),
+    ("2.5", lambda x: float(x), 2.5),
+    (2.7, lambda x: int(x), 2),
+    (2.567, lambda x: round(x, 2), 2.57),
+    (2.5, lambda x: math.floor(x), 2),
+    (1, lambda x: ["a", "b"][x], "b"),
+    (7, lambda x: divmod(x, 2), (3, 1)),
+    (7, lambda x: divmod(15, x), (2, 1)),
+    (1, lambda x: x << 2, 4),
+    ([1, 2], lambda x: list(reversed(x)), [2, 1]),
+])
+def test_lazy_object_special_methods(value, use, target):
+    """Test that the common uses of scalars and builtins are forwarded."""
+    assert use(marshal.LazyObject(lambda: value)) == target
+
+
+def test_lazy_object_in_place_and_context():
+    """Test in-place operators and context managers on restored objects."""
+    lst = [1]
+    proxy = marshal.LazyObject(lambda: lst)
+    proxy += [2]
+    assert proxy is lst and lst == [1, 2]
+    count = marshal.LazyObject(lambda: 1)
+    count += 1
+    assert count == 2 and type(count) is int
+
+    manager = mock.MagicMock()
+    with marshal.LazyObject(lambda: manager) as entered:
+        assert entered is manager.__enter__.return_value
+    manager.__exit__.assert_called_once_with(None, None, None)
+
+
+def test_xgboost_legacy_file_type():
+    """Test that legacy XGBoost models are restored but never saved."""
+    dispatcher = marshal.backend.get_dispatcher()
+    assert (dispatcher._dispatch_file_type("model.bst").name
+            == "XGBoost legacy Model backend")
+    assert (dispatcher._dispatch_file_type("model.ubj").name
+            == "XGBoost Model backend")
+
+
+def test_pytorch(data_dir):
+    """Test that modules defined in the notebook and tensors round trip."""
+    torch = pytest.importorskip("torch")
+
+    class _Net(torch.nn.Module):
+        def __init__(self):
+            super().__init__()
+            self.linear = torch.nn.Linear(4, 2)
+
+        def forward(self, x):
+            return self.linear(x)
+
+    net, x = _Net(), torch.ones(3, 4)
+    marshal.save_all({"net": net, "x": x})
+    assert sorted(os.listdir(data_dir)) == ["net.pt", "x.pt"]
+    loaded = marshal.load_all(["net", "x"])
+    assert torch.equal(loaded["x"], x)
+    assert torch.equal(loaded["net"](x), net(x))
+
+
+@pytest.mark.parametrize("signature,kwargs", [
+    (lambda f, pickle_module=None: None, {}),
+    (lambda f, pickle_module=None, weights_only=None: None,
+     {"weights_only": False}),
+    (lambda f, pickle_module=None, weights_only=None, mmap=None: None,
+     {"weights_only": False, "mmap": True}),
+])
+def test_pytorch_load_versions(signature, kwargs):
+    """Test that restoring modules fits the `torch.load` of older versions."""
+    torch = mock.MagicMock()
+    torch.load = mock.create_autospec(signature, side_effect=TypeError)
+    with mock.patch.dict("sys.modules", {"torch": torch}):
+        backend = marshal.get_backend_by_name("PyTorchBackend")
+        # errors while unpickling are not mistaken for an older version
+        with pytest.raises(TypeError):
+            backend.load("model.pt")
+    torch.load.assert_called_once_with("model.pt", pickle_module=mock.ANY,
+                                       **kwargs)
+
+
+@pytest.mark.parametrize("make_iterator", [
+    lambda: ({"i": i} for i in range(5)),
+    lambda: iter([{"i": i} for i in range(5)]),
+    lambda: map(lambda i: {"i": i}, range(5)),
+])
+def test_stream(data_dir, make_iterator):
+    """Test that iterators are saved in chunks and restored lazily."""
+    marshal.set_config(stream_chunk_size=2)
+    marshal.save(make_iterator(), "records")
+    assert os.listdir(data_dir) == ["records.dillstream"]
+    restored = marshal.load("records")
+    assert next(restored) == {"i": 0}
+    assert list(restored) == [{"i": i} for i in range(1, 5)]
+
+
+@pytest.mark.parametrize("make_iterator", [
+    lambda: itertools.count(3),
+    lambda: itertools.cycle([1, 2]),
+    lambda: itertools.repeat(1),
+])
+def test_stream_infinite(data_dir, make_iterator):
+    """Test that infinite iterators are not streamed."""
+    marshal.save(make_iterator(), "it")
+    assert os.listdir(data_dir) == ["it.dillpkl"]
+    assert next(marshal.load("it")) == next(make_iterator())
+
+
+def test_stats_report(data_dir):
+    """Test that the I/O of every object is summarized per step."""
+    marshal.set_config(stats_report=True)
+    marshal.save_all({"a": list(range(1000)), "b": "b"})
+    marshal.load("a")
+    marshal.report_stats("step")
+    with open(os.path.join(data_dir, ".kale.stats", "step.json")) as f:
+        summary = json.load(f)
+    assert (sorted((r["name"], r["operation"]) for r in summary["objects"])
+            == [("a", "load"), ("a", "save"), ("b", "save")])
+    assert summary["totals"]["save"]["count"] == 2
+    assert (summary["totals"]["load"]["size"]
+            == os.path.getsize(os.path.join(data_dir, "a.dillpkl")))
+    assert all(r["backend"] == "Default backend" for r in summary["objects"])
+    # Reported records are not reported again
+    assert marshal.stats.get_records() == []
+
+
+def test_remote_data_dir(tmp_path):
+    """Test marshalling to an object store, standing in with a folder."""
+    np = pytest.importorskip("numpy")
+    remote_dir = tmp_path / "bucket"
+    marshal.set_data_dir("file://%s/run" % remote_dir)
+    try:
+        marshal.set_config(remote_multipart_threshold=1024,
+                           remote_chunk_size=1000, remote_max_concurrency=4,
+                           out_of_band=True, out_of_band_min_size=1)
+        arr = np.arange(1000)
+        marshal.save_all({"arr": arr, "obj": {"arr": arr}})
+        assert sorted(os.listdir(remote_dir / "run")) == [
+            "arr.npy", "obj.dilloob"]
+        assert os.path.getsize(remote_dir / "run" / "arr.npy") > 1024
+        # Another step, starting from an empty staging dir
+        shutil.rmtree(marshal.get_data_dir())
+        marshal.set_data_dir("file://%s/run/" % remote_dir)
+        loaded = marshal.load_all(["arr", "obj"])
+        assert (loaded["arr"] == arr).all()
+        assert (loaded["obj"]["arr"] == arr).all()
+        marshal.set_config(stats_report=True)
+        marshal.save([1], "obj")
+        assert sorted(os.listdir(remote_dir / "run")) == [
+            "arr.npy", "obj.dillpkl"]
+        # The report is uploaded, but never listed as an object
+        marshal.report_stats("step")
+        with open(remote_dir / "run" / ".kale.stats" / "step.json") as f:
+            assert json.load(f)["totals"]["save"]["count"] == 1
+        shutil.rmtree(marshal.get_data_dir())
+        marshal.set_data_dir("file://%s/run/" % remote_dir)
+        assert marshal.load("obj") == [1]
+    finally:
+        shutil.rmtree(marshal.get_data_dir())
+        marshal.set_config()
+        marshal.set_data_dir(os.path.curdir)
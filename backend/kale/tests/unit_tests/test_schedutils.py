@@ -0,0 +1,126 @@
+#  Copyright 2020 The Kale Authors
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#       http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+
+import os
+import time
+
+import pytest
+
+from kale import marshal, Pipeline, PipelineConfig, Step
+from kale.common import schedutils
+
+
+def _diamond(dummy_nb_config, limits=None):
+    pipeline = Pipeline(dummy_nb_config)
+    steps = {name: Step(source=lambda: None, name=name,
+                        limits=limits or {})
+             for name in "abcd"}
+    for step in steps.values():
+        pipeline.add_step(step)
+    for parent, child in ["ab", "ac", "bd", "cd"]:
+        pipeline.add_dependency(steps[parent], steps[child])
+    return pipeline
+
+
+def _run_step(tmp_path):
+    def _run(step):
+        start = time.time()
+        if step.name in "bc":
+            time.sleep(.5)
+        print("ran", step.name)
+        if step.name == "c" and (tmp_path / "fail").exists():
+            raise RuntimeError("failed")
+        (tmp_path / step.name).write_text("%f %f" % (start, time.time()))
+    return _run
+
+
+def _get_times(tmp_path, name):
+    return [float(t) for t in (tmp_path / name).read_text().split()]
+
+
+@pytest.mark.parametrize("quantity,value", [
+    ("2", 2), ("500m", .5), ("1.5", 1.5), ("4Gi", 4 * 2 ** 30),
+    ("1k", 1000),
+])
+def test_parse_quantity(quantity, value):
+    """Test the parsing of K8s resource quantities."""
+    assert schedutils.parse_quantity(quantity) == value
+
+
+def test_local_scheduler(dummy_nb_config, tmp_path, capfd):
+    """Test that independent steps run at the same time."""
+    scheduler = schedutils.LocalScheduler(
+        _diamond(dummy_nb_config), _run_step(tmp_path), max_parallelism=2)
+    scheduler.run()
+    a, b, c, d = (_get_times(tmp_path, name) for name in "abcd")
+    assert a[1] <= min(b[0], c[0])
+    assert b[0] < c[1] and c[0] < b[1]
+    assert max(b[1], c[1]) <= d[0]
+    out, _ = capfd.readouterr()
+    assert all("[%s] ran %s\n" % (name, name) in out for name in "abcd")
+
+
+def test_local_scheduler_limits(dummy_nb_config, tmp_path):
+    """Test that steps run one by one when they need all the CPUs."""
+    scheduler = schedutils.LocalScheduler(
+        _diamond(dummy_nb_config, limits={"cpu": "2"}), _run_step(tmp_path),
+        max_parallelism=2, resources={"cpu": 1})
+    scheduler.run()
+    b, c = _get_times(tmp_path, "b"), _get_times(tmp_path, "c")
+    assert b[1] <= c[0] or c[1] <= b[0]
+
+
+def test_local_scheduler_failure(dummy_nb_config, tmp_path):
+    """Test that the children of failed steps do not run."""
+    (tmp_path / "fail").touch()
+    scheduler = schedutils.LocalScheduler(
+        _diamond(dummy_nb_config), _run_step(tmp_path), max_parallelism=2)
+    with pytest.raises(RuntimeError, match="steps failed: c"):
+        scheduler.run()
+    assert (tmp_path / "b").exists()
+    assert not (tmp_path / "d").exists()
+
+
+def test_local_scheduler_kernel_pools(dummy_nb_config, tmp_path,
+                                      monkeypatch):
+    """Test that steps shut down the kernels they started in advance."""
+    from kale.common import jputils
+
+    def _shutdown():
+        (tmp_path / ("shutdown-%d" % os.getpid())).touch()
+
+    monkeypatch.setattr(jputils, "shutdown_kernel_pools", _shutdown)
+    (tmp_path / "fail").touch()
+    scheduler = schedutils.LocalScheduler(
+        _diamond(dummy_nb_config), _run_step(tmp_path), max_parallelism=2)
+    with pytest.raises(RuntimeError):
+        scheduler.run()
+    # steps a, b and the failed c
+    assert len(list(tmp_path.glob("shutdown-*"))) == 3
+
+
+def test_pipeline_run_failure(tmp_path, monkeypatch):
+    """Test that a failed run does not keep the marshal config of a step."""
+    monkeypatch.chdir(tmp_path)
+    pipeline = Pipeline(PipelineConfig(pipeline_name="test",
+                                       experiment_name="test"))
+
+    def _fail():
+        raise RuntimeError("failed")
+
+    pipeline.add_step(Step(source=_fail, name="a",
+                           marshal_config={"compression": "gzip"}))
+    with pytest.raises(RuntimeError):
+        pipeline.run()
+    assert marshal.get_config().compression == "none"
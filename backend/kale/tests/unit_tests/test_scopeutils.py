@@ -0,0 +1,98 @@
+#  Copyright 2020 The Kale Authors
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#       http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+
+import pytest
+
+from kale.common import astutils, flakeutils, scopeutils
+
+# PyFlakes reports the same undefined names
+_CODE = [
+    "",
+    "a = b",
+    "def f(a=b):\n    return a + c\nc = 1",
+    "class A:\n    x = 1\n    def f(self):\n        return x",
+    "class A:\n    x = 1\n    y = [x for _ in range(3)]",
+    "class A:\n    x = 1\n    y = [i for i in x]",
+    "class A:\n    print(__module__, __class__)\n    def f(self):\n"
+    "        return __class__, __qualname__",
+    "try:\n    a\nexcept NameError:\n    b",
+    "try:\n    a\nexcept (ValueError, NameError):\n    pass",
+    "try:\n    pass\nexcept Exception as e:\n    pass\nprint(e)",
+    "if c:\n    del a",
+    "a = 1\ndel a\nprint(a)",
+    "print(g)\ndef f():\n    global g\n    g = 1",
+    "x: int\nprint(x)",
+    "from __future__ import annotations\nx: int\ndef f(y: 'x'): pass",
+    "def f(y: 'Q') -> List['R']: pass",
+    "def f(y: Literal['Q'], z: Annotated[int, 'R']): pass",
+    "from typing import NamedTuple\nT = NamedTuple('T', [('a', 'A')])",
+    "__all__ = ['a', 'b'] + ['c']\na = 1",
+    "from os import *\nprint(a)",
+    "[y := 1 for i in range(3)]\nprint(y)",
+    "(lambda a: a + b)(1)",
+    "x = 1\nx += y\nz += 1",
+    "match p:\n    case {'a': 1, **rest}:\n        print(rest)\n"
+    "    case [1, *others]:\n        print(others)\n"
+    "    case Point(x=px) as pt:\n        print(px, pt, q)",
+    "async def f():\n    await g()\n    async for i in h():\n        pass",
+    "def f():\n    def g():\n        return h\n    return g\nh = 1",
+    "def f(x, /, y, *, z):\n    return x + y + z + w",
+]
+
+# The free variables of the functions, in the context of some imports and
+# functions
+_PRELUDE = "import os\nfrom math import *\n"
+_CONTEXT = "import os\n\ndef helper():\n    return x\n"
+_FUNCTIONS = [
+    "x = 5\ndef foo():\n    print(math.sqrt(x), os.sep, helper())",
+    "def foo(a=b):\n    return a + c\nb = c = 1",
+    "try:\n    def foo(a=b):\n        return a\nexcept NameError:\n    pass",
+    "def foo():\n    try:\n        a\n    except NameError:\n        pass\n"
+    "    return b",
+    "def foo():\n    global x\n    x = 1\n    return y",
+    "class A:\n    def bar(self):\n        return a\ndef foo():\n    return A",
+    "async def outer():\n    x = 1\n    def foo():\n        return x",
+    "def foo():\n    return foo()",
+]
+
+
+@pytest.mark.parametrize("code", _CODE)
+def test_analyze(code):
+    """Test that the undefined names are the ones PyFlakes reports."""
+    assert (scopeutils.analyze(code).undefined
+            == flakeutils.pyflakes_report(code))
+
+
+@pytest.mark.parametrize("context", ["", _CONTEXT, _PRELUDE])
+@pytest.mark.parametrize("code", _FUNCTIONS)
+def test_get_free_variables(code, context):
+    """Test that functions miss the names PyFlakes reports after context."""
+    free_vars = scopeutils.get_free_variables(scopeutils.analyze(code),
+                                              scopeutils.analyze(context))
+    fns = astutils.parse_functions(code)
+    assert free_vars.keys() == fns.keys()
+    for fn_name, fn in fns.items():
+        assert free_vars[fn_name] == flakeutils.pyflakes_report(
+            context + "\n" + fn)
+
+
+def test_analyze_functions():
+    """Test the names of the global functions."""
+    report = scopeutils.analyze(
+        "def foo(a):\n    global b\n    b = a + c\n    return len(d)\n"
+        "class A:\n    def bar(self):\n        return e\n")
+    assert report.functions == {"foo": scopeutils.FunctionNames(
+        globals_used={"c", "d"}, globals_declared={"b"})}
+    assert {"foo", "A", "b"} <= report.defined
+    assert report.undefined == {"c", "d", "e"}
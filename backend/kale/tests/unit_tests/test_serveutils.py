@@ -0,0 +1,50 @@
+#  Copyright 2020 The Kale Authors
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#       http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+
+import os
+
+import pytest
+
+from testfixtures import mock
+
+from kale import marshal
+from kale.common import serveutils
+
+
+@mock.patch('kale.common.serveutils.utils.rm_r')
+@mock.patch('kale.common.serveutils.create_inference_service')
+@mock.patch('kale.common.serveutils.rokutils')
+@mock.patch('kale.common.serveutils.podutils')
+def test_serve_xgboost(podutils, rokutils, create_inference_service, rm_r,
+                       tmpdir):
+    """Test that XGBoost models are served as `model.bst` files."""
+    xgb = pytest.importorskip("xgboost")
+    np = pytest.importorskip("numpy")
+
+    data = xgb.DMatrix(np.random.rand(10, 3), label=np.arange(10) % 2)
+    model = xgb.train({"objective": "binary:logistic"}, data, 2)
+    # marshalled models use the UBJSON format
+    marshal.set_data_dir(str(tmpdir))
+    assert marshal.save(model, "model").endswith("model.ubj")
+
+    model_dir = os.path.join(str(tmpdir), "serve")
+    with mock.patch.object(serveutils, "PREDICTOR_MODEL_DIR", model_dir):
+        serveutils.serve(model, name="test", wait=False)
+
+    model_path = os.path.join(model_dir, "model.bst")
+    rm_r.assert_any_call(model_path)
+    assert (create_inference_service.call_args.kwargs["predictor"]
+            == "xgboost")
+    served = xgb.Booster(model_file=model_path)
+    assert np.allclose(served.predict(data), model.predict(data))